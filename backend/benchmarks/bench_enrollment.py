@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+选课开放瞬间的并发基准测试
+
+在进程内通过 ASGI 调用 /students/courses/{id}/enroll 和 /drop，使用临时 SQLite 数据库。
+所有学生同时抢同一门课程，统计吞吐量、延迟和状态码分布，并检查：
+  - 正式选课人数不超过课程容量，没有重复选课
+  - 候补人数不超过上限，排队位置连续且不重复
+  - 退课后按排队顺序递补，递补后人数仍等于容量
+任一检查失败时以非零状态退出。
+
+用法: python benchmarks/bench_enrollment.py --students 2000 --capacity 100 --drops 20
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import get_db
+from models import Base, User, UserRole, Student, Course, Enrollment
+from routers import students
+from routers.auth import issue_access_token
+from serice.enrollment_service import STATUS_ACTIVE, STATUS_WAITLISTED, WAITLIST_LIMIT
+
+
+def build_app(db_path):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(students.router, prefix="/students")
+    app.dependency_overrides[get_db] = override_get_db
+    return app, session_factory
+
+
+def seed(session_factory, student_count, capacity):
+    """创建学生和一门容量为 capacity 的课程，返回 (课程ID, [(student.id, 令牌)])"""
+    db = session_factory()
+    try:
+        db.execute(insert(User), [
+            {
+                "id": i + 1, "username": f"enroll{i:05d}", "email": f"enroll{i:05d}@bench.local",
+                "password_hash": "-", "full_name": f"选课学生{i}", "role": UserRole.STUDENT,
+                "is_active": True, "token_version": 0
+            }
+            for i in range(student_count)
+        ])
+        db.execute(insert(Student), [
+            {"id": i + 1, "user_id": i + 1, "student_id": f"E{i:07d}"} for i in range(student_count)
+        ])
+        course = Course(name="热门课程", code="HOT101", credits=3, max_students=capacity, is_active=True)
+        db.add(course)
+        db.commit()
+
+        tokens = [
+            (user.id, issue_access_token(user, user.id))
+            for user in db.query(User).order_by(User.id)
+        ]
+        return course.id, tokens
+    finally:
+        db.close()
+
+
+async def fire(client, path, tokens):
+    """所有请求同时发出，返回 [(student.id, 状态码, 响应, 延迟ms)] 和总耗时"""
+    results = []
+
+    async def call(student_id, token):
+        start = time.perf_counter()
+        response = await client.post(path, headers={"Authorization": f"Bearer {token}"})
+        results.append((student_id, response.status_code, response.json(), (time.perf_counter() - start) * 1000))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call(student_id, token) for student_id, token in tokens))
+    return results, time.perf_counter() - start
+
+
+def report(label, results, elapsed):
+    latencies = sorted(latency for _, _, _, latency in results)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    codes = Counter(code for _, code, _, _ in results)
+    print(f"\n=== {label} ===")
+    print(f"请求数: {len(results)}, 总耗时: {elapsed:.2f}s, 吞吐量: {len(results) / elapsed:.1f} 次/秒")
+    print(f"延迟 p50: {statistics.median(latencies):.1f}ms, p95: {percentile(0.95):.1f}ms, p99: {percentile(0.99):.1f}ms")
+    print(f"状态码: {dict(sorted(codes.items()))}")
+
+
+def check(failures, condition, message):
+    print(f"  [{'OK' if condition else 'FAIL'}] {message}")
+    if not condition:
+        failures.append(message)
+
+
+def snapshot(session_factory, course_id):
+    db = session_factory()
+    try:
+        rows = db.query(Enrollment.id, Enrollment.student_id, Enrollment.status).filter(
+            Enrollment.course_id == course_id
+        ).order_by(Enrollment.id).all()
+        duplicates = db.query(func.count()).select_from(
+            db.query(Enrollment.student_id).filter(
+                Enrollment.course_id == course_id,
+                Enrollment.status.in_([STATUS_ACTIVE, STATUS_WAITLISTED])
+            ).group_by(Enrollment.student_id).having(func.count(Enrollment.id) > 1).subquery()
+        ).scalar()
+    finally:
+        db.close()
+    active = [student_id for _, student_id, status in rows if status == STATUS_ACTIVE]
+    waitlist = [student_id for _, student_id, status in rows if status == STATUS_WAITLISTED]
+    return active, waitlist, duplicates
+
+
+async def main(student_count, capacity, drops):
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app, session_factory = build_app(os.path.join(tmp_dir, "bench_enrollment.db"))
+        course_id, tokens = seed(session_factory, student_count, capacity)
+        expected_active = min(student_count, capacity)
+        expected_waitlist = min(student_count - expected_active, WAITLIST_LIMIT)
+
+        async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+            # 第一轮：全部学生同时选课
+            results, elapsed = await fire(client, f"/students/courses/{course_id}/enroll", tokens)
+            report(f"{student_count} 名学生同时抢 {capacity} 个名额", results, elapsed)
+
+            active, waitlist, duplicates = snapshot(session_factory, course_id)
+            busy = sum(1 for _, code, _, _ in results if code == 503)
+            positions = sorted(
+                body["waitlist_position"] for _, code, body, _ in results
+                if code == 200 and body["status"] == STATUS_WAITLISTED
+            )
+            check(failures, len(active) <= capacity, f"正式选课 {len(active)} 人，不超过容量 {capacity}")
+            check(failures, duplicates == 0, f"重复选课 {duplicates} 人")
+            check(failures, len(waitlist) <= WAITLIST_LIMIT, f"候补 {len(waitlist)} 人，不超过上限 {WAITLIST_LIMIT}")
+            check(failures, positions == list(range(1, len(positions) + 1)), "候补位置连续且不重复")
+            if busy == 0:
+                check(failures, len(active) == expected_active, f"名额全部用完（预期 {expected_active}）")
+                check(failures, len(waitlist) == expected_waitlist, f"候补人数符合预期（{expected_waitlist}）")
+            else:
+                print(f"  {busy} 个请求等待写锁超时（503，客户端应重试）")
+
+            # 第二轮：部分正式选课的学生同时退课，候补按顺序递补
+            dropping = set(active[:drops])
+            results, elapsed = await fire(
+                client, f"/students/courses/{course_id}/drop",
+                [(student_id, token) for student_id, token in tokens if student_id in dropping]
+            )
+            report(f"{len(dropping)} 名学生同时退课", results, elapsed)
+
+            dropped = sum(1 for _, code, _, _ in results if code == 200)
+            promoted_expected = waitlist[:min(dropped, len(waitlist))]
+            active_after, waitlist_after, duplicates = snapshot(session_factory, course_id)
+            check(failures, len(active_after) <= capacity, f"退课后正式选课 {len(active_after)} 人，不超过容量")
+            check(failures, set(promoted_expected) <= set(active_after), f"按排队顺序递补了前 {len(promoted_expected)} 名候补")
+            check(failures, waitlist_after == waitlist[len(promoted_expected):], "剩余候补顺序不变")
+            check(failures, duplicates == 0, f"重复选课 {duplicates} 人")
+
+    if failures:
+        print(f"\n{len(failures)} 项检查失败")
+        sys.exit(1)
+    print("\n全部检查通过")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="选课并发基准测试")
+    parser.add_argument("--students", type=int, default=2000, help="同时选课的学生数")
+    parser.add_argument("--capacity", type=int, default=100, help="课程容量")
+    parser.add_argument("--drops", type=int, default=20, help="第二轮同时退课的人数")
+    args = parser.parse_args()
+    asyncio.run(main(args.students, args.capacity, args.drops))
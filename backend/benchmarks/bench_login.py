@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+登录吞吐量基准测试
+
+在进程内通过 ASGI 直接调用 /auth/login，使用临时 SQLite 数据库，
+分别测量旧 SHA-256 哈希首次登录（含升级）和 bcrypt 哈希登录的吞吐量，
+同时记录并发登录期间的事件循环延迟，验证 KDF 没有阻塞事件循环。
+
+用法: python benchmarks/bench_login.py --users 32 --concurrency 8
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import hashlib
+import statistics
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import get_db
+from models import Base, User, UserRole
+from routers import auth
+from security import identify_hash
+
+PASSWORD = "benchmark123"
+
+
+def build_app(db_path):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(auth.router, prefix="/auth")
+    app.dependency_overrides[get_db] = override_get_db
+    return app, session_factory
+
+
+def seed_users(session_factory, count):
+    legacy_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    db = session_factory()
+    try:
+        db.add_all([
+            User(
+                username=f"bench{i:05d}",
+                email=f"bench{i:05d}@bench.local",
+                password_hash=legacy_hash,
+                full_name=f"压测用户{i}",
+                role=UserRole.GUEST,
+            )
+            for i in range(count)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+async def measure_loop_lag(stop_event, samples, interval=0.005):
+    """周期性休眠并记录实际唤醒延迟"""
+    loop = asyncio.get_running_loop()
+    while not stop_event.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append((loop.time() - start - interval) * 1000)
+
+
+async def run_round(client, usernames, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def login(username):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(
+                "/auth/login",
+                data={"username": username, "password": PASSWORD},
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"登录失败: {username} {response.status_code} {response.text}")
+
+    lag_samples = []
+    stop_event = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop_event, lag_samples))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login(username) for username in usernames))
+    elapsed = time.perf_counter() - start
+
+    stop_event.set()
+    await lag_task
+    return elapsed, latencies, lag_samples
+
+
+def report(label, count, elapsed, latencies, lag_samples):
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"\n=== {label} ===")
+    print(f"登录次数: {count}, 总耗时: {elapsed:.2f}s, 吞吐量: {count / elapsed:.1f} 次/秒")
+    print(f"延迟 p50: {statistics.median(latencies):.1f}ms, p95: {p95:.1f}ms")
+    if lag_samples:
+        print(f"事件循环延迟 最大: {max(lag_samples):.1f}ms, 平均: {statistics.mean(lag_samples):.1f}ms")
+
+
+async def main(users, concurrency):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app, session_factory = build_app(os.path.join(tmp_dir, "bench_login.db"))
+        seed_users(session_factory, users)
+        usernames = [f"bench{i:05d}" for i in range(users)]
+
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            # 第一轮：旧 SHA-256 哈希，登录成功后升级为 bcrypt
+            elapsed, latencies, lag = await run_round(client, usernames, concurrency)
+            report("旧哈希首次登录（含升级）", users, elapsed, latencies, lag)
+
+            db = session_factory()
+            try:
+                schemes = {identify_hash(user.password_hash) for user in db.query(User).all()}
+            finally:
+                db.close()
+            print(f"升级后的哈希算法: {sorted(schemes)}")
+
+            # 第二轮：全部为 bcrypt 哈希
+            elapsed, latencies, lag = await run_round(client, usernames, concurrency)
+            report("bcrypt 登录", users, elapsed, latencies, lag)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="登录吞吐量基准测试")
+    parser.add_argument("--users", type=int, default=32, help="测试用户数量")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发登录数")
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.concurrency))
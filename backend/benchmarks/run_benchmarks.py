@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+仪表板和列表接口的负载基准测试
+
+在进程内通过 ASGI 调用完整应用（main.app），数据库为 datagen.py 生成的合成数据。
+每个场景先发送一个预热请求，在进程内监听数据库引擎的游标事件记录该请求的 SQL 条数
+（X-SQL-Profile 头只对管理员令牌生效，学生和教师场景无法用它计数），再按指定并发
+发送请求，记录 p50/p95/p99 延迟。指定 --baseline 时与基线对比：p95 超出基线的比例
+大于 --latency-tolerance、SQL 条数多于基线，或基线/本次缺少 SQL 条数，即视为回归
+并以非零状态退出。
+
+用法:
+  python benchmarks/datagen.py --scale 0.01
+  python benchmarks/run_benchmarks.py --requests 100 --concurrency 8 --baseline benchmarks/baseline.json
+  python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --update-baseline
+"""
+
+import sys
+import os
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import argparse
+import asyncio
+import json
+import platform
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+import httpx
+from sqlalchemy import event
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# 登录账号: 角色 -> (用户名, 密码)，合成账号见 datagen.py
+ACCOUNTS = {
+    "admin": ("admin", "admin123"),
+    "teacher": ("bt0000000", "benchmark123"),
+    "student": ("bs0000000", "benchmark123"),
+}
+
+# (场景名, 角色, 路径)，路径中的 {course_id} 为该教师的第一门课程
+SCENARIOS = [
+    ("admin_dashboard", "admin", "/admin/dashboard"),
+    ("admin_users", "admin", "/admin/users?page=1&page_size=20"),
+    ("admin_courses", "admin", "/admin/courses?page=1&page_size=20"),
+    ("admin_logs", "admin", "/admin/logs?page=1&page_size=50"),
+    ("admin_upgrade_requests", "admin", "/auth/upgrade-requests?page=1&page_size=50"),
+    ("student_dashboard", "student", "/students/dashboard"),
+    ("student_courses", "student", "/students/courses"),
+    ("student_grades", "student", "/students/grades"),
+    ("student_schedule", "student", "/students/schedule"),
+    ("student_exams", "student", "/students/exams"),
+    ("teacher_dashboard", "teacher", "/teachers/dashboard"),
+    ("teacher_courses", "teacher", "/teachers/courses"),
+    ("teacher_course_students", "teacher", "/teachers/courses/{course_id}/students"),
+    ("teacher_attendance", "teacher", "/teachers/attendance/{course_id}"),
+    ("friends_list", "student", "/friends/list"),
+    ("friends_search", "student", "/friends/search?q=bs00001"),
+]
+
+# 低于该值的 p95 变化视为噪声，不判定为回归
+LATENCY_FLOOR_MS = 2.0
+
+
+# 预热请求的 SQL 计数器；ASGITransport 在调用方的任务内执行应用，线程池中的同步
+# 路由也会复制上下文，因此在这里设置的计数器对该请求执行的所有语句可见
+_query_counter: ContextVar[list] = ContextVar("bench_query_counter", default=None)
+_counted_engines = set()
+
+
+def count_queries(engine):
+    """在引擎上挂载计数监听，每个引擎只需调用一次"""
+    if engine in _counted_engines:
+        return
+    _counted_engines.add(engine)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+def percentile(sorted_values, pct):
+    """最近秩百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+async def login(client, role):
+    username, password = ACCOUNTS[role]
+    response = await client.post("/auth/login", data={"username": username, "password": password})
+    if response.status_code != 200:
+        raise RuntimeError(f"{role} 登录失败: {response.status_code} {response.text}")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_scenario(client, headers, path, requests, concurrency):
+    # 预热请求，同时记录 SQL 条数；引擎未挂载计数监听时为 -1，对比时按缺失处理
+    counter = [0]
+    token = _query_counter.set(counter)
+    try:
+        response = await client.get(path, headers=headers)
+    finally:
+        _query_counter.reset(token)
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} 返回 {response.status_code}: {response.text[:200]}")
+    queries = counter[0] if _counted_engines else -1
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            r = await client.get(path, headers=headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if r.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "path": path,
+        "requests": requests,
+        "errors": errors,
+        "queries": queries,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+async def run_all(app, scenarios, requests, concurrency):
+    results = {}
+    async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+        headers = {role: await login(client, role) for role in ACCOUNTS}
+        response = await client.get("/teachers/courses", headers=headers["teacher"])
+        courses = response.json() if response.status_code == 200 else []
+        course_id = courses[0]["id"] if courses else 0
+
+        for name, role, path in scenarios:
+            path = path.format(course_id=course_id)
+            try:
+                result = await run_scenario(client, headers[role], path, requests, concurrency)
+            except Exception as e:
+                result = {"path": path, "error": str(e)}
+                print(f"✗ {name:<26} {e}")
+            else:
+                print(
+                    f"  {name:<26} p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  "
+                    f"p99 {result['p99_ms']:>8.2f}ms  SQL {result['queries']:>4}  {result['throughput_rps']:>7.1f} req/s"
+                )
+            results[name] = result
+    return results
+
+
+def compare(results, baseline, latency_tolerance):
+    """返回回归列表"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None or "error" in base:
+            continue
+        if "error" in current:
+            regressions.append(f"{name}: 请求失败 ({current['error']})")
+            continue
+        limit = max(base["p95_ms"] * (1 + latency_tolerance), base["p95_ms"] + LATENCY_FLOOR_MS)
+        if current["p95_ms"] > limit:
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms > 阈值 {limit:.2f}ms (基线 {base['p95_ms']}ms)")
+        base_queries = base.get("queries", -1)
+        current_queries = current.get("queries", -1)
+        if base_queries < 0:
+            regressions.append(f"{name}: 基线缺少 SQL 条数，请用 --update-baseline 重新生成")
+        elif current_queries < 0:
+            regressions.append(f"{name}: 本次未记录 SQL 条数")
+        elif current_queries > base_queries:
+            regressions.append(f"{name}: SQL 条数 {current_queries} > 基线 {base_queries}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="仪表板和列表接口负载基准测试")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="包含 student_system.db 的目录")
+    parser.add_argument("--requests", type=int, default=50, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发请求数")
+    parser.add_argument("--only", nargs="*", help="只运行指定场景")
+    parser.add_argument("--output", help="结果写入的 JSON 文件")
+    parser.add_argument("--baseline", help="基线 JSON 文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖基线")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25, help="p95 允许超出基线的比例")
+    args = parser.parse_args()
+
+    data_dir = os.path.abspath(args.data_dir)
+    if not os.path.exists(os.path.join(data_dir, "student_system.db")):
+        sys.exit(f"{data_dir} 中没有 student_system.db，请先运行 benchmarks/datagen.py")
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    # database.py 使用相对路径 ./student_system.db，引擎在导入时解析路径，
+    # 因此必须先切换目录再导入任何会导入 database 的模块
+    os.chdir(data_dir)
+    from main import app
+    from database import engine
+    count_queries(engine)
+
+    scenarios = [s for s in SCENARIOS if not args.only or s[0] in args.only]
+    print(f"数据目录: {data_dir}, 每场景 {args.requests} 次请求, 并发 {args.concurrency}")
+    results = asyncio.run(run_all(app, scenarios, args.requests, args.concurrency))
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "scenarios": results,
+    }
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if baseline_path and args.update_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已更新: {baseline_path}")
+        return
+
+    failed = [name for name, result in results.items() if "error" in result]
+    regressions = []
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.latency_tolerance)
+        for regression in regressions:
+            print(f"✗ 回归: {regression}")
+        if not regressions:
+            print("✓ 未发现回归")
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+run_benchmarks 的测试：基线对比规则，以及非管理员场景的 SQL 计数
+
+用法: python -m pytest benchmarks
+"""
+
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+from sqlalchemy import create_engine
+
+from benchmarks import run_benchmarks
+from benchmarks.run_benchmarks import compare
+
+
+def _result(p95_ms=10.0, queries=5):
+    return {"path": "/x", "requests": 10, "errors": 0, "queries": queries, "p95_ms": p95_ms}
+
+
+def _baseline(**scenarios):
+    return {"scenarios": scenarios}
+
+
+def test_compare_within_tolerance():
+    assert compare({"s": _result()}, _baseline(s=_result()), 0.25) == []
+
+
+def test_compare_latency_regression():
+    regressions = compare({"s": _result(p95_ms=20.0)}, _baseline(s=_result()), 0.25)
+    assert len(regressions) == 1
+    assert "p95" in regressions[0]
+
+
+def test_compare_latency_floor():
+    # 基线很小时允许至少 LATENCY_FLOOR_MS 的波动
+    current = _result(p95_ms=1.0 + run_benchmarks.LATENCY_FLOOR_MS)
+    assert compare({"s": current}, _baseline(s=_result(p95_ms=1.0)), 0.25) == []
+
+
+def test_compare_query_regression():
+    regressions = compare({"s": _result(queries=6)}, _baseline(s=_result()), 0.25)
+    assert regressions == ["s: SQL 条数 6 > 基线 5"]
+
+
+def test_compare_improvement():
+    current = _result(p95_ms=5.0, queries=2)
+    assert compare({"s": current}, _baseline(s=_result()), 0.25) == []
+
+
+@pytest.mark.parametrize("base_queries, current_queries", [(-1, 5), (5, -1)])
+def test_compare_missing_query_count(base_queries, current_queries):
+    regressions = compare(
+        {"s": _result(queries=current_queries)}, _baseline(s=_result(queries=base_queries)), 0.25
+    )
+    assert len(regressions) == 1
+    assert "缺少" in regressions[0] or "未记录" in regressions[0]
+
+
+def test_compare_baseline_without_query_field():
+    base = _result()
+    del base["queries"]
+    assert len(compare({"s": _result()}, _baseline(s=base), 0.25)) == 1
+
+
+def test_compare_failed_request():
+    regressions = compare({"s": {"path": "/x", "error": "boom"}}, _baseline(s=_result()), 0.25)
+    assert regressions == ["s: 请求失败 (boom)"]
+
+
+def test_compare_skips_new_scenario():
+    assert compare({"new": _result()}, _baseline(s=_result()), 0.25) == []
+
+
+@pytest.fixture(scope="module")
+def bench_app(tmp_path_factory):
+    """在临时目录生成小规模合成数据并导入完整应用"""
+    if "database" in sys.modules:
+        pytest.skip("database 已以其他数据库路径导入")
+    # database.py 的相对路径 ./student_system.db 在创建引擎（导入）时解析，
+    # 因此必须先切换目录再导入任何会导入 database 的模块
+    data_dir = tmp_path_factory.mktemp("bench_data")
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    try:
+        from seed_data import seed_database
+
+        engine = create_engine(f"sqlite:///{data_dir / 'student_system.db'}")
+        seed_database(engine, students=50, courses=10, attendance=500, seed=42)
+        engine.dispose()
+
+        from main import app
+        from database import engine as app_engine
+        run_benchmarks.count_queries(app_engine)
+        yield app
+    finally:
+        os.chdir(cwd)
+
+
+def test_query_counts_captured_for_every_role(bench_app):
+    scenarios = [s for s in run_benchmarks.SCENARIOS if s[1] != "admin"]
+
+    async def run():
+        async with httpx.AsyncClient(app=bench_app, base_url="http://bench", timeout=None) as client:
+            headers = {role: await run_benchmarks.login(client, role) for role in ("student", "teacher")}
+            response = await client.get("/teachers/courses", headers=headers["teacher"])
+            course_id = response.json()[0]["id"]
+            return {
+                name: await run_benchmarks.run_scenario(
+                    client, headers[role], path.format(course_id=course_id), 2, 1
+                )
+                for name, role, path in scenarios
+            }
+
+    results = asyncio.run(run())
+    for name, result in results.items():
+        assert result["errors"] == 0, name
+        assert result["queries"] > 0, name
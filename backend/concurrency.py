@@ -0,0 +1,49 @@
+"""
+乐观并发控制
+
+Course、Grade、User 映射了 version_id_col：ORM 更新这些行时自动带上 WHERE version = 读取时的版本，
+并把版本加一，被他人抢先修改时提交抛出 StaleDataError。
+更新接口的 ETag 即版本号，客户端带 If-Match 提交修改：
+  - 与当前版本不一致时直接返回 412，不做任何修改
+  - 检查通过后、提交前被他人修改（StaleDataError）同样返回 412
+不带 If-Match 时不检查客户端读取的版本，只在本次请求读取到提交之间被修改时返回 412。
+"""
+
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+
+def version_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def precondition_failed(current_version: Optional[int] = None) -> HTTPException:
+    headers = {"ETag": version_etag(current_version)} if current_version is not None else None
+    return HTTPException(
+        status_code=412,
+        detail="Resource was modified by someone else; reload and retry",
+        headers=headers
+    )
+
+
+def check_if_match(if_match: Optional[str], version: int):
+    """If-Match 中没有当前版本的 ETag 时返回 412；未提供 If-Match 或为 * 时通过"""
+    if if_match is None:
+        return
+    tags = [tag.strip() for tag in if_match.split(",")]
+    # 接受弱 ETag 形式，版本号本身即可比较
+    if "*" in tags or version_etag(version) in [tag[2:] if tag.startswith("W/") else tag for tag in tags]:
+        return
+    raise precondition_failed(version)
+
+
+def commit_versioned(db: Session):
+    """提交；版本冲突时回滚并返回 412"""
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise precondition_failed()
@@ -7,13 +7,16 @@ def simple_hash(password):
     """简单的密码哈希函数，用于测试"""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def create_test_data():
+def create_test_data(db: Session = None):
+    """创建基础测试账号和课程；传入 db 时写入该会话绑定的数据库，且不关闭会话"""
     # 导入并创建数据库表
     from models import Base
     from database import engine
-    Base.metadata.create_all(bind=engine)
+    owns_session = db is None
+    Base.metadata.create_all(bind=engine if owns_session else db.get_bind())
 
-    db = SessionLocal()
+    if owns_session:
+        db = SessionLocal()
 
     try:
         # 创建管理员用户
@@ -183,7 +186,8 @@ def create_test_data():
         print(f"创建测试数据失败: {e}")
         db.rollback()
     finally:
-        db.close()
+        if owns_session:
+            db.close()
 
 if __name__ == "__main__":
     create_test_data()
\ No newline at end of file
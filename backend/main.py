@@ -1,14 +1,26 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
 from database import engine, get_db
 from models import Base
-from routers import auth, students, teachers, admin, friends
+from metrics import MetricsMiddleware, instrument_engine, render_metrics
+import sql_profiler
+from migrate_schema import migrate_schema
+from routers import auth, students, teachers, admin, friends, health, calendar
 from serice import ai_service
+from serice.stats_service import dashboard_stats
+from serice.health_service import health_monitor
+from serice.job_service import job_runner
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+# SQL 执行和连接池计时
+instrument_engine(engine)
+# SQL 分析和慢查询日志
+sql_profiler.instrument_engine(engine)
+
+# 创建数据库表并补充新增的列
+migrate_schema()
 
 app = FastAPI(
     title="学生管理系统 API",
@@ -25,6 +37,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# SQL 分析（SQL_PROFILE=1 或管理员请求带 X-SQL-Profile: 1 时启用）
+app.add_middleware(sql_profiler.SQLProfilerMiddleware, authorize=auth.is_admin_token)
+
+# 请求指标（最后添加，位于最外层，CORS 预检请求也会被统计）
+app.add_middleware(MetricsMiddleware)
+
 # 包含路由
 app.include_router(auth.router, prefix="/auth", tags=["认证"])
 app.include_router(students.router, prefix="/students", tags=["学生"])
@@ -32,6 +50,28 @@ app.include_router(teachers.router, prefix="/teachers", tags=["教师"])
 app.include_router(admin.router, prefix="/admin", tags=["管理员"])
 app.include_router(friends.router, prefix="/friends", tags=["好友"])
 app.include_router(ai_service.router, prefix="/ai", tags=["AI助手"])
+app.include_router(health.router, prefix="/health", tags=["健康检查"])
+app.include_router(calendar.router, prefix="/calendar", tags=["日历订阅"])
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # 后台定时刷新管理员仪表板统计快照
+    dashboard_stats.start()
+    # 后台定时探测服务健康状态
+    health_monitor.start()
+    # 后台任务工作线程
+    job_runner.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await dashboard_stats.stop()
+    await health_monitor.stop()
+    job_runner.stop()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Prometheus 抓取端点，应在网关层限制为内网访问
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
@@ -41,10 +81,6 @@ async def root():
         "docs": "/docs"
     }
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,266 @@
+"""
+Prometheus 格式的运行指标
+
+MetricsMiddleware 记录每个路由的请求数、延迟直方图和进行中的请求数；
+instrument_engine 在 SQLAlchemy 引擎上挂载游标事件，统计每个请求的 SQL 条数和耗时，
+并记录连接池取连接的等待时间。render_metrics 输出 /metrics 的文本格式。
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    metric_type = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [各桶计数..., 总和, 总数]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        for labels, state in items:
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                le = f'le="{_format_number(bound) if bound != float("inf") else "+Inf"}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {state[-1]}")
+        return lines
+
+
+REGISTRY = []
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by method, route and status code", ("method", "route", "status")
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency in seconds", ("method", "route")
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being processed"
+)
+HTTP_EXCEPTIONS = Counter(
+    "http_request_exceptions_total", "Unhandled exceptions raised while processing requests", ("method", "route")
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_query_seconds_per_request", "Total SQL execution time per HTTP request in seconds", ("method", "route")
+)
+DB_QUERIES = Counter(
+    "db_queries_total", "SQL statements executed, including background tasks"
+)
+DB_QUERY_SECONDS = Counter(
+    "db_query_seconds_total", "Total SQL execution time in seconds, including background tasks"
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting to check out a pooled connection",
+    buckets=POOL_WAIT_BUCKETS
+)
+
+
+class RequestStats:
+    """单个请求内的 SQL 统计，通过 contextvar 在线程池中共享"""
+
+    __slots__ = ("query_count", "query_time")
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_time = 0.0
+
+
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---- SQLAlchemy 事件 ----
+
+_instrumented_engines = set()
+
+def instrument_engine(engine):
+    """挂载游标执行和连接池取连接的计时，每个引擎只需调用一次"""
+    if engine in _instrumented_engines:
+        return
+    _instrumented_engines.add(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get("query_start_times")
+        if not start_times:
+            return
+        elapsed = time.perf_counter() - start_times.pop()
+        DB_QUERIES.inc()
+        DB_QUERY_SECONDS.inc(amount=elapsed)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.query_count += 1
+            stats.query_time += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_times"):
+            conn.info["query_start_times"].pop()
+
+    # 连接池没有“开始取连接”事件，直接包装取连接的方法计时
+    pool = engine.pool
+    do_get = pool._do_get
+
+    def _timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+
+    pool._do_get = _timed_do_get
+
+
+# ---- ASGI 中间件 ----
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件，路由标签使用路径模板（如 /teachers/courses/{course_id}/students）"""
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths = None
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None or endpoint not in self._route_paths:
+            app = scope.get("app")
+            routes = getattr(app, "routes", [])
+            self._route_paths = {
+                getattr(route, "endpoint", None): getattr(route, "path", "unmatched") for route in routes
+            }
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            HTTP_EXCEPTIONS.inc(method, self._route_label(scope))
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            current_request_stats.reset(token)
+            route = self._route_label(scope)
+            HTTP_REQUESTS.inc(method, route, str(status_code))
+            HTTP_LATENCY.observe(elapsed, method, route)
+            DB_QUERIES_PER_REQUEST.observe(stats.query_count, method, route)
+            DB_TIME_PER_REQUEST.observe(stats.query_time, method, route)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本 - 为已有表补充新增的列
+
+Base.metadata.create_all 只会创建缺失的表，不会修改已存在的表，
+模型中新增的列需要在这里登记，新增的索引会自动补建。脚本可重复执行，main.py 启动时也会调用。
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import inspect, text
+from models import Base
+from database import engine, SessionLocal
+from serice.schedule_service import backfill_course_meetings, backfill_rooms
+
+# (表名, 列名, 列定义)
+NEW_COLUMNS = [
+    ("courses", "updated_at", "DATETIME"),
+    ("users", "token_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("courses", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("grades", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("grades", "reviewed_by", "INTEGER"),
+    ("grades", "reviewed_at", "DATETIME"),
+    ("grades", "review_comment", "TEXT"),
+]
+
+def migrate_schema():
+    # 先创建缺失的表
+    Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    with engine.connect() as conn:
+        for table, column, ddl in NEW_COLUMNS:
+            existing_columns = {col["name"] for col in inspector.get_columns(table)}
+            if column in existing_columns:
+                continue
+            print(f"添加列 {table}.{column}...")
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            print(f"✅ {table}.{column} 添加成功")
+
+        # 已有表上新增的索引
+        for table in Base.metadata.sorted_tables:
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                print(f"创建索引 {index.name}...")
+                index.create(bind=conn)
+
+        conn.commit()
+
+    # 课程上课时间文本解析为 CourseMeeting，只处理还没有时间段的课程
+    db = SessionLocal()
+    try:
+        parsed, unparsed = backfill_course_meetings(db)
+        db.commit()
+        if parsed:
+            print(f"✅ {parsed} 门课程的上课时间已解析为时间段")
+        if unparsed:
+            print(f"⚠️ {len(unparsed)} 门课程的上课时间无法解析，课程ID: {unparsed[:20]}")
+        rooms = backfill_rooms(db)
+        db.commit()
+        if rooms:
+            print(f"✅ 按课程现有教室创建了 {rooms} 间教室")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    try:
+        migrate_schema()
+        print("\n🎉 数据库迁移完成！")
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
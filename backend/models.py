@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, Enum
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -22,9 +22,13 @@ class User(Base):
     full_name = Column(String(100), nullable=False)
     role = Column(Enum(UserRole), nullable=False)
     is_active = Column(Boolean, default=True)
+    token_version = Column(Integer, default=0, nullable=False)  # 递增后旧令牌全部失效
+    version = Column(Integer, default=1, nullable=False)  # 乐观锁版本号，见 concurrency.py
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __mapper_args__ = {"version_id_col": version}
+
     # 关联关系
     student_profile = relationship("Student", back_populates="user", uselist=False)
     teacher_profile = relationship("Teacher", back_populates="user", uselist=False)
@@ -74,26 +78,69 @@ class Course(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, default=1, nullable=False)  # 乐观锁版本号，见 concurrency.py
+
+    __mapper_args__ = {"version_id_col": version}
 
     teacher = relationship("Teacher", back_populates="courses")
+    meetings = relationship("CourseMeeting", back_populates="course")
     enrollments = relationship("Enrollment", back_populates="course")
     grades = relationship("Grade", back_populates="course")
     attendances = relationship("Attendance", back_populates="course")
 
+class CourseMeeting(Base):
+    """课程的一个上课时间段，由 Course.schedule 解析得到（见 serice/schedule_service.py）"""
+    __tablename__ = "course_meetings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False, index=True)
+    day_of_week = Column(Integer, nullable=False)  # 1-7，周一为 1
+    start_minute = Column(Integer, nullable=False)  # 当天第几分钟，8:00 为 480
+    end_minute = Column(Integer, nullable=False)
+    room = Column(String(50))
+    week_pattern = Column(String(10), default="all", nullable=False)  # all, odd, even
+
+    course = relationship("Course", back_populates="meetings")
+
+class Room(Base):
+    """教室，排课时按容量分配（见 serice/scheduling_service.py）"""
+    __tablename__ = "rooms"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(50), unique=True, index=True, nullable=False)  # 与 Course.classroom、CourseMeeting.room 一致
+    building = Column(String(50))
+    capacity = Column(Integer, nullable=False)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Enrollment(Base):
     __tablename__ = "enrollments"
+    __table_args__ = (
+        # 选课时在写锁内统计课程人数、候补队列，查找学生已有的选课记录
+        Index("ix_enrollments_course_status", "course_id", "status"),
+        Index("ix_enrollments_student_course", "student_id", "course_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     student_id = Column(Integer, ForeignKey("students.id"))
     course_id = Column(Integer, ForeignKey("courses.id"))
     enrollment_date = Column(DateTime, default=datetime.utcnow)
-    status = Column(String(20), default="active")  # active, dropped, completed
+    status = Column(String(20), default="active")  # active, waitlisted, dropped, completed
 
     student = relationship("Student", back_populates="enrollments")
     course = relationship("Course", back_populates="enrollments")
 
 class Grade(Base):
     __tablename__ = "grades"
+    __table_args__ = (
+        # 按课程（和学期）读取成绩：成绩分析、课程名次
+        Index("ix_grades_course_semester", "course_id", "semester"),
+        # 按学生读取成绩：学生排名的加权 GPA、成绩录入时查找已有记录
+        Index("ix_grades_student_course", "student_id", "course_id"),
+        # 成绩审核：按学期整批审核、审核队列
+        Index("ix_grades_semester_status", "semester", "status"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     student_id = Column(Integer, ForeignKey("students.id"))
@@ -106,7 +153,13 @@ class Grade(Base):
     semester = Column(String(20))
     academic_year = Column(String(10))
     graded_at = Column(DateTime, default=datetime.utcnow)
-    status = Column(String(20), default="draft")  # draft, submitted, approved
+    status = Column(String(20), default="draft")  # draft, submitted, returned, approved
+    version = Column(Integer, default=1, nullable=False)  # 每次修改或状态变化加一，乐观锁版本号
+    reviewed_by = Column(Integer, ForeignKey("users.id"))
+    reviewed_at = Column(DateTime)
+    review_comment = Column(Text)  # 退回原因
+
+    __mapper_args__ = {"version_id_col": version}
 
     student = relationship("Student", back_populates="grades")
     course = relationship("Course", back_populates="grades")
@@ -127,6 +180,10 @@ class Attendance(Base):
 
 class Exam(Base):
     __tablename__ = "exams"
+    __table_args__ = (
+        # 按课程查询某时间之后的考试（仪表板即将到来的考试、考试冲突检查）
+        Index("ix_exams_course_date", "course_id", "date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     course_id = Column(Integer, ForeignKey("courses.id"))
@@ -214,4 +271,57 @@ class Friendship(Base):
     status = Column(String(20), default="active")  # active, blocked
 
     user1 = relationship("User", foreign_keys=[user1_id])
-    user2 = relationship("User", foreign_keys=[user2_id])
\ No newline at end of file
+    user2 = relationship("User", foreign_keys=[user2_id])
+
+
+class UserSession(Base):
+    __tablename__ = "user_sessions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    refresh_token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    previous_token_hash = Column(String(64), index=True)  # 上一个刷新令牌，用于检测重放
+    profile_id = Column(Integer)  # Student.id / Teacher.id，角色变更时会话随令牌版本一起失效
+    token_version = Column(Integer, nullable=False)  # 创建会话时的 User.token_version
+    user_agent = Column(String(255))
+    ip_address = Column(String(45))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime)
+
+    user = relationship("User")
+
+class Job(Base):
+    """后台任务，由 serice/job_service.py 中的工作线程执行"""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_type = Column(String(50), nullable=False)
+    status = Column(String(20), default="pending", nullable=False, index=True)  # pending, running, completed, failed, cancelled
+    payload = Column(Text)  # JSON
+    result = Column(Text)  # JSON，运行中为进度详情
+    error = Column(Text)
+    progress = Column(Float, default=0.0)
+    progress_message = Column(String(255))
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=1, nullable=False)
+    cancel_requested = Column(Boolean, default=False, nullable=False)
+    run_after = Column(DateTime, default=datetime.utcnow)  # 重试时延后执行
+    worker_id = Column(String(50))
+    created_by = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ImportCredential(Base):
+    """批量导入时生成的初始密码，与账号在同一事务中写入，管理员下载一次后删除"""
+    __tablename__ = "import_credentials"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), nullable=False, index=True)
+    username = Column(String(50), nullable=False)
+    student_id = Column(String(20), nullable=False)
+    password = Column(String(64), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
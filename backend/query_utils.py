@@ -0,0 +1,25 @@
+"""
+批量查询工具
+
+SQLite 单条语句的参数个数有限，IN 查询按批拆分；路由和服务模块共用。
+"""
+
+from typing import Iterable, Iterator, List
+
+from sqlalchemy.orm import Session
+
+IN_CLAUSE_BATCH_SIZE = 500
+
+
+def chunked(values: Iterable, size: int = IN_CLAUSE_BATCH_SIZE) -> Iterator[List]:
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def existing_values(db: Session, column, values) -> set:
+    """集合查询：返回 values 中已存在于 column 的值"""
+    existing = set()
+    for chunk in chunked(values):
+        existing.update(value for (value,) in db.query(column).filter(column.in_(chunk)))
+    return existing
@@ -1,152 +1,71 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status, File, UploadFile
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
 from datetime import datetime, timedelta
+from concurrency import check_if_match, commit_versioned, version_etag
 from database import get_db
-from models import User, UserRole, Student, Teacher, Course, SystemLog, Notice
-# 将在函数内导入以避免循环导入
+from models import User, UserRole, Student, Teacher, Course, Enrollment, SystemLog, Notice, Job, Room, Exam
+from routers.auth import Principal, require_role, revoke_user_tokens, token_version_cache
+from serice.stats_service import dashboard_stats
+from serice.health_service import health_monitor
+from serice import (
+    enrollment_service, exam_service, grade_workflow_service, import_service, job_service, maintenance_jobs,
+    scheduling_service, transcript_service
+)
+from serice.enrollment_service import EnrollmentError
+from serice.catalog_service import course_catalog
+from serice.calendar_service import calendar_feeds
+from serice.grade_analytics_service import grade_analytics
+from serice.ranking_service import rankings
+from serice.schedule_service import replace_course_meetings, timetable
+from sql_profiler import sql_profiler, SQL_PROFILE_ALL, REPEAT_THRESHOLD, SLOW_QUERY_MS
 
 router = APIRouter()
 
-def get_admin_user(current_user):
-    from routers.auth import get_current_active_user, get_db
-    current_user = get_current_active_user(current_user)
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to access admin resources"
-        )
-    return current_user
+# 仅凭令牌声明鉴权，不查询 User
+get_admin_user = require_role(UserRole.ADMIN, "Not authorized to access admin resources")
 
 @router.get("/dashboard")
 async def get_admin_dashboard(
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user)
 ):
-    # 获取系统统计数据
-    total_users = db.query(User).count()
-    active_users = db.query(User).filter(User.is_active == True).count()
+    # 统计数据来自后台定时刷新的快照，请求本身不查询数据库
+    snapshot = await dashboard_stats.get_snapshot()
 
-    total_students = db.query(Student).count()
-    total_teachers = db.query(Teacher).count()
-    total_courses = db.query(Course).filter(Course.is_active == True).count()
-    total_departments = db.query(Teacher.department).distinct().count()
+    # 服务状态来自健康监测的滚动窗口
+    system_status = health_monitor.dashboard_services()
 
-    # 获取最近活动日志
-    recent_activities = db.query(SystemLog).order_by(
-        SystemLog.created_at.desc()
-    ).limit(10).all()
-
-    activities = []
-    for activity in recent_activities:
-        user = db.query(User).filter(User.id == activity.user_id).first()
-        activities.append({
-            "id": activity.id,
-            "user": user.full_name if user else "系统",
-            "action": activity.action,
-            "time": activity.created_at.strftime("%Y-%m-%d %H:%M"),
-            "role": user.role.value if user else "系统",
-            "status": activity.status
-        })
-
-    # 获取用户增长趋势（最近6个月）
-    six_months_ago = datetime.now() - timedelta(days=180)
-
-    student_growth = db.query(
-        func.strftime('%Y-%m', User.created_at).label('month'),
-        func.count(Student.id).label('count')
-    ).join(User).filter(
-        User.created_at >= six_months_ago,
-        User.role == UserRole.STUDENT
-    ).group_by('month').all()
-
-    teacher_growth = db.query(
-        func.strftime('%Y-%m', User.created_at).label('month'),
-        func.count(Teacher.id).label('count')
-    ).join(User).filter(
-        User.created_at >= six_months_ago,
-        User.role == UserRole.TEACHER
-    ).group_by('month').all()
-
-    # 组织增长数据
-    user_growth_data = []
-    months = []
-    for i in range(6):
-        month_date = datetime.now() - timedelta(days=30 * i)
-        month_str = month_date.strftime('%Y-%m')
-        months.insert(0, month_str)
-
-    for month in months:
-        student_count = next((s.count for s in student_growth if s.month == month), 0)
-        teacher_count = next((t.count for t in teacher_growth if t.month == month), 0)
-        user_growth_data.append({
-            "month": month,
-            "students": student_count,
-            "teachers": teacher_count
-        })
-
-    # 获取系统状态（模拟）
-    system_status = [
-        {"service": "用户服务", "status": "正常", "uptime": "99.9%", "response": "12ms"},
-        {"service": "数据库服务", "status": "正常", "uptime": "99.8%", "response": "8ms"},
-        {"service": "文件服务", "status": "正常", "uptime": "99.7%", "response": "45ms"},
-        {"service": "邮件服务", "status": "警告", "uptime": "98.5%", "response": "120ms"},
-        {"service": "缓存服务", "status": "正常", "uptime": "99.9%", "response": "2ms"}
-    ]
-
-    # 获取安全警告（模拟）
+    # 安全警告：登录失败和异常操作来自系统日志，性能警告来自健康监测
+    security = snapshot["security"]
+    degraded_services = [service for service in system_status if service["status"] != "正常"]
     security_alerts = [
-        {"id": 1, "type": "high", "title": "检测到异常登录尝试", "count": 5, "time": "最近1小时"},
-        {"id": 2, "type": "medium", "title": "用户密码重置异常", "count": 3, "time": "最近24小时"},
-        {"id": 3, "type": "low", "title": "系统性能警告", "count": 1, "time": "最近12小时"}
+        alert for alert in (
+            {"id": 1, "type": "high", "title": "检测到异常登录尝试", "count": security["failed_logins_1h"], "time": "最近1小时"},
+            {"id": 2, "type": "medium", "title": "操作失败或警告", "count": security["abnormal_operations_24h"], "time": "最近24小时"},
+            {"id": 3, "type": "low", "title": "系统性能警告", "count": len(degraded_services), "time": "当前"}
+        )
+        if alert["count"] > 0
     ]
 
-    # 获取系统通知
-    notices = db.query(Notice).filter(
-        Notice.is_active == True
-    ).order_by(Notice.created_at.desc()).limit(5).all()
-
-    notice_list = []
-    for notice in notices:
-        notice_list.append({
-            "id": notice.id,
-            "title": notice.title,
-            "date": notice.created_at.strftime("%Y-%m-%d"),
-            "urgent": notice.priority == 'urgent'
-        })
-
-    # 计算统计数据
-    active_rate = (active_users / total_users * 100) if total_users > 0 else 0
-
-    # 计算新增用户
-    last_month_students = next((s.count for s in student_growth if s.month == months[-2]), 0)
-    last_month_teachers = next((t.count for t in teacher_growth if t.month == months[-2]), 0)
-
     critical_alerts = len([alert for alert in security_alerts if alert['type'] == 'high'])
     normal_services = len([service for service in system_status if service['status'] == '正常'])
 
     return {
-        "system_stats": {
-            "total_users": total_users,
-            "active_users": active_users,
-            "total_students": total_students,
-            "total_teachers": total_teachers,
-            "total_courses": total_courses,
-            "total_departments": total_departments
-        },
-        "recent_activities": activities,
-        "user_growth_data": user_growth_data,
+        "system_stats": snapshot["system_stats"],
+        "recent_activities": snapshot["recent_activities"],
+        "user_growth_data": snapshot["user_growth_data"],
         "system_status": system_status,
         "security_alerts": security_alerts,
-        "notices": notice_list,
+        "notices": snapshot["notices"],
         "calculated_stats": {
-            "active_rate": round(active_rate, 1),
-            "recent_new_students": last_month_students,
-            "recent_new_teachers": last_month_teachers,
+            **snapshot["calculated_stats"],
             "critical_alerts": critical_alerts,
             "normal_services": normal_services
-        }
+        },
+        "computed_at": snapshot["computed_at"]
     }
 
 @router.get("/users")
@@ -155,7 +74,7 @@ async def get_users(
     is_active: Optional[bool] = None,
     page: int = 1,
     page_size: int = 20,
-    current_user: User = Depends(get_admin_user),
+    current_user: Principal = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
     query = db.query(User)
@@ -182,7 +101,8 @@ async def get_users(
             "full_name": user.full_name,
             "role": user.role.value,
             "is_active": user.is_active,
-            "created_at": user.created_at.isoformat()
+            "created_at": user.created_at.isoformat(),
+            "version": user.version
         }
 
         # 添加角色特定信息
@@ -215,18 +135,28 @@ async def get_users(
 @router.post("/users/{user_id}/toggle-status")
 async def toggle_user_status(
     user_id: int,
-    current_user: User = Depends(get_admin_user),
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    check_if_match(if_match, user.version)
 
     if user.role == UserRole.ADMIN:
         raise HTTPException(status_code=400, detail="Cannot change admin status")
 
     user.is_active = not user.is_active
-    db.commit()
+    commit_versioned(db)
+    response.headers["ETag"] = version_etag(user.version)
+
+    # 禁用用户时撤销其全部令牌，启用时刷新令牌状态缓存
+    if not user.is_active:
+        revoke_user_tokens(db, user.id)
+    else:
+        token_version_cache.delete(user.id)
 
     # 记录日志
     log_entry = SystemLog(
@@ -241,11 +171,37 @@ async def toggle_user_status(
 
     return {"message": f"User {'activated' if user.is_active else 'deactivated'} successfully"}
 
+@router.post("/users/{user_id}/revoke-sessions")
+async def revoke_user_sessions(
+    user_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # 撤销全部会话，并使已签发的访问令牌失效
+    revoke_user_tokens(db, user_id)
+
+    # 记录日志
+    log_entry = SystemLog(
+        user_id=current_user.id,
+        action=f"撤销用户 {user.username} 的全部会话",
+        resource_type="user",
+        resource_id=str(user_id),
+        status="success"
+    )
+    db.add(log_entry)
+    db.commit()
+
+    return {"message": "User sessions revoked successfully"}
+
 @router.get("/courses")
 async def get_all_courses(
     page: int = 1,
     page_size: int = 20,
-    current_user: User = Depends(get_admin_user),
+    current_user: Principal = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
     total = db.query(Course).count()
@@ -270,7 +226,8 @@ async def get_all_courses(
             "enrolled_students": enrollment_count,
             "max_students": course.max_students,
             "is_active": course.is_active,
-            "created_at": course.created_at.isoformat()
+            "created_at": course.created_at.isoformat(),
+            "version": course.version
         })
 
     return {
@@ -284,6 +241,7 @@ async def get_all_courses(
 @router.put("/courses/{course_id}")
 async def update_course(
     course_id: int,
+    response: Response,
     name: str = None,
     code: str = None,
     credits: int = None,
@@ -293,12 +251,15 @@ async def update_course(
     max_students: int = None,
     description: str = None,
     is_active: bool = None,
-    current_user: User = Depends(get_admin_user),
+    if_match: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
+    """修改课程；带 If-Match（课程列表中的 version 或上次修改返回的 ETag）时版本不一致返回 412"""
     course = db.query(Course).filter(Course.id == course_id).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
+    check_if_match(if_match, course.version)
 
     # 更新课程信息
     update_data = {}
@@ -368,8 +329,33 @@ async def update_course(
     for key, value in update_data.items():
         setattr(course, key, value)
 
+    # 上课时间或教室变化时重建时间段
+    if "schedule" in update_data or "classroom" in update_data:
+        replace_course_meetings(db, course_id, course.schedule, course.classroom)
+
     course.updated_at = datetime.utcnow()
-    db.commit()
+    commit_versioned(db)
+    response.headers["ETag"] = version_etag(course.version)
+
+    # 扩容后按顺序递补候补学生
+    if max_students is not None:
+        try:
+            enrollment_service.fill_waitlist(db, course_id)
+        except EnrollmentError as e:
+            print(f"课程 {course_id} 候补递补失败: {e.detail}")
+
+    # 课程目录快照、课表索引在下次读取时重建
+    course_catalog.invalidate()
+    timetable.invalidate()
+    calendar_feeds.invalidate_courses([course_id])
+    exam_service.upcoming_exams.invalidate([course_id])
+    if teacher_id is not None:
+        calendar_feeds.invalidate_user(teacher.user_id)
+        # 更换任课教师后课程可能属于另一个院系
+        grade_analytics.invalidate_course(course_id)
+    if credits is not None:
+        # 学分变化影响所有修过这门课的学生的加权 GPA
+        rankings.mark_stale()
 
     # 记录日志
     log_entry = SystemLog(
@@ -382,21 +368,43 @@ async def update_course(
     db.add(log_entry)
     db.commit()
 
-    return {"message": "Course updated successfully"}
+    result = {"message": "Course updated successfully", "version": course.version}
+    # 时间、教室、教师变化后提示与其他课程的冲突（不阻止修改）
+    if update_data.keys() & {"schedule", "classroom", "teacher_id", "is_active"}:
+        result["conflicts"] = timetable.course_conflicts(db, course_id)
+    return result
+
+@router.get("/courses/{course_id}/conflicts")
+async def get_course_conflicts(
+    course_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """课程当前时间安排与其他有效课程的教室、教师冲突"""
+    if not db.query(Course.id).filter(Course.id == course_id).first():
+        raise HTTPException(status_code=404, detail="Course not found")
+    return {"course_id": course_id, **timetable.course_conflicts(db, course_id)}
 
 @router.post("/courses/{course_id}/toggle-status")
 async def toggle_course_status(
     course_id: int,
-    current_user: User = Depends(get_admin_user),
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
     course = db.query(Course).filter(Course.id == course_id).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
+    check_if_match(if_match, course.version)
 
     course.is_active = not course.is_active
     course.updated_at = datetime.utcnow()
-    db.commit()
+    commit_versioned(db)
+    response.headers["ETag"] = version_etag(course.version)
+    course_catalog.invalidate()
+    timetable.invalidate()
+    calendar_feeds.invalidate_courses([course_id])
 
     # 记录日志
     log_entry = SystemLog(
@@ -417,7 +425,7 @@ async def create_notice(
     content: str,
     priority: str = "normal",
     target_audience: str = "all",
-    current_user: User = Depends(get_admin_user),
+    current_user: Principal = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
     notice = Notice(
@@ -440,7 +448,7 @@ async def get_system_logs(
     status: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    current_user: User = Depends(get_admin_user),
+    current_user: Principal = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
     query = db.query(SystemLog)
@@ -478,4 +486,678 @@ async def get_system_logs(
         "page": page,
         "page_size": page_size,
         "total_pages": (total + page_size - 1) // page_size
-    }
\ No newline at end of file
+    }
+
+@router.get("/sql-profile")
+async def get_sql_profile(
+    sort: str = "total_time",
+    limit: int = 20,
+    current_user: Principal = Depends(get_admin_user)
+):
+    """被分析请求中开销最大的语句，sort 可选 total_time / count / max_time / repeated"""
+    return {
+        "enabled_for_all_requests": SQL_PROFILE_ALL,
+        "repeat_threshold": REPEAT_THRESHOLD,
+        "slow_query_ms": SLOW_QUERY_MS,
+        "profiled_requests": sql_profiler.profiled_requests,
+        "slow_queries": sql_profiler.slow_queries,
+        "top_statements": sql_profiler.top_offenders(sort, max(1, min(limit, 100))),
+        "recent_requests": sql_profiler.recent_requests()
+    }
+
+@router.delete("/sql-profile")
+async def reset_sql_profile(
+    current_user: Principal = Depends(get_admin_user)
+):
+    sql_profiler.reset()
+    return {"message": "SQL profile statistics cleared"}
+
+
+@router.post("/imports/{kind}", status_code=status.HTTP_202_ACCEPTED)
+async def import_records(
+    kind: str,
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """批量导入学生（kind=students）或选课（kind=enrollments），返回后台任务，进度通过 /admin/jobs/{id} 查询"""
+    if kind not in import_service.JOB_TYPES:
+        raise HTTPException(status_code=404, detail="Unknown import type")
+    try:
+        file_format = import_service.detect_format(file.filename)
+    except import_service.ImportFileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    path = await import_service.save_upload(file)
+    job = import_service.enqueue_import(
+        db, kind, path, file_format, file.filename, current_user.id, dry_run=dry_run
+    )
+    return job_service.serialize_job(job)
+
+class JobCreateRequest(BaseModel):
+    job_type: str
+    payload: Dict[str, Any] = {}
+
+@router.get("/jobs")
+async def list_jobs(
+    status: Optional[str] = None,
+    job_type: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+    query = db.query(Job)
+    if status:
+        query = query.filter(Job.status == status)
+    if job_type:
+        query = query.filter(Job.job_type == job_type)
+
+    total = query.count()
+    jobs = query.order_by(Job.id.desc()).offset((page - 1) * page_size).limit(page_size).all()
+
+    # 列表中不返回结果详情（导入任务的错误明细可能很大）
+    job_list = []
+    for job in jobs:
+        data = job_service.serialize_job(job)
+        data.pop("result")
+        job_list.append(data)
+
+    return {
+        "jobs": job_list,
+        "job_types": sorted(
+            job_type for job_type, definition in job_service.JOB_HANDLERS.items() if definition.enqueueable
+        ),
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": (total + page_size - 1) // page_size
+    }
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_job(
+    request: JobCreateRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    definition = job_service.JOB_HANDLERS.get(request.job_type)
+    if definition is None or not definition.enqueueable:
+        raise HTTPException(status_code=400, detail="Unknown job type")
+    job = job_service.enqueue(db, request.job_type, request.payload, created_by=current_user.id)
+    return job_service.serialize_job(job)
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_service.serialize_job(job)
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(
+    job_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    job = job_service.request_cancel(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status in (job_service.STATUS_COMPLETED, job_service.STATUS_FAILED):
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return job_service.serialize_job(job)
+
+@router.post("/jobs/{job_id}/retry")
+async def retry_job(
+    job_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if job and job.job_type in import_service.JOB_TYPES.values() and not import_service.upload_available(job):
+        raise HTTPException(status_code=409, detail="The uploaded file is no longer available; upload it again")
+    try:
+        job = job_service.retry_job(db, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_service.serialize_job(job)
+
+@router.post("/jobs/{job_id}/initial-passwords")
+async def download_initial_passwords(
+    job_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """下载导入任务生成的初始密码（CSV），下载后服务器上的明文即删除，只能下载一次"""
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job or job.job_type not in import_service.JOB_TYPES.values():
+        raise HTTPException(status_code=404, detail="Import job not found")
+    credentials = import_service.take_initial_passwords(db, job_id)
+    if not credentials:
+        raise HTTPException(status_code=410, detail="Initial passwords were already downloaded or none were generated")
+
+    db.add(SystemLog(
+        user_id=current_user.id,
+        action=f"下载导入任务 {job_id} 的初始密码（{len(credentials)} 个）",
+        resource_type="job",
+        resource_id=str(job_id),
+        status="success"
+    ))
+    db.commit()
+    return Response(content=import_service.render_initial_passwords(credentials), media_type="text/csv; charset=utf-8", headers={
+        "Content-Disposition": f'attachment; filename="initial_passwords_{job_id}.csv"',
+        "Cache-Control": "no-store"
+    })
+
+
+class RoomCreateRequest(BaseModel):
+    name: str
+    capacity: int
+    building: Optional[str] = None
+
+class RoomUpdateRequest(BaseModel):
+    capacity: Optional[int] = None
+    building: Optional[str] = None
+    is_active: Optional[bool] = None
+
+def _serialize_room(room: Room) -> dict:
+    return {
+        "id": room.id,
+        "name": room.name,
+        "building": room.building,
+        "capacity": room.capacity,
+        "is_active": room.is_active
+    }
+
+@router.get("/rooms")
+async def list_rooms(
+    include_inactive: bool = False,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    query = db.query(Room)
+    if not include_inactive:
+        query = query.filter(Room.is_active == True)
+    return {"rooms": [_serialize_room(room) for room in query.order_by(Room.name)]}
+
+@router.post("/rooms")
+async def create_room(
+    request: RoomCreateRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    if request.capacity < 1:
+        raise HTTPException(status_code=400, detail="Capacity must be positive")
+    if db.query(Room.id).filter(Room.name == request.name).first():
+        raise HTTPException(status_code=400, detail="Room already exists")
+    room = Room(name=request.name, capacity=request.capacity, building=request.building)
+    db.add(room)
+    db.commit()
+    db.refresh(room)
+    return _serialize_room(room)
+
+@router.put("/rooms/{room_id}")
+async def update_room(
+    room_id: int,
+    request: RoomUpdateRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """教室名称被课程引用，不允许修改；停用的教室不参与排课"""
+    room = db.query(Room).filter(Room.id == room_id).first()
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    if request.capacity is not None:
+        if request.capacity < 1:
+            raise HTTPException(status_code=400, detail="Capacity must be positive")
+        room.capacity = request.capacity
+    if request.building is not None:
+        room.building = request.building
+    if request.is_active is not None:
+        room.is_active = request.is_active
+    room.updated_at = datetime.utcnow()
+    db.commit()
+    return _serialize_room(room)
+
+
+class ScheduleSolveRequest(BaseModel):
+    days: Optional[List[int]] = None
+    periods: Optional[List[str]] = None
+    time_limit: Optional[int] = None
+    stability_weight: Optional[float] = None
+    teacher_unavailable: List[Dict[str, Any]] = []
+
+@router.post("/scheduling/solve", status_code=status.HTTP_202_ACCEPTED)
+async def solve_schedule(
+    request: ScheduleSolveRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    为全部有效课程重新分配上课时间和教室，后台任务计算方案，不修改课程。
+    通过 GET /admin/scheduling/{job_id} 预览变更，确认后 POST /admin/scheduling/{job_id}/apply 应用。
+    """
+    if request.days is not None and (not request.days or any(day < 1 or day > 7 for day in request.days)):
+        raise HTTPException(status_code=400, detail="Days must be between 1 and 7")
+    if request.periods is not None:
+        try:
+            scheduling_service.parse_periods(request.periods)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if request.time_limit is not None and not 1 <= request.time_limit <= 3600:
+        raise HTTPException(status_code=400, detail="Time limit must be between 1 and 3600 seconds")
+
+    payload = request.model_dump(exclude_none=True)
+    job = scheduling_service.enqueue_solve(db, payload, current_user.id)
+    return job_service.serialize_job(job)
+
+@router.get("/scheduling/{job_id}")
+async def get_schedule_plan(
+    job_id: int,
+    page: int = 1,
+    page_size: int = 50,
+    changed: Optional[str] = None,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """排课方案预览：统计、分页的课程变更（changed=time / room 只看时间或教室变化）和未能排课的课程"""
+    job = db.query(Job).filter(Job.id == job_id, Job.job_type == scheduling_service.JOB_TYPE).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Scheduling job not found")
+    data = job_service.serialize_job(job)
+    result = data.pop("result") or {}
+    if job.status != job_service.STATUS_COMPLETED:
+        return data
+
+    page = max(page, 1)
+    page_size = max(1, min(page_size, 200))
+    changes = result.get("changes", [])
+    if changed == "time":
+        changes = [change for change in changes if change["time_changed"]]
+    elif changed == "room":
+        changes = [change for change in changes if change["room_changed"]]
+    total = len(changes)
+    data.update({
+        "summary": result.get("summary"),
+        "settings": result.get("settings"),
+        "applied_at": result.get("applied_at"),
+        "unassigned": result.get("unassigned", []),
+        "changes": {
+            "items": changes[(page - 1) * page_size:page * page_size],
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "total_pages": (total + page_size - 1) // page_size
+        }
+    })
+    return data
+
+@router.post("/scheduling/{job_id}/apply")
+def apply_schedule_plan(
+    job_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """应用排课方案；方案计算后课程被修改过、或写回后教室、教师时间重叠时返回 409，需要重新求解"""
+    job = db.query(Job).filter(Job.id == job_id, Job.job_type == scheduling_service.JOB_TYPE).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Scheduling job not found")
+    try:
+        result = scheduling_service.apply_plan(db, job, current_user.id)
+    except scheduling_service.PlanConflictError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+
+    course_catalog.invalidate()
+    timetable.invalidate()
+    calendar_feeds.clear()
+    return result
+
+
+@router.get("/exams")
+async def list_exams(
+    course_id: Optional[int] = None,
+    exam_type: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    page: int = 1,
+    page_size: int = 50,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    page = max(page, 1)
+    page_size = max(1, min(page_size, 200))
+    query = db.query(Exam, Course.name).join(Course, Exam.course_id == Course.id)
+    if course_id is not None:
+        query = query.filter(Exam.course_id == course_id)
+    if exam_type:
+        query = query.filter(Exam.exam_type == exam_type)
+    if start:
+        query = query.filter(Exam.date >= start)
+    if end:
+        query = query.filter(Exam.date < end)
+
+    total = query.count()
+    rows = query.order_by(Exam.date, Exam.id).offset((page - 1) * page_size).limit(page_size).all()
+    return {
+        "items": [exam_service.serialize_exam(exam, name) for exam, name in rows],
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": (total + page_size - 1) // page_size
+    }
+
+def _load_exam(db: Session, exam_id: int) -> Exam:
+    exam = db.query(Exam).filter(Exam.id == exam_id).first()
+    if not exam:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    return exam
+
+def _exam_saved(db: Session, exam: Exam, current_user: Principal, action: str) -> dict:
+    """考试保存后：日历订阅失效、记录日志，返回考试及冲突提示"""
+    calendar_feeds.invalidate_courses([exam.course_id])
+    exam_service.upcoming_exams.invalidate([exam.course_id])
+    db.add(SystemLog(
+        user_id=current_user.id,
+        action=f"{action}: {exam.title}",
+        resource_type="exam",
+        resource_id=str(exam.id),
+        status="success"
+    ))
+    db.commit()
+    return {**exam_service.serialize_exam(exam), "conflicts": exam_service.exam_conflicts(db, exam)}
+
+@router.post("/exams")
+async def create_exam(
+    request: exam_service.ExamCreateRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    try:
+        exam = exam_service.create_exam(db, request.course_id, request)
+    except exam_service.ExamError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return _exam_saved(db, exam, current_user, "创建考试")
+
+@router.put("/exams/{exam_id}")
+async def update_exam(
+    exam_id: int,
+    request: exam_service.ExamUpdateRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    exam = _load_exam(db, exam_id)
+    try:
+        exam = exam_service.update_exam(db, exam, request)
+    except exam_service.ExamError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return _exam_saved(db, exam, current_user, "更新考试")
+
+@router.delete("/exams/{exam_id}")
+async def delete_exam(
+    exam_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    exam = _load_exam(db, exam_id)
+    course_id, title = exam.course_id, exam.title
+    db.delete(exam)
+    db.add(SystemLog(
+        user_id=current_user.id,
+        action=f"删除考试: {title}",
+        resource_type="exam",
+        resource_id=str(exam_id),
+        status="success"
+    ))
+    db.commit()
+    calendar_feeds.invalidate_courses([course_id])
+    exam_service.upcoming_exams.invalidate([course_id])
+    return {"message": "Exam deleted successfully"}
+
+@router.get("/exams/{exam_id}/conflicts")
+async def get_exam_conflicts(
+    exam_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    exam = _load_exam(db, exam_id)
+    return {"exam_id": exam_id, **exam_service.exam_conflicts(db, exam)}
+
+
+class ExamTimetableRequest(BaseModel):
+    start_date: str
+    days: Optional[int] = None
+    periods: Optional[List[str]] = None
+    skip_weekends: bool = True
+    exam_type: str = "final"
+    title: Optional[str] = None
+    course_ids: Optional[List[int]] = None
+    replace_existing: bool = False
+
+@router.post("/exam-timetable", status_code=status.HTTP_202_ACCEPTED)
+async def generate_exam_timetable(
+    request: ExamTimetableRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    为有学生选课的有效课程安排考试时间和考场，有共同学生的课程不会同时考试。
+    后台任务计算方案，GET /admin/exam-timetable/{job_id} 预览，POST .../apply 写入考试。
+    replace_existing 为 false 时跳过已有同类型考试的课程，为 true 时替换（未能排期的课程原有考试也会删除）。
+    """
+    if request.exam_type not in exam_service.EXAM_TYPES:
+        raise HTTPException(status_code=400, detail=f"exam_type must be one of {', '.join(exam_service.EXAM_TYPES)}")
+    if request.days is not None and not 1 <= request.days <= 60:
+        raise HTTPException(status_code=400, detail="Days must be between 1 and 60")
+    payload = request.model_dump(exclude_none=True)
+    try:
+        exam_service.build_exam_slots(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job = exam_service.enqueue_timetable(db, payload, current_user.id)
+    return job_service.serialize_job(job)
+
+@router.get("/exam-timetable/{job_id}")
+async def get_exam_timetable(
+    job_id: int,
+    page: int = 1,
+    page_size: int = 50,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """考试排期预览：统计、分页的考试安排和未能排期的课程"""
+    job = db.query(Job).filter(Job.id == job_id, Job.job_type == exam_service.JOB_TYPE).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Exam timetable job not found")
+    data = job_service.serialize_job(job)
+    result = data.pop("result") or {}
+    if job.status != job_service.STATUS_COMPLETED:
+        return data
+
+    page = max(page, 1)
+    page_size = max(1, min(page_size, 200))
+    exams = result.get("exams", [])
+    total = len(exams)
+    data.update({
+        "summary": result.get("summary"),
+        "settings": result.get("settings"),
+        "applied_at": result.get("applied_at"),
+        "unplaced": result.get("unplaced", []),
+        "exams": {
+            "items": exams[(page - 1) * page_size:page * page_size],
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "total_pages": (total + page_size - 1) // page_size
+        }
+    })
+    return data
+
+@router.post("/exam-timetable/{job_id}/apply")
+def apply_exam_timetable(
+    job_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    job = db.query(Job).filter(Job.id == job_id, Job.job_type == exam_service.JOB_TYPE).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Exam timetable job not found")
+    try:
+        result = exam_service.apply_plan(db, job, current_user.id)
+    except exam_service.PlanConflictError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+
+    calendar_feeds.clear()
+    exam_service.upcoming_exams.clear()
+    return result
+
+@router.get("/analytics/courses/{course_id}")
+def get_course_analytics(
+    course_id: int,
+    semester: Optional[str] = None,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    course = db.query(Course).filter(Course.id == course_id).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return grade_analytics.course(db, course, semester)
+
+@router.get("/analytics/departments/{department}")
+def get_department_analytics(
+    department: str,
+    semester: Optional[str] = None,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """院系（任课教师所属院系）全部课程的成绩分析及各课程汇总"""
+    result = grade_analytics.department(db, department, semester)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Department not found or has no courses")
+    return result
+
+@router.get("/students/{student_id}/transcript")
+def download_student_transcript(
+    student_id: int,
+    format: str = "pdf",
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    try:
+        transcript = transcript_service.transcripts.get(db, student_id, format)
+    except transcript_service.TranscriptError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if transcript is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return Response(content=transcript.content, media_type=transcript.media_type, headers={
+        "ETag": f'"{transcript.version}"',
+        "Content-Disposition": f'attachment; filename="{transcript.filename}"'
+    })
+
+class TranscriptBatchRequest(BaseModel):
+    enrollment_year: Optional[int] = None
+    class_name: Optional[str] = None
+    format: str = "pdf"
+
+@router.post("/transcripts/batch", status_code=status.HTTP_202_ACCEPTED)
+async def generate_transcript_batch(
+    request: TranscriptBatchRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """按入学年份（整届学生）和/或班级批量生成成绩单，后台任务写入 ZIP 文件，完成后从 .../download 下载"""
+    payload = request.model_dump(exclude_none=True)
+    try:
+        transcript_service.validate_batch_payload(db, payload)
+    except transcript_service.TranscriptError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    job = transcript_service.enqueue_batch(db, payload, current_user.id)
+    return job_service.serialize_job(job)
+
+@router.get("/transcripts/batch/{job_id}/download")
+def download_transcript_batch(
+    job_id: int,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    job = db.query(Job).filter(Job.id == job_id, Job.job_type == transcript_service.BATCH_JOB_TYPE).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Transcript batch job not found")
+    if job.status != job_service.STATUS_COMPLETED:
+        raise HTTPException(status_code=409, detail=f"Transcript batch job is {job.status}")
+    path = transcript_service.batch_archive_path(job.id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Transcript archive no longer exists")
+    return FileResponse(path, media_type="application/zip", filename=f"transcripts_job{job.id}.zip")
+
+@router.get("/grades/review")
+async def get_grade_review_queue(
+    semester: Optional[str] = None,
+    department: Optional[str] = None,
+    status: str = "submitted",
+    page: int = 1,
+    page_size: int = 20,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """成绩审核队列：有 status 状态成绩的课程及其各状态的成绩数"""
+    try:
+        return grade_workflow_service.review_queue(
+            db, semester, department, status, max(page, 1), max(1, min(page_size, 100))
+        )
+    except grade_workflow_service.GradeWorkflowError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@router.post("/grades/approve")
+def approve_grades(
+    request: grade_workflow_service.GradeApproveRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """审核通过一个学期已提交的成绩（可限定院系或课程），一条 UPDATE 完成；通过后成绩锁定"""
+    try:
+        result = grade_workflow_service.approve_grades(db, request, current_user.id)
+    except grade_workflow_service.GradeWorkflowError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    scope = request.department or (f"{len(request.course_ids)} 门课程" if request.course_ids else "全部课程")
+    db.add(SystemLog(
+        user_id=current_user.id,
+        action=f"审核通过成绩: {request.semester} {scope}，共 {result['approved']} 条",
+        resource_type="grade",
+        status="success"
+    ))
+    db.commit()
+    return result
+
+@router.post("/grades/return")
+def return_grades(
+    request: grade_workflow_service.GradeReturnRequest,
+    current_user: Principal = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """退回一门课程已提交的成绩，任课教师修改后重新提交"""
+    try:
+        result = grade_workflow_service.return_grades(db, request, current_user.id)
+    except grade_workflow_service.GradeWorkflowError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    db.add(SystemLog(
+        user_id=current_user.id,
+        action=f"退回成绩: {request.semester}，共 {result['returned']} 条",
+        resource_type="course",
+        resource_id=str(request.course_id),
+        status="success"
+    ))
+    db.commit()
+    return result
@@ -1,13 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import insert
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
-from database import get_db
-from models import User, UserRole, Student, Teacher
+import hashlib
+import secrets
+from database import SessionLocal, get_db
+from models import User, UserRole, Student, Teacher, UserSession, UpgradeRequest, SystemLog
+from security import get_password_hash_async, verify_and_update_password
+from cache import TTLCache
+from query_utils import chunked, existing_values
+from serice.calendar_service import calendar_feeds
 
 class RegisterRequest(BaseModel):
     username: str
@@ -16,31 +24,43 @@ class RegisterRequest(BaseModel):
     full_name: str
     role: str = "guest"
 
-router = APIRouter()
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
-# 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+class UserInfo(BaseModel):
+    """用户信息，学生/教师档案字段仅在对应角色下返回"""
+    id: int
+    username: str
+    email: str
+    full_name: str
+    role: str
+    student_id: Optional[str] = None
+    class_name: Optional[str] = None
+    teacher_id: Optional[str] = None
+    department: Optional[str] = None
+    title: Optional[str] = None
+
+class LoginResponse(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str
+    expires_in: int
+    user: UserInfo
+
+router = APIRouter()
 
 # JWT配置
 SECRET_KEY = "your-secret-key-here"  # 在生产环境中应该使用环境变量
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = 7
+# 日历订阅令牌的类型声明，与访问令牌区分（订阅令牌没有 sub，不能用作访问令牌）
+FEED_TOKEN_TYPE = "ics"
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
-
-def verify_password(plain_password, hashed_password):
-    # 首先尝试bcrypt验证
-    try:
-        return pwd_context.verify(plain_password, hashed_password)
-    except:
-        # 如果bcrypt验证失败，尝试SHA-256验证（用于测试数据）
-        import hashlib
-        return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
+# 登录失败日志的 action，仪表板据此统计异常登录尝试
+LOGIN_FAILED_ACTION = "登录失败"
 
-def get_password_hash(password):
-    # Temporarily use SHA-256 due to bcrypt compatibility issues
-    import hashlib
-    return hashlib.sha256(password.encode()).hexdigest()
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -52,34 +72,191 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def build_token_claims(user: User, profile_id: Optional[int] = None) -> dict:
+    """令牌声明：用户ID、角色、档案ID（Student.id / Teacher.id）和令牌版本"""
+    return {
+        "sub": user.username,
+        "uid": user.id,
+        "role": user.role.value,
+        "pid": profile_id,
+        "ver": user.token_version or 0
+    }
+
+class Principal(BaseModel):
+    """仅由令牌声明得到的当前用户身份，鉴权时无需加载 User"""
+    id: int
+    username: str
+    role: UserRole
+    profile_id: Optional[int] = None
+    token_version: int = 0
+
+# 令牌版本缓存: user_id -> (token_version, is_active)
+# 多进程部署时撤销令牌只清除本进程缓存，其他进程最多延迟一个 TTL 生效
+token_version_cache = TTLCache(maxsize=10000, ttl=60, name="token_version")
+
+def remember_token_state(user: User):
+    token_version_cache.set(user.id, (user.token_version or 0, bool(user.is_active)))
+
+def get_token_state(db: Session, user_id: int):
+    state = token_version_cache.get(user_id)
+    if state is None:
+        row = db.query(User.token_version, User.is_active).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        state = (row.token_version or 0, bool(row.is_active))
+        token_version_cache.set(user_id, state)
+    return state
+
+def bump_token_versions(db: Session, user_ids):
+    """递增令牌版本并撤销全部会话（不提交），提交后需清除 token_version_cache"""
+    db.query(User).filter(User.id.in_(user_ids)).update(
+        {User.token_version: User.token_version + 1},
+        synchronize_session=False
+    )
+    db.query(UserSession).filter(
+        UserSession.user_id.in_(user_ids),
+        UserSession.revoked_at.is_(None)
+    ).update({UserSession.revoked_at: datetime.utcnow()}, synchronize_session=False)
+
+def revoke_user_tokens(db: Session, user_id: int):
+    """使该用户已签发的令牌全部失效（会提交当前事务）"""
+    bump_token_versions(db, [user_id])
+    db.commit()
+    token_version_cache.delete(user_id)
+    calendar_feeds.invalidate_user(user_id)
+
+def hash_refresh_token(refresh_token: str) -> str:
+    # 刷新令牌是高熵随机串，SHA-256 即可，无需慢哈希
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+def create_session(db: Session, user: User, profile_id: Optional[int], request: Request) -> str:
+    """创建登录会话，返回刷新令牌明文（数据库只保存哈希）"""
+    refresh_token = secrets.token_urlsafe(32)
+    session = UserSession(
+        user_id=user.id,
+        refresh_token_hash=hash_refresh_token(refresh_token),
+        profile_id=profile_id,
+        token_version=user.token_version or 0,
+        user_agent=(request.headers.get("user-agent") or "")[:255],
+        ip_address=request.client.host if request.client else None,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    db.add(session)
+    db.commit()
+    return refresh_token
+
+def issue_access_token(user: User, profile_id: Optional[int] = None) -> str:
+    access_token = create_access_token(
+        data=build_token_claims(user, profile_id),
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    remember_token_state(user)
+    return access_token
+
+def create_feed_token(principal: "Principal") -> str:
+    """日历订阅令牌：不过期，只能用于订阅地址；令牌版本递增（退出全部设备）后失效"""
+    return jwt.encode({
+        "typ": FEED_TOKEN_TYPE,
+        "uid": principal.id,
+        "role": principal.role.value,
+        "pid": principal.profile_id,
+        "ver": principal.token_version
+    }, SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_feed_token(token: str) -> dict:
+    """校验签名，不查询数据库；令牌版本由调用方核对"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=404, detail="Calendar feed not found")
+    if payload.get("typ") != FEED_TOKEN_TYPE or payload.get("uid") is None or payload.get("pid") is None:
+        raise HTTPException(status_code=404, detail="Calendar feed not found")
+    return payload
+
 def get_user_by_username(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
-    if not user:
+def query_users_with_profile(db: Session):
+    """用户及其学生/教师档案，一次外连接查询取出，结果为 (User, Student, Teacher)"""
+    return db.query(User, Student, Teacher).outerjoin(
+        Student, Student.user_id == User.id
+    ).outerjoin(
+        Teacher, Teacher.user_id == User.id
+    )
+
+def get_profile_id(user: User, student: Optional[Student], teacher: Optional[Teacher]) -> Optional[int]:
+    if user.role == UserRole.STUDENT and student:
+        return student.id
+    if user.role == UserRole.TEACHER and teacher:
+        return teacher.id
+    return None
+
+def build_user_info(user: User, student: Optional[Student], teacher: Optional[Teacher], model=None, **extra):
+    """根据角色组装用户信息，model 可传入 UserInfo 的子类"""
+    data = {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "full_name": user.full_name,
+        "role": user.role.value
+    }
+    if user.role == UserRole.STUDENT and student:
+        data.update({
+            "student_id": student.student_id,
+            "class_name": student.class_name
+        })
+    elif user.role == UserRole.TEACHER and teacher:
+        data.update({
+            "teacher_id": teacher.teacher_id,
+            "department": teacher.department,
+            "title": teacher.title
+        })
+    data.update(extra)
+    return (model or UserInfo)(**data)
+
+async def authenticate_user(db: Session, username: str, password: str):
+    """校验用户名密码，成功时返回 (User, Student, Teacher)"""
+    row = query_users_with_profile(db).filter(User.username == username).first()
+    if not row:
         return False
-    if not verify_password(password, user.password_hash):
+    user = row[0]
+    verified, new_hash = await verify_and_update_password(password, user.password_hash)
+    if not verified:
         return False
-    return user
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+    # 旧哈希在登录成功后透明升级为 bcrypt
+    if new_hash:
+        user.password_hash = new_hash
+        try:
+            db.commit()
+        except StaleDataError:
+            # 同一用户的并发登录已先完成升级
+            db.rollback()
+    return row
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_access_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload
 
-    user = get_user_by_username(db, username=username)
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    payload = decode_access_token(token)
+
+    user = get_user_by_username(db, username=payload["sub"])
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    if payload.get("ver", 0) != (user.token_version or 0):
+        raise _credentials_exception()
     return user
 
 def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -87,56 +264,206 @@ def get_current_active_user(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-@router.post("/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
-    if not user:
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    payload = decode_access_token(token)
+    user_id = payload.get("uid")
+    if user_id is None:
+        raise _credentials_exception()
+    try:
+        role = UserRole(payload.get("role"))
+    except ValueError:
+        raise _credentials_exception()
+
+    # 令牌版本和启用状态命中缓存时不查询数据库
+    state = get_token_state(db, user_id)
+    if state is None or payload.get("ver", 0) != state[0]:
+        raise _credentials_exception()
+    if not state[1]:
+        raise HTTPException(status_code=400, detail="Inactive user")
+
+    return Principal(
+        id=user_id,
+        username=payload["sub"],
+        role=role,
+        profile_id=payload.get("pid"),
+        token_version=state[0]
+    )
+
+def is_admin_token(token: str) -> bool:
+    """令牌有效、未被撤销且属于启用的管理员；供中间件判断是否允许调试功能，不抛出异常"""
+    try:
+        payload = decode_access_token(token)
+    except HTTPException:
+        return False
+    if payload.get("role") != UserRole.ADMIN.value or payload.get("uid") is None:
+        return False
+    db = SessionLocal()
+    try:
+        state = get_token_state(db, payload["uid"])
+    finally:
+        db.close()
+    return state is not None and payload.get("ver", 0) == state[0] and state[1]
+
+def require_role(role: UserRole, detail: str):
+    """生成按角色鉴权的依赖，返回 Principal"""
+    async def dependency(principal: Principal = Depends(get_current_principal)) -> Principal:
+        if principal.role != role:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=detail
+            )
+        return principal
+    return dependency
+
+@router.post(
+    "/login",
+    response_model=LoginResponse,
+    response_model_exclude_none=True,
+    response_class=ORJSONResponse
+)
+async def login(
+    request: Request,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: Session = Depends(get_db)
+):
+    row = await authenticate_user(db, form_data.username, form_data.password)
+    if not row:
+        db.add(SystemLog(
+            action=LOGIN_FAILED_ACTION,
+            resource_type="auth",
+            resource_id=form_data.username[:50],
+            ip_address=request.client.host if request.client else None,
+            status="failed"
+        ))
+        db.commit()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username, "role": user.role.value}
-    )
+    user, student, teacher = row
+    profile_id = get_profile_id(user, student, teacher)
+    access_token = issue_access_token(user, profile_id)
+    refresh_token = create_session(db, user, profile_id, request)
 
-    # 获取用户详细信息
-    user_info = {
-        "id": user.id,
-        "username": user.username,
-        "email": user.email,
-        "full_name": user.full_name,
-        "role": user.role.value
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "user": build_user_info(user, student, teacher)
     }
 
-    # 根据角色获取额外信息
-    if user.role == UserRole.STUDENT:
-        student = db.query(Student).filter(Student.user_id == user.id).first()
-        if student:
-            user_info.update({
-                "student_id": student.student_id,
-                "class_name": student.class_name
-            })
-    elif user.role == UserRole.TEACHER:
-        teacher = db.query(Teacher).filter(Teacher.user_id == user.id).first()
-        if teacher:
-            user_info.update({
-                "teacher_id": teacher.teacher_id,
-                "department": teacher.department,
-                "title": teacher.title
-            })
-    elif user.role == UserRole.GUEST:
-        # 访客用户的基本信息已经在user_info中
-        pass
+@router.post("/refresh")
+async def refresh_access_token(request: RefreshRequest, db: Session = Depends(get_db)):
+    """用刷新令牌换取新的访问令牌，不校验密码；刷新令牌每次使用后轮换"""
+    invalid_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    now = datetime.utcnow()
+    token_hash = hash_refresh_token(request.refresh_token)
+
+    row = db.query(UserSession, User).join(User, UserSession.user_id == User.id).filter(
+        UserSession.refresh_token_hash == token_hash
+    ).first()
+    if not row:
+        # 已轮换掉的旧令牌再次出现，说明令牌可能泄露，撤销整个会话
+        db.query(UserSession).filter(
+            UserSession.previous_token_hash == token_hash,
+            UserSession.revoked_at.is_(None)
+        ).update({UserSession.revoked_at: now}, synchronize_session=False)
+        db.commit()
+        raise invalid_exception
+
+    session, user = row
+    if (session.revoked_at is not None
+            or session.expires_at <= now
+            or session.token_version != (user.token_version or 0)
+            or not user.is_active):
+        raise invalid_exception
+
+    # 条件更新保证并发刷新时只有一个请求轮换成功
+    new_refresh_token = secrets.token_urlsafe(32)
+    rotated = db.query(UserSession).filter(
+        UserSession.id == session.id,
+        UserSession.refresh_token_hash == token_hash
+    ).update({
+        UserSession.refresh_token_hash: hash_refresh_token(new_refresh_token),
+        UserSession.previous_token_hash: token_hash,
+        UserSession.last_used_at: now
+    }, synchronize_session=False)
+    db.commit()
+    if rotated != 1:
+        raise invalid_exception
 
     return {
-        "access_token": access_token,
+        "access_token": issue_access_token(user, session.profile_id),
+        "refresh_token": new_refresh_token,
         "token_type": "bearer",
-        "user": user_info
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
     }
 
+@router.post("/logout")
+async def logout(request: RefreshRequest, db: Session = Depends(get_db)):
+    """注销当前会话"""
+    db.query(UserSession).filter(
+        UserSession.refresh_token_hash == hash_refresh_token(request.refresh_token),
+        UserSession.revoked_at.is_(None)
+    ).update({UserSession.revoked_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    return {"message": "Logged out successfully"}
+
+@router.post("/logout-all")
+async def logout_all(
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """注销该用户的全部会话并使已签发的访问令牌失效"""
+    revoke_user_tokens(db, current_user.id)
+    return {"message": "All sessions revoked successfully"}
+
+@router.get("/sessions")
+async def get_sessions(
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    sessions = db.query(UserSession).filter(
+        UserSession.user_id == current_user.id,
+        UserSession.revoked_at.is_(None),
+        UserSession.expires_at > datetime.utcnow()
+    ).order_by(UserSession.last_used_at.desc()).all()
+
+    return [
+        {
+            "id": session.id,
+            "user_agent": session.user_agent,
+            "ip_address": session.ip_address,
+            "created_at": session.created_at.isoformat(),
+            "last_used_at": session.last_used_at.isoformat(),
+            "expires_at": session.expires_at.isoformat()
+        }
+        for session in sessions
+    ]
+
+@router.delete("/sessions/{session_id}")
+async def revoke_session(
+    session_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    revoked = db.query(UserSession).filter(
+        UserSession.id == session_id,
+        UserSession.user_id == current_user.id,
+        UserSession.revoked_at.is_(None)
+    ).update({UserSession.revoked_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    if not revoked:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session revoked successfully"}
+
 @router.post("/register")
 async def register(
     request: RegisterRequest,
@@ -159,7 +486,7 @@ async def register(
         )
 
     # 创建用户
-    hashed_password = get_password_hash(request.password)
+    hashed_password = await get_password_hash_async(request.password)
     db_user = User(
         username=request.username,
         email=request.email,
@@ -173,9 +500,20 @@ async def register(
 
     return {"message": "User registered successfully", "user_id": db_user.id}
 
-@router.get("/me")
-async def read_users_me(current_user: User = Depends(get_current_active_user)):
-    return current_user
+@router.get(
+    "/me",
+    response_model=UserInfo,
+    response_model_exclude_none=True,
+    response_class=ORJSONResponse
+)
+async def read_users_me(
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    row = query_users_with_profile(db).filter(User.id == current_user.id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="User not found")
+    return build_user_info(*row)
 
 @router.post("/upgrade-role")
 async def upgrade_role(
@@ -227,9 +565,32 @@ async def upgrade_role(
 
     return {"message": "Upgrade request submitted successfully", "request_id": upgrade_request.id}
 
+def serialize_upgrade_request(upgrade_request: UpgradeRequest, user: Optional[User]) -> dict:
+    return {
+        "id": upgrade_request.id,
+        "user_id": upgrade_request.user_id,
+        "user": {
+            "id": user.id,
+            "username": user.username,
+            "full_name": user.full_name,
+            "email": user.email
+        } if user else None,
+        "target_role": upgrade_request.target_role,
+        "student_id": upgrade_request.student_id,
+        "teacher_id": upgrade_request.teacher_id,
+        "class_name": upgrade_request.class_name,
+        "department": upgrade_request.department,
+        "title": upgrade_request.title,
+        "status": upgrade_request.status,
+        "created_at": upgrade_request.created_at.isoformat() if upgrade_request.created_at else None,
+        "rejection_reason": upgrade_request.rejection_reason
+    }
+
 @router.get("/upgrade-requests")
 async def get_upgrade_requests(
-    current_user: User = Depends(get_current_active_user),
+    page: int = 1,
+    page_size: int = 50,
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     # 只有管理员可以查看所有升级请求
@@ -239,14 +600,158 @@ async def get_upgrade_requests(
             detail="Only admin can view upgrade requests"
         )
 
-    from models import UpgradeRequest
-    requests = db.query(UpgradeRequest).filter(UpgradeRequest.status == "pending").all()
-    return requests
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 500)
 
-@router.post("/approve-upgrade/{request_id}")
-async def approve_upgrade(
-    request_id: int,
-    current_user: User = Depends(get_current_active_user),
+    query = db.query(UpgradeRequest).filter(UpgradeRequest.status == "pending")
+    total = query.count()
+    rows = db.query(UpgradeRequest, User).outerjoin(
+        User, UpgradeRequest.user_id == User.id
+    ).filter(
+        UpgradeRequest.status == "pending"
+    ).order_by(UpgradeRequest.created_at, UpgradeRequest.id).offset(
+        (page - 1) * page_size
+    ).limit(page_size).all()
+
+    return {
+        "requests": [serialize_upgrade_request(upgrade_request, user) for upgrade_request, user in rows],
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": (total + page_size - 1) // page_size
+    }
+
+def approve_upgrade_requests(db: Session, request_ids, processed_by: int) -> list:
+    """
+    批量批准升级申请：集合查询校验、批量创建档案，全部通过后一次提交。
+    返回错误列表 [{"request_id", "status_code", "detail"}]，有错误时不做任何修改。
+    """
+    request_ids = list(dict.fromkeys(request_ids))
+    rows = []
+    for chunk in chunked(request_ids):
+        rows.extend(
+            db.query(UpgradeRequest, User).outerjoin(
+                User, UpgradeRequest.user_id == User.id
+            ).filter(UpgradeRequest.id.in_(chunk)).all()
+        )
+    found = {upgrade_request.id: (upgrade_request, user) for upgrade_request, user in rows}
+
+    errors = []
+
+    def fail(request_id, status_code, detail):
+        errors.append({"request_id": request_id, "status_code": status_code, "detail": detail})
+
+    students, teachers = [], []
+    for request_id in request_ids:
+        if request_id not in found:
+            fail(request_id, 404, "Upgrade request not found")
+            continue
+        upgrade_request, user = found[request_id]
+        if upgrade_request.status != "pending":
+            fail(request_id, 400, "Upgrade request already processed")
+        elif not user:
+            fail(request_id, 404, "User not found")
+        elif upgrade_request.target_role == UserRole.STUDENT.value:
+            if not upgrade_request.student_id:
+                fail(request_id, 400, "Student ID is required for student role")
+            else:
+                students.append((upgrade_request, user))
+        elif upgrade_request.target_role == UserRole.TEACHER.value:
+            if not upgrade_request.teacher_id:
+                fail(request_id, 400, "Teacher ID is required for teacher role")
+            else:
+                teachers.append((upgrade_request, user))
+        else:
+            fail(request_id, 400, "Target role must be student or teacher")
+
+    # 学号/工号：批内重复和库内已存在各用一次集合判断
+    for pending, column, attr, detail in (
+        (students, Student.student_id, "student_id", "Student ID already exists"),
+        (teachers, Teacher.teacher_id, "teacher_id", "Teacher ID already exists"),
+    ):
+        values = [getattr(upgrade_request, attr) for upgrade_request, _ in pending]
+        taken = existing_values(db, column, values)
+        seen = set()
+        for upgrade_request, _ in pending:
+            value = getattr(upgrade_request, attr)
+            if value in taken or value in seen:
+                fail(upgrade_request.id, 400, detail)
+            seen.add(value)
+
+    # 同一用户不能重复创建档案
+    user_ids = [user.id for _, user in students + teachers]
+    profiled = existing_values(db, Student.user_id, user_ids) | existing_values(db, Teacher.user_id, user_ids)
+    seen_users = set()
+    for upgrade_request, user in students + teachers:
+        if user.id in profiled or user.id in seen_users:
+            fail(upgrade_request.id, 400, "User already has a profile")
+        seen_users.add(user.id)
+
+    if errors:
+        return errors
+
+    now = datetime.utcnow()
+    if students:
+        db.execute(insert(Student), [
+            {
+                "user_id": user.id,
+                "student_id": upgrade_request.student_id,
+                "class_name": upgrade_request.class_name,
+                "enrollment_year": now.year  # 默认当前年份
+            }
+            for upgrade_request, user in students
+        ])
+    if teachers:
+        db.execute(insert(Teacher), [
+            {
+                "user_id": user.id,
+                "teacher_id": upgrade_request.teacher_id,
+                "department": upgrade_request.department,
+                "title": upgrade_request.title
+            }
+            for upgrade_request, user in teachers
+        ])
+
+    # 更新用户角色
+    for pending, role in ((students, UserRole.STUDENT), (teachers, UserRole.TEACHER)):
+        for chunk in chunked([user.id for _, user in pending]):
+            db.query(User).filter(User.id.in_(chunk)).update(
+                {User.role: role, User.updated_at: now, User.version: User.version + 1},
+                synchronize_session=False
+            )
+
+    # 条件更新请求状态，防止并发重复批准
+    updated = 0
+    for chunk in chunked(request_ids):
+        updated += db.query(UpgradeRequest).filter(
+            UpgradeRequest.id.in_(chunk),
+            UpgradeRequest.status == "pending"
+        ).update({
+            UpgradeRequest.status: "approved",
+            UpgradeRequest.processed_at: now,
+            UpgradeRequest.processed_by: processed_by
+        }, synchronize_session=False)
+    if updated != len(request_ids):
+        db.rollback()
+        return [{"request_id": None, "status_code": 409, "detail": "Upgrade requests were modified concurrently"}]
+
+    # 角色已变更，旧令牌中的角色声明失效，需要重新登录
+    for chunk in chunked(user_ids):
+        bump_token_versions(db, chunk)
+
+    db.commit()
+    for user_id in user_ids:
+        token_version_cache.delete(user_id)
+        calendar_feeds.invalidate_user(user_id)
+    return []
+
+class ApproveUpgradesRequest(BaseModel):
+    request_ids: List[int]
+
+@router.post("/approve-upgrades")
+async def approve_upgrades(
+    request: ApproveUpgradesRequest,
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     # 只有管理员可以批准升级请求
@@ -256,86 +761,37 @@ async def approve_upgrade(
             detail="Only admin can approve upgrade requests"
         )
 
-    from models import UpgradeRequest, Student, Teacher
-    upgrade_request = db.query(UpgradeRequest).filter(UpgradeRequest.id == request_id).first()
+    if not request.request_ids:
+        raise HTTPException(status_code=400, detail="request_ids must not be empty")
 
-    if not upgrade_request:
+    errors = approve_upgrade_requests(db, request.request_ids, current_user.id)
+    if errors:
         raise HTTPException(
-            status_code=404,
-            detail="Upgrade request not found"
+            status_code=409 if errors[0]["status_code"] == 409 else 400,
+            detail={"message": "No upgrade requests were approved", "errors": errors}
         )
 
-    if upgrade_request.status != "pending":
-        raise HTTPException(
-            status_code=400,
-            detail="Upgrade request already processed"
-        )
+    return {
+        "message": "Upgrade requests approved successfully",
+        "approved": len(set(request.request_ids))
+    }
 
-    # 获取用户
-    user = db.query(User).filter(User.id == upgrade_request.user_id).first()
-    if not user:
+@router.post("/approve-upgrade/{request_id}")
+async def approve_upgrade(
+    request_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    # 只有管理员可以批准升级请求
+    if current_user.role != UserRole.ADMIN:
         raise HTTPException(
-            status_code=404,
-            detail="User not found"
-        )
-
-    # 更新用户角色
-    target_role = UserRole(upgrade_request.target_role)
-    user.role = target_role
-
-    # 创建相应的档案
-    if target_role == UserRole.STUDENT:
-        if not upgrade_request.student_id:
-            raise HTTPException(
-                status_code=400,
-                detail="Student ID is required for student role"
-            )
-
-        # 检查学号是否已存在
-        existing_student = db.query(Student).filter(Student.student_id == upgrade_request.student_id).first()
-        if existing_student:
-            raise HTTPException(
-                status_code=400,
-                detail="Student ID already exists"
-            )
-
-        student = Student(
-            user_id=user.id,
-            student_id=upgrade_request.student_id,
-            class_name=upgrade_request.class_name,
-            enrollment_year=2024  # 默认当前年份
-        )
-        db.add(student)
-
-    elif target_role == UserRole.TEACHER:
-        if not upgrade_request.teacher_id:
-            raise HTTPException(
-                status_code=400,
-                detail="Teacher ID is required for teacher role"
-            )
-
-        # 检查工号是否已存在
-        existing_teacher = db.query(Teacher).filter(Teacher.teacher_id == upgrade_request.teacher_id).first()
-        if existing_teacher:
-            raise HTTPException(
-                status_code=400,
-                detail="Teacher ID already exists"
-            )
-
-        teacher = Teacher(
-            user_id=user.id,
-            teacher_id=upgrade_request.teacher_id,
-            department=upgrade_request.department,
-            title=upgrade_request.title
+            status_code=403,
+            detail="Only admin can approve upgrade requests"
         )
-        db.add(teacher)
 
-    # 更新请求状态
-    upgrade_request.status = "approved"
-    upgrade_request.processed_at = datetime.utcnow()
-    upgrade_request.processed_by = current_user.id
-
-    db.commit()
+    errors = approve_upgrade_requests(db, [request_id], current_user.id)
+    if errors:
+        raise HTTPException(status_code=errors[0]["status_code"], detail=errors[0]["detail"])
 
     return {"message": "Upgrade request approved successfully"}
 
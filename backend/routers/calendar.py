@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from starlette.concurrency import run_in_threadpool
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from database import SessionLocal
+from models import UserRole
+from routers.auth import Principal, create_feed_token, decode_feed_token, get_current_principal, get_token_state
+from serice.calendar_service import calendar_feeds
+
+router = APIRouter()
+
+FEED_MEDIA_TYPE = "text/calendar; charset=utf-8"
+
+@router.get("/feed-url")
+async def get_feed_url(
+    request: Request,
+    current_user: Principal = Depends(get_current_principal)
+):
+    """当前用户（学生或教师）的日历订阅地址；退出全部设备后地址失效，需重新获取"""
+    if current_user.role not in (UserRole.STUDENT, UserRole.TEACHER) or current_user.profile_id is None:
+        raise HTTPException(status_code=400, detail="Calendar feeds are available for students and teachers only")
+    url = str(request.url_for("get_calendar_feed", token=create_feed_token(current_user)))
+    return {
+        "url": url,
+        "webcal_url": "webcal://" + url.split("://", 1)[1]
+    }
+
+def _load_feed(payload: dict):
+    """缓存未命中：核对令牌版本和用户状态后查询数据库生成日历"""
+    db = SessionLocal()
+    try:
+        state = get_token_state(db, payload["uid"])
+        if state is None or state[0] != payload.get("ver", 0) or not state[1]:
+            return None
+        return calendar_feeds.build(db, payload["uid"], UserRole(payload["role"]), payload["pid"], state[0])
+    finally:
+        db.close()
+
+def _not_modified(request: Request, etag: str, last_modified) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(tzinfo=timezone.utc) <= since
+    return False
+
+@router.get("/feeds/{token}.ics", name="get_calendar_feed")
+async def get_calendar_feed(token: str, request: Request):
+    """iCalendar 订阅，令牌在地址中；缓存命中时不查询数据库，内容未变化时返回 304"""
+    payload = decode_feed_token(token)
+    feed = calendar_feeds.lookup(payload["uid"], payload.get("ver", 0))
+    if feed is None:
+        feed = await run_in_threadpool(_load_feed, payload)
+        if feed is None:
+            raise HTTPException(status_code=404, detail="Calendar feed not found")
+
+    headers = {
+        "ETag": feed.etag,
+        "Last-Modified": format_datetime(feed.last_modified.replace(tzinfo=timezone.utc), usegmt=True),
+        "Cache-Control": "private, no-cache"
+    }
+    if _not_modified(request, feed.etag, feed.last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=feed.body, media_type=FEED_MEDIA_TYPE, headers={
+        **headers,
+        "Content-Disposition": 'inline; filename="schedule.ics"'
+    })
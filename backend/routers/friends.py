@@ -1,11 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, and_
 from typing import List, Optional
 from pydantic import BaseModel
 from database import get_db
 from models import User, FriendRequest, Friendship, UserRole
-from routers.auth import get_current_active_user
+from routers.auth import (
+    get_current_active_user,
+    get_current_principal,
+    Principal,
+    UserInfo,
+    query_users_with_profile,
+    build_user_info,
+)
 
 router = APIRouter()
 
@@ -38,27 +46,19 @@ class FriendResponse(BaseModel):
     class_name: Optional[str] = None
     friendship_since: str
 
-class UserSearchResponse(BaseModel):
-    id: int
+class UserSearchResponse(UserInfo):
     name: str
-    email: str
-    role: str
-    student_id: Optional[str] = None
-    teacher_id: Optional[str] = None
-    department: Optional[str] = None
-    title: Optional[str] = None
-    class_name: Optional[str] = None
 
-@router.get("/search", response_model=List[UserSearchResponse])
+@router.get("/search", response_model=List[UserSearchResponse], response_class=ORJSONResponse)
 async def search_users(
     q: str = Query(..., min_length=1, description="搜索关键词"),
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """搜索用户（用于添加好友）"""
     try:
-        # 搜索用户名、姓名、邮箱
-        users = db.query(User).filter(
+        # 搜索用户名、姓名、邮箱，档案信息在同一查询中外连接取出
+        rows = query_users_with_profile(db).filter(
             and_(
                 User.id != current_user.id,  # 排除自己
                 or_(
@@ -69,31 +69,10 @@ async def search_users(
             )
         ).limit(20).all()
 
-        result = []
-        for user in users:
-            user_data = {
-                "id": user.id,
-                "name": user.full_name,
-                "email": user.email,
-                "role": user.role.value
-            }
-
-            # 根据角色添加额外信息
-            if user.role == UserRole.STUDENT and hasattr(user, 'student_profile') and user.student_profile:
-                user_data.update({
-                    "student_id": user.student_profile.student_id,
-                    "class_name": user.student_profile.class_name
-                })
-            elif user.role == UserRole.TEACHER and hasattr(user, 'teacher_profile') and user.teacher_profile:
-                user_data.update({
-                    "teacher_id": user.teacher_profile.teacher_id,
-                    "department": user.teacher_profile.department,
-                    "title": user.teacher_profile.title
-                })
-
-            result.append(user_data)
-
-        return result
+        return [
+            build_user_info(user, student, teacher, model=UserSearchResponse, name=user.full_name)
+            for user, student, teacher in rows
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"搜索用户失败: {str(e)}")
 
@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from serice.health_service import health_monitor
+
+router = APIRouter()
+
+@router.get("")
+async def health_check():
+    """整体健康状态摘要"""
+    report = health_monitor.report()
+    return {"status": report["status"], "ready": report["ready"]}
+
+@router.get("/live")
+async def liveness_check():
+    """存活检查：进程和事件循环能响应即可"""
+    return {"status": "alive"}
+
+@router.get("/ready")
+async def readiness_check():
+    """就绪检查：数据库、连接池或事件循环异常时返回 503，供负载均衡摘除实例"""
+    report = health_monitor.report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
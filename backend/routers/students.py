@@ -1,32 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 from datetime import datetime, timedelta
 from database import get_db
-from models import User, UserRole, Student, Course, Enrollment, Grade, Attendance, Exam
-# 将在函数内导入以避免循环导入
+from models import User, UserRole, Student, Teacher, Course, Enrollment, Grade, Attendance, Exam
+from routers.auth import Principal, require_role
+from serice import enrollment_service, exam_service
+from serice.catalog_service import AVAILABILITY_VALUES, course_catalog
+from serice.grade_analytics_service import ANALYZED_STATUSES
+from serice.calendar_service import calendar_feeds
+from serice.ranking_service import rankings
+from serice.transcript_service import TranscriptError, transcripts
+from serice.schedule_service import load_course_meetings
+from serice.enrollment_service import EnrollmentError
 
 router = APIRouter()
 
-def get_student_user(current_user):
-    from routers.auth import get_current_active_user, get_db
-    current_user = get_current_active_user(current_user)
-    if current_user.role != UserRole.STUDENT:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to access student resources"
-        )
-    return current_user
+# 仅凭令牌声明鉴权，不查询 User
+get_student_user = require_role(UserRole.STUDENT, "Not authorized to access student resources")
+
+def get_student_id(current_user: Principal) -> int:
+    """令牌中的档案ID即 Student.id"""
+    if current_user.profile_id is None:
+        raise HTTPException(status_code=404, detail="Student profile not found")
+    return current_user.profile_id
+
+def load_student(db: Session, current_user: Principal):
+    """一次查询取出学生档案及其用户信息"""
+    row = db.query(Student, User).join(User, Student.user_id == User.id).filter(
+        Student.id == get_student_id(current_user)
+    ).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Student profile not found")
+    return row
 
 @router.get("/dashboard")
 async def get_student_dashboard(
-    current_user: User = Depends(get_student_user),
+    current_user: Principal = Depends(get_student_user),
     db: Session = Depends(get_db)
 ):
     # 获取学生信息
-    student = db.query(Student).filter(Student.user_id == current_user.id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student profile not found")
+    student, user = load_student(db, current_user)
 
     # 获取学生课程
     enrollments = db.query(Enrollment).filter(
@@ -46,32 +61,41 @@ async def get_student_dashboard(
             "credits": course.credits
         })
 
-    # 获取学生成绩
-    grades = db.query(Grade).filter(Grade.student_id == student.id).all()
+    # 获取学生成绩：草稿和被退回的成绩在审核前对学生不可见，与排名、成绩单的统计范围一致
+    grades = db.query(Grade).filter(
+        Grade.student_id == student.id,
+        Grade.status.in_(ANALYZED_STATUSES)
+    ).all()
+
+    # 排名：加权 GPA 在全校、班级、专业中的名次和各门课程的名次；首次使用时需要建立，放到线程池中
+    ranking = await run_in_threadpool(rankings.student_ranks, db, student.id, grades)
+    course_ranks = {(rank["course_id"], rank["semester"]): rank for rank in ranking.pop("courses")}
+
     grade_list = []
     for grade in grades:
+        course_rank = course_ranks.get((grade.course_id, grade.semester))
         grade_list.append({
             "course": grade.course.name,
             "midterm": grade.midterm_score,
             "final": grade.final_score,
             "usual": grade.usual_score,
             "total": grade.total_score,
-            "gpa": grade.gpa
+            "gpa": grade.gpa,
+            "rank": {key: course_rank[key] for key in ("rank", "total", "percentile")} if course_rank else None
         })
 
-    # 获取即将到来的考试
-    exams = db.query(Exam).join(Course).join(Enrollment).filter(
-        Enrollment.student_id == student.id,
-        Exam.date > datetime.now()
-    ).all()
-
+    # 即将到来的考试：按已选课程从考试缓存中取
     upcoming_exams = []
-    for exam in exams:
+    for exam in exam_service.upcoming_exams.for_courses(db, [enrollment.course_id for enrollment in enrollments]):
+        start = exam["date"]
+        time_range = start.strftime("%H:%M")
+        if exam["duration"]:
+            time_range += f"-{(start + timedelta(minutes=exam['duration'])).strftime('%H:%M')}"
         upcoming_exams.append({
-            "course": exam.course.name,
-            "date": exam.date.strftime("%Y-%m-%d"),
-            "time": f"{exam.date.strftime('%H:%M')}-{(exam.date + timedelta(minutes=exam.duration)).strftime('%H:%M')}",
-            "room": exam.location
+            "course": exam["course"],
+            "date": start.strftime("%Y-%m-%d"),
+            "time": time_range,
+            "room": exam["location"]
         })
 
     # 计算统计数据
@@ -80,14 +104,15 @@ async def get_student_dashboard(
 
     return {
         "student_info": {
-            "name": current_user.full_name,
+            "name": user.full_name,
             "student_id": student.student_id,
             "class_name": student.class_name,
-            "email": current_user.email
+            "email": user.email
         },
         "courses": courses,
         "grades": grade_list,
         "upcoming_exams": upcoming_exams,
+        "ranking": ranking,
         "stats": {
             "total_courses": len(courses),
             "total_credits": total_credits,
@@ -97,15 +122,13 @@ async def get_student_dashboard(
 
 @router.get("/courses")
 async def get_student_courses(
-    current_user: User = Depends(get_student_user),
+    current_user: Principal = Depends(get_student_user),
     db: Session = Depends(get_db)
 ):
-    student = db.query(Student).filter(Student.user_id == current_user.id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student profile not found")
+    student_id = get_student_id(current_user)
 
     enrollments = db.query(Enrollment).filter(
-        Enrollment.student_id == student.id,
+        Enrollment.student_id == student_id,
         Enrollment.status == "active"
     ).all()
 
@@ -126,17 +149,104 @@ async def get_student_courses(
 
     return courses
 
+def _enrollment_http_error(error: EnrollmentError) -> HTTPException:
+    headers = None
+    if error.status_code == 503:
+        headers = {"Retry-After": str(enrollment_service.LOCK_RETRY_AFTER_SECONDS)}
+    return HTTPException(status_code=error.status_code, detail=error.detail, headers=headers)
+
+@router.get("/catalog")
+async def get_course_catalog(
+    request: Request,
+    response: Response,
+    department: Optional[str] = None,
+    credits: Optional[int] = None,
+    day: Optional[int] = Query(None, ge=1, le=7),
+    teacher_id: Optional[int] = None,
+    availability: Optional[str] = None,
+    q: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    current_user: Principal = Depends(get_student_user)
+):
+    """可选课程目录，读取内存快照，不查询数据库；内容未变化时返回 304"""
+    if availability is not None and availability not in AVAILABILITY_VALUES:
+        raise HTTPException(status_code=400, detail=f"availability must be one of {', '.join(AVAILABILITY_VALUES)}")
+
+    await course_catalog.ensure_fresh()
+    headers = {"Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etag = course_catalog.etag()
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers={**headers, "ETag": etag})
+
+    filters = {
+        "department": department,
+        "credits": credits,
+        "day": day,
+        "teacher": teacher_id,
+        "availability": availability
+    }
+    etag, result = course_catalog.search(
+        {facet: value for facet, value in filters.items() if value is not None}, q, page, page_size
+    )
+    response.headers.update({**headers, "ETag": etag})
+    return result
+
+# 选课、退课是同步函数，在线程池中执行，等待写锁时不阻塞事件循环
+@router.post("/courses/{course_id}/enroll")
+def enroll_course(
+    course_id: int,
+    current_user: Principal = Depends(get_student_user),
+    db: Session = Depends(get_db)
+):
+    try:
+        result = enrollment_service.enroll(db, get_student_id(current_user), course_id)
+    except EnrollmentError as e:
+        raise _enrollment_http_error(e)
+    course_catalog.seats_changed([course_id])
+    # 本人和递补学生的日历订阅
+    calendar_feeds.invalidate_user(current_user.id)
+    calendar_feeds.invalidate_courses([course_id])
+    return result
+
+@router.post("/courses/{course_id}/drop")
+def drop_course(
+    course_id: int,
+    current_user: Principal = Depends(get_student_user),
+    db: Session = Depends(get_db)
+):
+    try:
+        result = enrollment_service.drop(db, get_student_id(current_user), course_id)
+    except EnrollmentError as e:
+        raise _enrollment_http_error(e)
+    course_catalog.seats_changed([course_id])
+    # 本人和递补学生的日历订阅
+    calendar_feeds.invalidate_user(current_user.id)
+    calendar_feeds.invalidate_courses([course_id])
+    return result
+
+@router.get("/waitlist")
+async def get_student_waitlist(
+    current_user: Principal = Depends(get_student_user),
+    db: Session = Depends(get_db)
+):
+    return enrollment_service.get_student_waitlist(db, get_student_id(current_user))
+
 @router.get("/grades")
 async def get_student_grades(
-    current_user: User = Depends(get_student_user),
+    current_user: Principal = Depends(get_student_user),
     semester: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    student = db.query(Student).filter(Student.user_id == current_user.id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student profile not found")
+    student_id = get_student_id(current_user)
 
-    query = db.query(Grade).filter(Grade.student_id == student.id)
+    # 只返回已提交和已审核的成绩，草稿和被退回的成绩对学生不可见
+    query = db.query(Grade).filter(
+        Grade.student_id == student_id,
+        Grade.status.in_(ANALYZED_STATUSES)
+    )
     if semester:
         query = query.filter(Grade.semester == semester)
 
@@ -162,51 +272,57 @@ async def get_student_grades(
 
 @router.get("/schedule")
 async def get_student_schedule(
-    current_user: User = Depends(get_student_user),
+    week: Optional[int] = Query(None, ge=1, description="第几周，指定时按单双周过滤上课时间"),
+    current_user: Principal = Depends(get_student_user),
     db: Session = Depends(get_db)
 ):
-    student = db.query(Student).filter(Student.user_id == current_user.id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student profile not found")
+    student_id = get_student_id(current_user)
 
-    enrollments = db.query(Enrollment).filter(
-        Enrollment.student_id == student.id,
+    rows = db.query(Course, User.full_name).join(
+        Enrollment, Enrollment.course_id == Course.id
+    ).outerjoin(Teacher, Course.teacher_id == Teacher.id).outerjoin(
+        User, Teacher.user_id == User.id
+    ).filter(
+        Enrollment.student_id == student_id,
         Enrollment.status == "active"
     ).all()
+    meetings = load_course_meetings(db, [course.id for course, _ in rows], week)
 
     schedule = []
-    for enrollment in enrollments:
-        course = enrollment.course
-        if course.schedule:
+    for course, teacher_name in rows:
+        if course.schedule or course.id in meetings:
             schedule.append({
                 "course_id": course.id,
                 "course_name": course.name,
-                "teacher": course.teacher.user.full_name if course.teacher else "未分配",
+                "teacher": teacher_name or "未分配",
                 "schedule": course.schedule,
                 "classroom": course.classroom,
-                "credits": course.credits
+                "credits": course.credits,
+                "meetings": meetings.get(course.id, [])
             })
 
     return schedule
 
 @router.get("/exams")
 async def get_student_exams(
-    current_user: User = Depends(get_student_user),
+    current_user: Principal = Depends(get_student_user),
     db: Session = Depends(get_db)
 ):
-    student = db.query(Student).filter(Student.user_id == current_user.id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student profile not found")
+    student_id = get_student_id(current_user)
 
-    exams = db.query(Exam).join(Course).join(Enrollment).filter(
-        Enrollment.student_id == student.id
-    ).all()
+    # 只看当前正式选课的课程；退课、候补的课程不显示考试
+    exams = db.query(Exam, Course.name).join(Course, Exam.course_id == Course.id).join(
+        Enrollment, Enrollment.course_id == Course.id
+    ).filter(
+        Enrollment.student_id == student_id,
+        Enrollment.status == "active"
+    ).order_by(Exam.date).all()
 
     exam_list = []
-    for exam in exams:
+    for exam, course_name in exams:
         exam_list.append({
             "id": exam.id,
-            "course": exam.course.name,
+            "course": course_name,
             "title": exam.title,
             "exam_type": exam.exam_type,
             "date": exam.date.isoformat(),
@@ -220,20 +336,42 @@ async def get_student_exams(
 
 @router.get("/profile")
 async def get_student_profile(
-    current_user: User = Depends(get_student_user),
+    current_user: Principal = Depends(get_student_user),
     db: Session = Depends(get_db)
 ):
-    student = db.query(Student).filter(Student.user_id == current_user.id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student profile not found")
+    student, user = load_student(db, current_user)
 
     return {
         "id": student.id,
         "student_id": student.student_id,
-        "full_name": current_user.full_name,
-        "email": current_user.email,
+        "full_name": user.full_name,
+        "email": user.email,
         "class_name": student.class_name,
         "enrollment_year": student.enrollment_year,
         "phone": student.phone,
         "address": student.address
-    }
\ No newline at end of file
+    }
+
+@router.get("/transcript")
+def download_transcript(
+    request: Request,
+    format: str = "pdf",
+    current_user: Principal = Depends(get_student_user),
+    db: Session = Depends(get_db)
+):
+    """本人成绩单（format=pdf 或 csv），成绩未变化时返回缓存的文件，ETag 为成绩版本"""
+    try:
+        transcript = transcripts.get(db, get_student_id(current_user), format)
+    except TranscriptError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if transcript is None:
+        raise HTTPException(status_code=404, detail="Student profile not found")
+
+    etag = f'"{transcript.version}"'
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=transcript.content, media_type=transcript.media_type, headers={
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f'attachment; filename="{transcript.filename}"'
+    })
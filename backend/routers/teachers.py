@@ -1,33 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func
 from typing import List, Optional
 from datetime import datetime, timedelta
+from concurrency import check_if_match, commit_versioned, precondition_failed, version_etag
 from database import get_db
-from models import User, UserRole, Teacher, Course, Enrollment, Grade, Attendance, Student
-# 将在函数内导入以避免循环导入
+from models import User, UserRole, Teacher, Course, Enrollment, Grade, Attendance, Student, Exam
+from routers.auth import Principal, require_role
+from serice import exam_service, grade_workflow_service
+from serice.calendar_service import calendar_feeds
+from serice.grade_analytics_service import grade_analytics
+from serice.ranking_service import rankings
+from serice.schedule_service import load_course_meetings
 
 router = APIRouter()
 
-def get_teacher_user(current_user):
-    from routers.auth import get_current_active_user, get_db
-    current_user = get_current_active_user(current_user)
-    if current_user.role != UserRole.TEACHER:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to access teacher resources"
-        )
-    return current_user
+# 仅凭令牌声明鉴权，不查询 User
+get_teacher_user = require_role(UserRole.TEACHER, "Not authorized to access teacher resources")
+
+def get_teacher_id(current_user: Principal) -> int:
+    """令牌中的档案ID即 Teacher.id"""
+    if current_user.profile_id is None:
+        raise HTTPException(status_code=404, detail="Teacher profile not found")
+    return current_user.profile_id
+
+def load_teacher(db: Session, current_user: Principal):
+    """一次查询取出教师档案及其用户信息"""
+    row = db.query(Teacher, User).join(User, Teacher.user_id == User.id).filter(
+        Teacher.id == get_teacher_id(current_user)
+    ).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Teacher profile not found")
+    return row
 
 @router.get("/dashboard")
 async def get_teacher_dashboard(
-    current_user: User = Depends(get_teacher_user),
+    current_user: Principal = Depends(get_teacher_user),
     db: Session = Depends(get_db)
 ):
     # 获取教师信息
-    teacher = db.query(Teacher).filter(Teacher.user_id == current_user.id).first()
-    if not teacher:
-        raise HTTPException(status_code=404, detail="Teacher profile not found")
+    teacher, user = load_teacher(db, current_user)
 
     # 获取教师课程
     courses = db.query(Course).filter(Course.teacher_id == teacher.id).all()
@@ -68,16 +80,19 @@ async def get_teacher_dashboard(
         })
 
     # 获取今日课程
-    today = datetime.now().strftime("%A")
+    today = datetime.now().isoweekday()
+    meetings = load_course_meetings(db, [course.id for course in courses])
     today_courses = []
     for course in courses:
-        if course.schedule and today in course.schedule:
-            today_courses.append({
-                "course": course.name,
-                "time": course.schedule,
-                "room": course.classroom,
-                "class": f"{course.name}班级"
-            })
+        for meeting in meetings.get(course.id, []):
+            if meeting["day"] == today:
+                today_courses.append({
+                    "course": course.name,
+                    "time": f"{meeting['start']}-{meeting['end']}",
+                    "room": meeting["room"] or course.classroom,
+                    "class": f"{course.name}班级"
+                })
+    today_courses.sort(key=lambda item: item["time"])
 
     # 获取学生出勤情况
     attendance_stats = []
@@ -87,8 +102,8 @@ async def get_teacher_dashboard(
             Student.user_id,
             User.full_name,
             func.count(Attendance.id).label('total'),
-            func.sum(func.case([(Attendance.status == 'present', 1)], else_=0)).label('present'),
-            func.sum(func.case([(Attendance.status == 'absent', 1)], else_=0)).label('absent')
+            func.sum(case((Attendance.status == 'present', 1), else_=0)).label('present'),
+            func.sum(case((Attendance.status == 'absent', 1), else_=0)).label('absent')
         ).join(Attendance).join(User).filter(
             Attendance.course_id == course.id
         ).group_by(Student.user_id, User.full_name).all()
@@ -134,11 +149,11 @@ async def get_teacher_dashboard(
 
     return {
         "teacher_info": {
-            "name": current_user.full_name,
+            "name": user.full_name,
             "teacher_id": teacher.teacher_id,
             "department": teacher.department,
             "title": teacher.title,
-            "email": current_user.email
+            "email": user.email
         },
         "courses": course_list,
         "recent_grades": grade_list,
@@ -154,16 +169,42 @@ async def get_teacher_dashboard(
         }
     }
 
+@router.get("/schedule")
+async def get_teacher_schedule(
+    week: Optional[int] = Query(None, ge=1, description="第几周，指定时按单双周过滤上课时间"),
+    current_user: Principal = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    teacher_id = get_teacher_id(current_user)
+
+    courses = db.query(Course).filter(
+        Course.teacher_id == teacher_id,
+        Course.is_active == True
+    ).all()
+    meetings = load_course_meetings(db, [course.id for course in courses], week)
+
+    return [
+        {
+            "course_id": course.id,
+            "course_name": course.name,
+            "code": course.code,
+            "schedule": course.schedule,
+            "classroom": course.classroom,
+            "credits": course.credits,
+            "meetings": meetings.get(course.id, [])
+        }
+        for course in courses
+        if course.schedule or course.id in meetings
+    ]
+
 @router.get("/courses")
 async def get_teacher_courses(
-    current_user: User = Depends(get_teacher_user),
+    current_user: Principal = Depends(get_teacher_user),
     db: Session = Depends(get_db)
 ):
-    teacher = db.query(Teacher).filter(Teacher.user_id == current_user.id).first()
-    if not teacher:
-        raise HTTPException(status_code=404, detail="Teacher profile not found")
+    teacher_id = get_teacher_id(current_user)
 
-    courses = db.query(Course).filter(Course.teacher_id == teacher.id).all()
+    courses = db.query(Course).filter(Course.teacher_id == teacher_id).all()
 
     course_list = []
     for course in courses:
@@ -191,17 +232,15 @@ async def get_teacher_courses(
 @router.get("/courses/{course_id}/students")
 async def get_course_students(
     course_id: int,
-    current_user: User = Depends(get_teacher_user),
+    current_user: Principal = Depends(get_teacher_user),
     db: Session = Depends(get_db)
 ):
-    teacher = db.query(Teacher).filter(Teacher.user_id == current_user.id).first()
-    if not teacher:
-        raise HTTPException(status_code=404, detail="Teacher profile not found")
+    teacher_id = get_teacher_id(current_user)
 
     # 验证课程属于该教师
     course = db.query(Course).filter(
         Course.id == course_id,
-        Course.teacher_id == teacher.id
+        Course.teacher_id == teacher_id
     ).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found or not authorized")
@@ -230,21 +269,26 @@ async def get_course_students(
 async def submit_grade(
     student_id: int,
     course_id: int,
+    response: Response,
     midterm_score: Optional[float] = None,
     final_score: Optional[float] = None,
     usual_score: Optional[float] = None,
     semester: str = "2024-1",
-    current_user: User = Depends(get_teacher_user),
+    version: Optional[int] = None,
+    if_match: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_teacher_user),
     db: Session = Depends(get_db)
 ):
-    teacher = db.query(Teacher).filter(Teacher.user_id == current_user.id).first()
-    if not teacher:
-        raise HTTPException(status_code=404, detail="Teacher profile not found")
+    """
+    录入或修改一名学生的成绩，保存为草稿，按课程提交后进入审核。
+    修改已有成绩时可带 If-Match（或 version 参数）为读取时的版本，不一致时返回 412。
+    """
+    teacher_id = get_teacher_id(current_user)
 
     # 验证课程属于该教师
     course = db.query(Course).filter(
         Course.id == course_id,
-        Course.teacher_id == teacher.id
+        Course.teacher_id == teacher_id
     ).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found or not authorized")
@@ -296,8 +340,17 @@ async def submit_grade(
         Grade.semester == semester
     ).first()
 
+    if existing_grade is None and (if_match is not None or version is not None):
+        raise precondition_failed()
     if existing_grade:
-        # 更新现有成绩
+        check_if_match(if_match, existing_grade.version)
+        if version is not None and existing_grade.version != version:
+            raise precondition_failed(existing_grade.version)
+        if existing_grade.status not in grade_workflow_service.EDITABLE_STATUSES:
+            raise HTTPException(status_code=409, detail="Approved grades are locked")
+
+    if existing_grade:
+        # 更新现有成绩，已提交的成绩撤回为草稿
         if midterm_score is not None:
             existing_grade.midterm_score = midterm_score
         if final_score is not None:
@@ -307,7 +360,7 @@ async def submit_grade(
         existing_grade.total_score = total_score
         existing_grade.gpa = gpa
         existing_grade.graded_at = datetime.now()
-        existing_grade.status = "submitted"
+        existing_grade.status = "draft"
     else:
         # 创建新成绩记录
         new_grade = Grade(
@@ -320,28 +373,123 @@ async def submit_grade(
             gpa=gpa,
             semester=semester,
             academic_year="2024",
-            status="submitted"
+            status="draft"
         )
         db.add(new_grade)
 
-    db.commit()
+    commit_versioned(db)
+    grade_analytics.invalidate_course(course_id)
+    rankings.grade_changed(db, student_id, course_id)
+
+    grade = existing_grade or new_grade
+    response.headers["ETag"] = version_etag(grade.version)
+    return {
+        "message": "Grade saved successfully",
+        "id": grade.id,
+        "total_score": total_score,
+        "gpa": gpa,
+        "status": grade.status,
+        "version": grade.version
+    }
+
+@router.get("/courses/{course_id}/grades")
+async def get_course_grades(
+    course_id: int,
+    semester: Optional[str] = None,
+    current_user: Principal = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    """课程成绩及审核状态，version 用于修改和提交时的并发检查"""
+    teacher_id = get_teacher_id(current_user)
+
+    course = db.query(Course).filter(
+        Course.id == course_id,
+        Course.teacher_id == teacher_id
+    ).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found or not authorized")
+
+    query = db.query(Grade, Student.student_id, User.full_name).join(
+        Student, Grade.student_id == Student.id
+    ).join(User, Student.user_id == User.id).filter(Grade.course_id == course_id)
+    if semester:
+        query = query.filter(Grade.semester == semester)
+
+    grades = []
+    counts = {status: 0 for status in grade_workflow_service.GRADE_STATUSES}
+    for grade, student_number, name in query.order_by(Grade.semester, Student.student_id):
+        counts[grade.status] = counts.get(grade.status, 0) + 1
+        grades.append({
+            "id": grade.id,
+            "student_id": grade.student_id,
+            "student_number": student_number,
+            "student_name": name,
+            "semester": grade.semester,
+            "midterm_score": grade.midterm_score,
+            "final_score": grade.final_score,
+            "usual_score": grade.usual_score,
+            "total_score": grade.total_score,
+            "gpa": grade.gpa,
+            "status": grade.status,
+            "version": grade.version,
+            "review_comment": grade.review_comment
+        })
 
-    return {"message": "Grade submitted successfully", "total_score": total_score, "gpa": gpa}
+    return {"course_id": course_id, "semester": semester, "counts": counts, "grades": grades}
+
+@router.post("/courses/{course_id}/grades/submit")
+def submit_course_grades(
+    course_id: int,
+    request: grade_workflow_service.GradeSubmitRequest,
+    current_user: Principal = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    """提交课程一个学期的草稿和被退回的成绩进入审核；grades 指定时只提交其中版本号一致的成绩"""
+    teacher_id = get_teacher_id(current_user)
+
+    course = db.query(Course).filter(
+        Course.id == course_id,
+        Course.teacher_id == teacher_id
+    ).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found or not authorized")
+
+    try:
+        return grade_workflow_service.submit_course_grades(db, course_id, request.semester, request.grades)
+    except grade_workflow_service.GradeWorkflowError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@router.get("/courses/{course_id}/analytics")
+def get_course_analytics(
+    course_id: int,
+    semester: Optional[str] = None,
+    current_user: Principal = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    """本人课程的成绩分析（分布、分位数、相关系数、档次人数），结果缓存到下次提交成绩"""
+    teacher_id = get_teacher_id(current_user)
+
+    course = db.query(Course).filter(
+        Course.id == course_id,
+        Course.teacher_id == teacher_id
+    ).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found or not authorized")
+
+    return grade_analytics.course(db, course, semester)
 
 @router.get("/attendance/{course_id}")
 async def get_course_attendance(
     course_id: int,
-    current_user: User = Depends(get_teacher_user),
+    current_user: Principal = Depends(get_teacher_user),
     db: Session = Depends(get_db)
 ):
-    teacher = db.query(Teacher).filter(Teacher.user_id == current_user.id).first()
-    if not teacher:
-        raise HTTPException(status_code=404, detail="Teacher profile not found")
+    teacher_id = get_teacher_id(current_user)
 
     # 验证课程属于该教师
     course = db.query(Course).filter(
         Course.id == course_id,
-        Course.teacher_id == teacher.id
+        Course.teacher_id == teacher_id
     ).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found or not authorized")
@@ -360,4 +508,76 @@ async def get_course_attendance(
             "notes": attendance.notes
         })
 
-    return attendance_list
\ No newline at end of file
+    return attendance_list
+
+
+def _load_own_exam(db: Session, exam_id: int, teacher_id: int) -> Exam:
+    exam = db.query(Exam).join(Course, Exam.course_id == Course.id).filter(
+        Exam.id == exam_id,
+        Course.teacher_id == teacher_id
+    ).first()
+    if not exam:
+        raise HTTPException(status_code=404, detail="Exam not found or not authorized")
+    return exam
+
+@router.get("/exams")
+async def get_teacher_exams(
+    current_user: Principal = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    teacher_id = get_teacher_id(current_user)
+
+    rows = db.query(Exam, Course.name).join(Course, Exam.course_id == Course.id).filter(
+        Course.teacher_id == teacher_id
+    ).order_by(Exam.date, Exam.id).all()
+    return [exam_service.serialize_exam(exam, name) for exam, name in rows]
+
+@router.post("/courses/{course_id}/exams")
+async def create_course_exam(
+    course_id: int,
+    request: exam_service.ExamFields,
+    current_user: Principal = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    teacher_id = get_teacher_id(current_user)
+
+    # 验证课程属于该教师
+    if not db.query(Course.id).filter(Course.id == course_id, Course.teacher_id == teacher_id).first():
+        raise HTTPException(status_code=404, detail="Course not found or not authorized")
+    try:
+        exam = exam_service.create_exam(db, course_id, request)
+    except exam_service.ExamError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    calendar_feeds.invalidate_courses([course_id])
+    exam_service.upcoming_exams.invalidate([course_id])
+    return {**exam_service.serialize_exam(exam), "conflicts": exam_service.exam_conflicts(db, exam)}
+
+@router.put("/exams/{exam_id}")
+async def update_course_exam(
+    exam_id: int,
+    request: exam_service.ExamUpdateRequest,
+    current_user: Principal = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    exam = _load_own_exam(db, exam_id, get_teacher_id(current_user))
+    try:
+        exam = exam_service.update_exam(db, exam, request)
+    except exam_service.ExamError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    calendar_feeds.invalidate_courses([exam.course_id])
+    exam_service.upcoming_exams.invalidate([exam.course_id])
+    return {**exam_service.serialize_exam(exam), "conflicts": exam_service.exam_conflicts(db, exam)}
+
+@router.delete("/exams/{exam_id}")
+async def delete_course_exam(
+    exam_id: int,
+    current_user: Principal = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    exam = _load_own_exam(db, exam_id, get_teacher_id(current_user))
+    course_id = exam.course_id
+    db.delete(exam)
+    db.commit()
+    calendar_feeds.invalidate_courses([course_id])
+    exam_service.upcoming_exams.invalidate([course_id])
+    return {"message": "Exam deleted successfully"}
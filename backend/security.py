@@ -0,0 +1,112 @@
+"""
+密码哈希模块
+
+按哈希前缀识别算法，不再依赖异常回退；bcrypt 等耗时的 KDF
+放到线程池执行，避免阻塞事件循环；旧的 SHA-256 哈希在登录成功后自动升级。
+"""
+
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import string
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+# 只启用已安装后端的算法；无法识别前缀的哈希直接校验失败，不会交给 passlib 抛出 MissingBackendError
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+SCHEME_BCRYPT = "bcrypt"
+SCHEME_SHA256 = "sha256"
+
+_PREFIX_SCHEMES = (
+    ("$2a$", SCHEME_BCRYPT),
+    ("$2b$", SCHEME_BCRYPT),
+    ("$2y$", SCHEME_BCRYPT),
+)
+_HEX_DIGITS = frozenset(string.hexdigits)
+
+# 批量计算哈希的进程数，默认等于 CPU 核数
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or os.cpu_count() or 1
+INITIAL_PASSWORD_BYTES = 9
+
+
+def identify_hash(hashed_password: Optional[str]) -> Optional[str]:
+    """根据前缀识别哈希算法，无法识别时返回 None"""
+    if not hashed_password:
+        return None
+    for prefix, scheme in _PREFIX_SCHEMES:
+        if hashed_password.startswith(prefix):
+            return scheme
+    # 旧版测试数据使用无盐 SHA-256 的十六进制摘要
+    if len(hashed_password) == 64 and _HEX_DIGITS.issuperset(hashed_password):
+        return SCHEME_SHA256
+    return None
+
+
+def _sha256_hex(password: str) -> str:
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    scheme = identify_hash(hashed_password)
+    if scheme == SCHEME_SHA256:
+        return hmac.compare_digest(_sha256_hex(plain_password), hashed_password.lower())
+    if scheme is None:
+        return False
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def generate_initial_password() -> str:
+    """批量创建账号时的随机初始密码（12 个 URL 安全字符）"""
+    return secrets.token_urlsafe(INITIAL_PASSWORD_BYTES)
+
+
+def password_hash_pool(workers: int = PASSWORD_HASH_WORKERS) -> ProcessPoolExecutor:
+    """批量计算哈希用的进程池；服务进程中有多个线程，用 spawn 避免 fork 继承被持有的锁"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def get_password_hashes(passwords: Sequence[str], executor: Optional[Executor] = None) -> List[str]:
+    """批量计算 bcrypt 哈希，传入进程池时分散到多个进程并行计算"""
+    if executor is None:
+        return [get_password_hash(password) for password in passwords]
+    return list(executor.map(get_password_hash, passwords, chunksize=16))
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """旧的 SHA-256 哈希或参数过期的 KDF 哈希都需要重新生成"""
+    scheme = identify_hash(hashed_password)
+    if scheme is None:
+        return False
+    if scheme == SCHEME_SHA256:
+        return True
+    return pwd_context.needs_update(hashed_password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    # SHA-256 校验很便宜，直接在事件循环中完成
+    if identify_hash(hashed_password) in (SCHEME_SHA256, None):
+        return verify_password(plain_password, hashed_password)
+    return await run_in_threadpool(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await run_in_threadpool(get_password_hash, password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """校验密码，校验通过且哈希需要升级时返回新哈希"""
+    if not await verify_password_async(plain_password, hashed_password):
+        return False, None
+    if needs_rehash(hashed_password):
+        return True, await get_password_hash_async(plain_password)
+    return True, None
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+批量合成数据生成工具
+
+先调用 init_data.create_test_data 创建基础账号（admin / teacher001 / 2023001），
+再用 Core insert() 按批次 executemany 生成用户、学生、教师、课程、选课、成绩、
+考试、考勤、好友关系和系统日志。全部写入在一个事务内完成，主键预先分配，
+不经过 ORM 会话；写入期间调整 SQLite PRAGMA（关闭同步、内存日志和临时表、
+加大页缓存）。同一 seed 和参考日期生成的合成数据完全相同
+（基础账号的创建时间除外）。
+
+合成用户名为 <前缀>s0000000（学生）/ <前缀>t0000000（教师），
+密码均为 benchmark123（旧 SHA-256 哈希，首次登录时升级）。
+
+用法:
+  python seed_data.py --db /tmp/seed.db --students 20000 --courses 1000 --attendance 800000
+  python seed_data.py --db student_system.db --append --prefix x --students 500
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import hashlib
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from init_data import create_test_data
+from models import (
+    Base, User, UserRole, Student, Teacher, Course, CourseMeeting, Enrollment, Grade, Attendance, Exam,
+    Friendship, SystemLog
+)
+from serice.enrollment_service import STATUS_ACTIVE, STATUS_DROPPED, STATUS_WAITLISTED, WAITLIST_LIMIT
+from serice.schedule_service import parse_schedule
+
+PASSWORD = "benchmark123"
+
+DEFAULT_STUDENTS = 100_000
+DEFAULT_COURSES = 5_000
+DEFAULT_ATTENDANCE = 10_000_000
+COURSES_PER_TEACHER = 5
+ENROLLMENTS_PER_STUDENT = 6
+GRADED_FRACTION = 0.5
+EXAMS_PER_COURSE = 2
+FRIENDSHIPS_PER_STUDENT = 2
+SYSTEM_LOGS = 5_000
+BATCH_SIZE = 10_000
+
+# 写入期间使用的 PRAGMA，结束后恢复同步、日志模式和外键检查（恢复为写入前的设置）
+BULK_PRAGMAS = (
+    "PRAGMA synchronous = OFF",
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA foreign_keys = OFF",
+)
+RESTORE_PRAGMAS = (
+    "PRAGMA journal_mode = DELETE",
+    "PRAGMA synchronous = FULL",
+)
+
+DEPARTMENTS = ["计算机科学系", "软件工程系", "数学系", "物理系", "电子工程系", "经济学系", "外语系", "化学系"]
+TITLES = ["助教", "讲师", "副教授", "教授"]
+MAJORS = ["计算机科学", "软件工程", "数学", "物理", "电子工程", "经济学", "英语", "化学"]
+WEEKDAYS = ["一", "二", "三", "四", "五"]
+SLOTS = ["8:00-9:30", "10:00-11:30", "14:00-15:30", "16:00-17:30", "19:00-20:30"]
+BUILDINGS = ["A", "B", "C", "D", "E"]
+ATTENDANCE_STATUSES = ["present", "late", "absent", "excused"]
+ATTENDANCE_WEIGHTS = [85, 7, 5, 3]
+LOG_ACTIONS = ["登录", "修改课程", "提交成绩", "登录失败", "更新个人信息"]
+
+SEMESTER_START = datetime(2024, 9, 2, 8, 0)
+
+
+def synthetic_username(prefix, index):
+    return f"{prefix}{index:07d}"
+
+
+def _next_id(conn, model):
+    return (conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _insert_batches(conn, table, rows, batch_size=BATCH_SIZE):
+    """按批次 executemany 插入，返回插入行数"""
+    batch = []
+    total = 0
+    insert = table.insert()
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.execute(insert, batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        conn.execute(insert, batch)
+        total += len(batch)
+    return total
+
+
+def _score_to_gpa(score):
+    if score >= 90:
+        return 4.0
+    if score >= 60:
+        return round(1.0 + (score - 60) / 10, 1)
+    return 0.0
+
+
+def _clamp_score(score):
+    return round(min(100.0, max(0.0, score)), 1)
+
+
+def seed_database(engine, students=DEFAULT_STUDENTS, teachers=None, courses=DEFAULT_COURSES,
+                  enrollments_per_student=ENROLLMENTS_PER_STUDENT, graded_fraction=GRADED_FRACTION,
+                  attendance=DEFAULT_ATTENDANCE, exams_per_course=EXAMS_PER_COURSE,
+                  friendships=None, system_logs=SYSTEM_LOGS, seed=42, reference_date=None,
+                  prefix="b", base_accounts=True, batch_size=BATCH_SIZE, log=print):
+    """在 engine 指向的 SQLite 数据库中生成合成数据，返回各表插入的行数
+
+    teachers 默认为每 5 门课一名教师，friendships 默认为每个学生 2 个好友关系。
+    reference_date 为“当前时间”的基准（默认今天），考试日期和日志时间以它为准。
+    """
+    rng = random.Random(seed)
+    Base.metadata.create_all(bind=engine)
+
+    if base_accounts:
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        db = session_factory()
+        try:
+            create_test_data(db)
+        finally:
+            db.close()
+
+    teachers = teachers if teachers is not None else max(1, courses // COURSES_PER_TEACHER)
+    friendships = friendships if friendships is not None else students * FRIENDSHIPS_PER_STUDENT
+    password_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    now = datetime.combine(reference_date or date.today(), datetime.min.time())
+    code_prefix = prefix.upper()
+    counts = {}
+
+    with engine.begin() as conn:
+        foreign_keys = conn.exec_driver_sql("PRAGMA foreign_keys").scalar()
+        for pragma in BULK_PRAGMAS:
+            conn.exec_driver_sql(pragma)
+
+        def step(name, table, rows):
+            start = time.perf_counter()
+            counts[name] = _insert_batches(conn, table, rows, batch_size)
+            log(f"  {name}: {counts[name]} 行, {time.perf_counter() - start:.1f}s")
+
+        user_id = _next_id(conn, User)
+        student_id = _next_id(conn, Student)
+        teacher_id = _next_id(conn, Teacher)
+        course_id = _next_id(conn, Course)
+        enrollment_id = _next_id(conn, Enrollment)
+
+        teacher_user_ids = range(user_id, user_id + teachers)
+        student_user_ids = range(user_id + teachers, user_id + teachers + students)
+        teacher_ids = range(teacher_id, teacher_id + teachers)
+        student_ids = range(student_id, student_id + students)
+        course_ids = range(course_id, course_id + courses)
+
+        def user_rows():
+            for i, uid in enumerate(teacher_user_ids):
+                name = synthetic_username(f"{prefix}t", i)
+                yield {
+                    "id": uid, "username": name, "email": f"{name}@bench.local",
+                    "password_hash": password_hash, "full_name": f"教师{i}",
+                    "role": UserRole.TEACHER, "is_active": True, "token_version": 0,
+                    "created_at": now - timedelta(days=rng.randrange(720)), "updated_at": now
+                }
+            for i, uid in enumerate(student_user_ids):
+                name = synthetic_username(f"{prefix}s", i)
+                yield {
+                    "id": uid, "username": name, "email": f"{name}@bench.local",
+                    "password_hash": password_hash, "full_name": f"学生{i}",
+                    "role": UserRole.STUDENT, "is_active": rng.random() > 0.02, "token_version": 0,
+                    "created_at": now - timedelta(days=rng.randrange(720)), "updated_at": now
+                }
+
+        step("users", User.__table__, user_rows())
+
+        step("teachers", Teacher.__table__, (
+            {
+                "id": tid, "user_id": uid, "teacher_id": f"{code_prefix}T{i:06d}",
+                "department": DEPARTMENTS[i % len(DEPARTMENTS)], "title": rng.choice(TITLES),
+                "phone": f"138{i:08d}", "office_address": f"{rng.choice(BUILDINGS)}楼{rng.randint(101, 599)}"
+            }
+            for i, (tid, uid) in enumerate(zip(teacher_ids, teacher_user_ids))
+        ))
+
+        def student_rows():
+            for i, (sid, uid) in enumerate(zip(student_ids, student_user_ids)):
+                year = 2021 + i % 4
+                yield {
+                    "id": sid, "user_id": uid, "student_id": f"{code_prefix}S{i:08d}",
+                    "class_name": f"{MAJORS[i % len(MAJORS)]}{year}-{(i // len(MAJORS)) % 8 + 1}班",
+                    "enrollment_year": year, "phone": f"139{i:08d}", "address": f"学生宿舍{i % 50 + 1}号楼"
+                }
+
+        step("students", Student.__table__, student_rows())
+
+        course_schedules = []
+        course_capacity = {}
+
+        def course_rows():
+            for i, cid in enumerate(course_ids):
+                days = sorted(rng.sample(WEEKDAYS, 2), key=WEEKDAYS.index)
+                row = {
+                    "id": cid, "name": f"{MAJORS[i % len(MAJORS)]}课程{i}", "code": f"{code_prefix}C{i:06d}",
+                    "description": "合成数据课程", "credits": rng.randint(1, 5),
+                    "teacher_id": teacher_ids[i % teachers],
+                    "classroom": f"{rng.choice(BUILDINGS)}{rng.randint(101, 599)}",
+                    "schedule": f"周{'、'.join(days)} {rng.choice(SLOTS)}",
+                    "max_students": rng.choice([30, 50, 80, 120, 200]), "is_active": rng.random() > 0.05,
+                    "created_at": now, "updated_at": now
+                }
+                course_schedules.append((cid, row["schedule"], row["classroom"]))
+                course_capacity[cid] = row["max_students"]
+                yield row
+
+        step("courses", Course.__table__, course_rows())
+        step("course_meetings", CourseMeeting.__table__, (
+            {"course_id": cid, **meeting}
+            for cid, schedule, classroom in course_schedules
+            for meeting in parse_schedule(schedule, classroom)
+        ))
+
+        # 选课：每个学生随机选若干门课，在读人数不超过 max_students，超出的进入候补队列，
+        # 候补队列也满时放弃这门课；成绩和考勤只生成给占座的（在读和已退课）选课
+        enrollments = []
+        enrollment_pairs = []
+        seats = {cid: [0, 0] for cid in course_ids}  # 课程 -> [在读人数, 候补人数]
+        per_student = min(enrollments_per_student, courses)
+        for sid in student_ids:
+            for cid in rng.sample(course_ids, per_student):
+                taken = seats[cid]
+                if rng.random() <= 0.05:
+                    status = STATUS_DROPPED
+                elif taken[0] < course_capacity[cid]:
+                    status = STATUS_ACTIVE
+                    taken[0] += 1
+                elif taken[1] < WAITLIST_LIMIT:
+                    status = STATUS_WAITLISTED
+                    taken[1] += 1
+                else:
+                    continue
+                enrollments.append((sid, cid, status))
+                if status != STATUS_WAITLISTED:
+                    enrollment_pairs.append((sid, cid))
+
+        step("enrollments", Enrollment.__table__, (
+            {
+                "id": enrollment_id + i, "student_id": sid, "course_id": cid,
+                "enrollment_date": SEMESTER_START - timedelta(days=rng.randrange(30)),
+                "status": status
+            }
+            for i, (sid, cid, status) in enumerate(enrollments)
+        ))
+
+        def grade_rows():
+            for sid, cid in enrollment_pairs:
+                if rng.random() >= graded_fraction:
+                    continue
+                midterm = _clamp_score(rng.gauss(78, 10))
+                final = _clamp_score(rng.gauss(75, 12))
+                usual = _clamp_score(rng.gauss(85, 8))
+                total = round(min(100.0, max(0.0, midterm * 0.3 + final * 0.5 + usual * 0.2)), 1)
+                yield {
+                    "student_id": sid, "course_id": cid, "midterm_score": midterm,
+                    "final_score": final, "usual_score": usual, "total_score": total,
+                    "gpa": _score_to_gpa(total), "semester": "2024-1", "academic_year": "2024",
+                    "graded_at": now, "status": rng.choice(["draft", "submitted", "approved"])
+                }
+
+        step("grades", Grade.__table__, grade_rows())
+
+        def exam_rows():
+            for cid in course_ids:
+                for n in range(exams_per_course):
+                    yield {
+                        "course_id": cid, "title": "期中考试" if n == 0 else "期末考试",
+                        "exam_type": "midterm" if n == 0 else "final",
+                        "date": now + timedelta(days=rng.randint(-60, 90), hours=rng.choice([8, 10, 14])),
+                        "duration": rng.choice([90, 120]),
+                        "location": f"{rng.choice(BUILDINGS)}{rng.randint(101, 599)}",
+                        "max_score": 100.0
+                    }
+
+        step("exams", Exam.__table__, exam_rows())
+
+        def attendance_rows():
+            if not enrollment_pairs or attendance <= 0:
+                return
+            per_enrollment, remainder = divmod(attendance, len(enrollment_pairs))
+            for i, (sid, cid) in enumerate(enrollment_pairs):
+                sessions = per_enrollment + (1 if i < remainder else 0)
+                statuses = rng.choices(ATTENDANCE_STATUSES, ATTENDANCE_WEIGHTS, k=sessions)
+                offset = cid % 5
+                for week, status in enumerate(statuses):
+                    when = SEMESTER_START + timedelta(days=week * 7 + offset)
+                    yield {
+                        "student_id": sid, "course_id": cid, "date": when,
+                        "status": status, "recorded_at": when
+                    }
+
+        step("attendances", Attendance.__table__, attendance_rows())
+
+        def friendship_rows():
+            if students < 2:
+                return
+            seen = set()
+            attempts = 0
+            # 好友关系不重复，user1_id < user2_id
+            while len(seen) < friendships and attempts < friendships * 3:
+                attempts += 1
+                a, b = rng.sample(student_user_ids, 2)
+                pair = (a, b) if a < b else (b, a)
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                yield {
+                    "user1_id": pair[0], "user2_id": pair[1],
+                    "created_at": now - timedelta(days=rng.randrange(365)), "status": "active"
+                }
+
+        step("friendships", Friendship.__table__, friendship_rows())
+
+        log_user_ids = list(teacher_user_ids) + list(student_user_ids[:1000])
+        step("system_logs", SystemLog.__table__, (
+            {
+                "user_id": rng.choice(log_user_ids) if log_user_ids else None, "action": action,
+                "resource_type": "user", "ip_address": f"10.0.{rng.randrange(256)}.{rng.randrange(256)}",
+                "status": "failed" if action == "登录失败" else "success",
+                "created_at": now - timedelta(minutes=rng.randrange(60 * 24 * 30))
+            }
+            for action in (rng.choice(LOG_ACTIONS) for _ in range(system_logs))
+        ))
+
+    with engine.connect() as conn:
+        for pragma in RESTORE_PRAGMAS:
+            conn.exec_driver_sql(pragma)
+        conn.exec_driver_sql(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+        conn.exec_driver_sql("ANALYZE")
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量生成合成数据")
+    parser.add_argument("--db", required=True, help="目标 SQLite 文件")
+    parser.add_argument("--append", action="store_true", help="允许写入已存在的数据库（不再创建基础账号）")
+    parser.add_argument("--students", type=int, default=DEFAULT_STUDENTS)
+    parser.add_argument("--teachers", type=int, help="默认每 5 门课一名教师")
+    parser.add_argument("--courses", type=int, default=DEFAULT_COURSES)
+    parser.add_argument("--enrollments-per-student", type=int, default=ENROLLMENTS_PER_STUDENT)
+    parser.add_argument("--graded-fraction", type=float, default=GRADED_FRACTION, help="有成绩的选课比例")
+    parser.add_argument("--attendance", type=int, default=DEFAULT_ATTENDANCE, help="考勤记录总数")
+    parser.add_argument("--exams-per-course", type=int, default=EXAMS_PER_COURSE)
+    parser.add_argument("--friendships", type=int, help="默认每个学生 2 个")
+    parser.add_argument("--logs", type=int, default=SYSTEM_LOGS, help="系统日志条数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--reference-date", type=date.fromisoformat, help="基准日期 YYYY-MM-DD，默认今天")
+    parser.add_argument("--prefix", default="b", help="合成用户名和编号前缀，追加数据时避免冲突")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    exists = os.path.exists(args.db)
+    if exists and not args.append:
+        sys.exit(f"{args.db} 已存在，追加数据请使用 --append")
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+
+    engine = create_engine(f"sqlite:///{args.db}")
+    start = time.perf_counter()
+    counts = seed_database(
+        engine,
+        students=args.students,
+        teachers=args.teachers,
+        courses=args.courses,
+        enrollments_per_student=args.enrollments_per_student,
+        graded_fraction=args.graded_fraction,
+        attendance=args.attendance,
+        exams_per_course=args.exams_per_course,
+        friendships=args.friendships,
+        system_logs=args.logs,
+        seed=args.seed,
+        reference_date=args.reference_date,
+        prefix=args.prefix,
+        base_accounts=not exists,
+        batch_size=args.batch_size
+    )
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    print(f"共插入 {total} 行，用时 {elapsed:.1f}s（{total / elapsed:,.0f} 行/秒）")
+
+
+if __name__ == "__main__":
+    main()
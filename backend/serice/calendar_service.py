@@ -0,0 +1,300 @@
+"""
+iCalendar 订阅（.ics）
+
+学生（已选课程）和教师（任课课程）各有一个订阅地址，包含每周上课时间和考试。
+订阅地址中的令牌是不过期的签名令牌（见 routers/auth.py 的 create_feed_token），
+日历客户端无法携带 Authorization 头，只能通过地址鉴权；退出全部设备（令牌版本递增）后旧地址失效。
+
+日历客户端通常每 15 分钟轮询一次，内容很少变化。生成结果按用户缓存在内存中：
+  - 选课、退课、课程时间或教室修改、考试修改后，按课程找到相关用户标记过期
+    （课程 -> 用户的反向索引在生成时建立，包含候补的课程，递补后也能失效）
+  - 另有 CALENDAR_FEED_MAX_AGE_SECONDS 的兜底过期，覆盖其他进程的修改
+ETag 是日历内容的哈希，Last-Modified 是内容最近一次变化的时间。缓存未过期时
+条件请求（If-None-Match / If-Modified-Since）直接返回 304，不查询数据库。
+
+每周课程生成带 RRULE 的重复事件，从学期第一周开始重复 TERM_WEEKS 周，单双周间隔两周。
+学期开始日期由 TERM_START_DATE 指定（YYYY-MM-DD），未指定时秋季学期取 9 月 1 日、
+春季学期取 2 月 20 日之后的第一个周一。时间为本地时间（floating），时区由 CALENDAR_TIMEZONE 标注。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from models import Course, CourseMeeting, Enrollment, Exam, Teacher, User, UserRole
+from serice.schedule_service import WEEK_EVEN, WEEK_ODD, MeetingSlot, slot_from_meeting
+
+CALENDAR_FEED_MAX_AGE_SECONDS = int(os.getenv("CALENDAR_FEED_MAX_AGE_SECONDS", "3600"))
+CALENDAR_FEED_CACHE_SIZE = 20000
+CALENDAR_TIMEZONE = os.getenv("CALENDAR_TIMEZONE", "Asia/Shanghai")
+TERM_START_DATE = os.getenv("TERM_START_DATE")
+TERM_WEEKS = int(os.getenv("TERM_WEEKS", "18"))
+
+PRODUCT_ID = "-//Student System//Calendar Feed//ZH"
+UID_DOMAIN = "student-system"
+
+# 选课记录中计入日历的状态：正式选课出现在日历中，候补只用于失效索引
+ENROLLMENT_STATUSES = ("active", "waitlisted")
+
+
+def term_start(today: Optional[date] = None) -> date:
+    """学期第一周的周一"""
+    if TERM_START_DATE:
+        start = datetime.strptime(TERM_START_DATE, "%Y-%m-%d").date()
+        return start - timedelta(days=start.weekday())
+    today = today or date.today()
+    if today.month >= 8:
+        anchor = date(today.year, 9, 1)
+    elif today.month >= 2:
+        anchor = date(today.year, 2, 20)
+    else:
+        anchor = date(today.year - 1, 9, 1)
+    return anchor + timedelta(days=(7 - anchor.weekday()) % 7)
+
+
+def _escape(value) -> str:
+    return (
+        str(value).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    """按 RFC 5545 把超过 75 字节的行折行，不拆开多字节字符"""
+    if len(line.encode()) <= 75:
+        return line
+    parts, current, size = [], "", 0
+    for char in line:
+        length = len(char.encode())
+        if size + length > (75 if not parts else 74):
+            parts.append(current)
+            current, size = "", 0
+        current += char
+        size += length
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+
+def _local(value: datetime) -> str:
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+def _course_events(course: dict, meetings: List[MeetingSlot], start: date) -> List[dict]:
+    events = []
+    for meeting in meetings:
+        first = start + timedelta(days=meeting.day - 1)
+        interval, count = 1, TERM_WEEKS
+        if meeting.week_pattern == WEEK_ODD:
+            interval, count = 2, (TERM_WEEKS + 1) // 2
+        elif meeting.week_pattern == WEEK_EVEN:
+            first += timedelta(days=7)
+            interval, count = 2, TERM_WEEKS // 2
+        if count <= 0:
+            continue
+        midnight = datetime.combine(first, datetime.min.time())
+        events.append({
+            "uid": f"course-{course['id']}-{meeting.day}-{meeting.start}-{meeting.week_pattern}",
+            "summary": course["name"],
+            "start": _local(midnight + timedelta(minutes=meeting.start)),
+            "end": _local(midnight + timedelta(minutes=meeting.end)),
+            "rrule": f"FREQ=WEEKLY;INTERVAL={interval};COUNT={count}",
+            "location": meeting.room or course["classroom"],
+            "description": f"课程代码: {course['code']}\n教师: {course['teacher']}",
+            "categories": "课程"
+        })
+    return events
+
+
+def _exam_event(exam: Exam, course_name: str) -> dict:
+    return {
+        "uid": f"exam-{exam.id}",
+        "summary": f"{course_name} {exam.title}",
+        "start": _local(exam.date),
+        # 未填写时长的考试只标注开始时间
+        "end": _local(exam.date + timedelta(minutes=exam.duration)) if exam.duration else None,
+        "rrule": None,
+        "location": exam.location,
+        "description": exam.description,
+        "categories": "考试"
+    }
+
+
+def load_feed_events(db: Session, role: UserRole, profile_id: int):
+    """返回 (日历名称, 事件列表, 关联课程ID集合)；学生按已选课程，教师按任课课程"""
+    if role == UserRole.STUDENT:
+        statuses = dict(db.query(Enrollment.course_id, Enrollment.status).filter(
+            Enrollment.student_id == profile_id,
+            Enrollment.status.in_(ENROLLMENT_STATUSES)
+        ).all())
+        related = set(statuses)
+        shown = [course_id for course_id, status in statuses.items() if status == "active"]
+        course_filter = Course.id.in_(shown)
+        title = "我的课表"
+    else:
+        course_filter = Course.teacher_id == profile_id
+        related = None
+        title = "我的授课"
+
+    rows = db.query(
+        Course.id, Course.name, Course.code, Course.classroom, User.full_name
+    ).outerjoin(Teacher, Course.teacher_id == Teacher.id).outerjoin(
+        User, Teacher.user_id == User.id
+    ).filter(course_filter, Course.is_active == True).order_by(Course.id).all()
+    courses = {
+        row.id: {"id": row.id, "name": row.name, "code": row.code, "classroom": row.classroom,
+                 "teacher": row.full_name or "未分配"}
+        for row in rows
+    }
+    if related is None:
+        related = set(courses)
+
+    events = []
+    start = term_start()
+    if courses:
+        meetings: Dict[int, List[MeetingSlot]] = {}
+        for meeting in db.query(CourseMeeting).filter(CourseMeeting.course_id.in_(list(courses))).order_by(
+            CourseMeeting.course_id, CourseMeeting.day_of_week, CourseMeeting.start_minute
+        ):
+            meetings.setdefault(meeting.course_id, []).append(slot_from_meeting(meeting))
+        for course_id, course in courses.items():
+            events.extend(_course_events(course, meetings.get(course_id, []), start))
+        for exam in db.query(Exam).filter(Exam.course_id.in_(list(courses))).order_by(Exam.date, Exam.id):
+            events.append(_exam_event(exam, courses[exam.course_id]["name"]))
+    return title, events, related
+
+
+def render_calendar(title: str, events: List[dict], stamp: datetime) -> str:
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODUCT_ID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(title)}",
+        f"X-WR-TIMEZONE:{CALENDAR_TIMEZONE}",
+        # 建议客户端的刷新间隔
+        "REFRESH-INTERVAL;VALUE=DURATION:PT15M",
+        "X-PUBLISHED-TTL:PT15M",
+    ]
+    dtstamp = stamp.strftime("%Y%m%dT%H%M%SZ")
+    for event in events:
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{event['uid']}@{UID_DOMAIN}",
+            f"DTSTAMP:{dtstamp}",
+            f"DTSTART:{event['start']}",
+        ]
+        if event["end"]:
+            lines.append(f"DTEND:{event['end']}")
+        if event["rrule"]:
+            lines.append(f"RRULE:{event['rrule']}")
+        lines.append(f"SUMMARY:{_escape(event['summary'])}")
+        if event["location"]:
+            lines.append(f"LOCATION:{_escape(event['location'])}")
+        if event["description"]:
+            lines.append(f"DESCRIPTION:{_escape(event['description'])}")
+        lines += [f"CATEGORIES:{event['categories']}", "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+
+class CalendarFeed:
+    __slots__ = ("body", "etag", "content_hash", "last_modified", "token_version", "built_at", "stale")
+
+    def __init__(self, body: bytes, content_hash: str, last_modified: datetime, token_version: int, stale: bool):
+        self.body = body
+        self.content_hash = content_hash
+        self.etag = f'"{content_hash}"'
+        self.last_modified = last_modified
+        self.token_version = token_version
+        self.built_at = time.monotonic()
+        self.stale = stale
+
+
+class CalendarFeedCache:
+    """按用户缓存生成好的日历；过期的条目保留到重建，用于判断内容是否变化"""
+
+    def __init__(self, max_age: float = CALENDAR_FEED_MAX_AGE_SECONDS, maxsize: int = CALENDAR_FEED_CACHE_SIZE):
+        self.max_age = max_age
+        self._feeds = TTLCache(maxsize=maxsize, ttl=None, name="calendar_feed")
+        self._course_users: Dict[int, Set[int]] = {}
+        self._user_courses: Dict[int, Set[int]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, user_id: int, token_version: int) -> Optional[CalendarFeed]:
+        """未过期且令牌版本一致时返回缓存的日历"""
+        feed = self._feeds.get(user_id)
+        if feed is None or feed.stale or feed.token_version != token_version:
+            return None
+        if time.monotonic() - feed.built_at >= self.max_age:
+            return None
+        return feed
+
+    def _mark_stale(self, user_ids: Iterable[int]):
+        self._generation += 1
+        for user_id in user_ids:
+            feed = self._feeds.get(user_id)
+            if feed is not None:
+                feed.stale = True
+
+    def invalidate_user(self, user_id: int):
+        """该用户的选课或令牌版本变化后调用"""
+        with self._lock:
+            self._mark_stale([user_id])
+
+    def invalidate_courses(self, course_ids: Iterable[int]):
+        """课程时间、教室、考试或选课人员变化后调用，使相关学生和教师的日历过期"""
+        with self._lock:
+            users = set()
+            for course_id in course_ids:
+                users.update(self._course_users.get(course_id, ()))
+            self._mark_stale(users)
+
+    def clear(self):
+        """批量修改（导入选课、应用排课方案）后调用"""
+        with self._lock:
+            self._generation += 1
+            self._feeds.clear()
+            self._course_users.clear()
+            self._user_courses.clear()
+
+    def build(self, db: Session, user_id: int, role: UserRole, profile_id: int, token_version: int) -> CalendarFeed:
+        """查询数据库生成日历并缓存；生成期间有失效发生时，结果只用于本次响应"""
+        with self._lock:
+            generation = self._generation
+        title, events, course_ids = load_feed_events(db, role, profile_id)
+        content_hash = hashlib.sha1(
+            json.dumps([title, events, CALENDAR_TIMEZONE], ensure_ascii=False, sort_keys=True).encode()
+        ).hexdigest()[:20]
+
+        previous = self._feeds.get(user_id)
+        if previous is not None and previous.content_hash == content_hash:
+            last_modified = previous.last_modified
+        else:
+            last_modified = datetime.utcnow().replace(microsecond=0)
+        body = render_calendar(title, events, last_modified).encode()
+
+        with self._lock:
+            feed = CalendarFeed(body, content_hash, last_modified, token_version, generation != self._generation)
+            self._feeds.set(user_id, feed)
+            for course_id in self._user_courses.pop(user_id, ()):
+                users = self._course_users.get(course_id)
+                if users is not None:
+                    users.discard(user_id)
+                    if not users:
+                        del self._course_users[course_id]
+            self._user_courses[user_id] = course_ids
+            for course_id in course_ids:
+                self._course_users.setdefault(course_id, set()).add(user_id)
+        return feed
+
+
+calendar_feeds = CalendarFeedCache()
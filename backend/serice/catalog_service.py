@@ -0,0 +1,280 @@
+"""
+课程目录（选课浏览）
+
+课程信息很少变化而选课期间读取非常频繁，目录以内存快照的形式提供：
+  - 课程信息（名称、学分、教师、院系、上课日）在管理员修改、启停课程后整体重建，
+    另有 CATALOG_MAX_AGE_SECONDS 的兜底过期，覆盖其他进程或脚本的修改
+  - 已选、候补人数变化频繁，选课、退课后只标记对应课程，下次读取时用一次查询刷新这些课程，
+    另外每 SEATS_MAX_AGE_SECONDS 全量刷新一次
+  - 每个筛选维度的取值预先建立课程下标集合，筛选和分面计数都是集合交集
+ETag 由课程信息和人数的内容哈希组成，不同进程的快照内容相同时 ETag 也相同。
+"""
+
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal
+from models import Course, CourseMeeting, Enrollment, Teacher, User
+from serice.enrollment_service import STATUS_ACTIVE, STATUS_WAITLISTED, WAITLIST_LIMIT
+
+CATALOG_MAX_AGE_SECONDS = 300
+SEATS_MAX_AGE_SECONDS = 30
+# 每个分面最多返回的取值个数（按课程数降序）
+FACET_VALUE_LIMIT = 50
+
+AVAILABLE = "available"
+WAITLIST = "waitlist"
+FULL = "full"
+AVAILABILITY_VALUES = (AVAILABLE, WAITLIST, FULL)
+
+FACETS = ("department", "credits", "day", "teacher", "availability")
+
+def _availability(max_students, enrolled: int, waitlisted: int) -> str:
+    if max_students is None or enrolled < max_students:
+        return AVAILABLE
+    return WAITLIST if waitlisted < WAITLIST_LIMIT else FULL
+
+
+def _seat_hash(course_id: int, enrolled: int, waitlisted: int) -> int:
+    # 整数元组的 hash 不受随机化影响，各进程一致
+    return hash((course_id, enrolled, waitlisted)) & 0xFFFFFFFFFFFFFFFF
+
+
+def _load_seats(db: Session, course_ids: Optional[Iterable[int]] = None) -> Dict[int, List[int]]:
+    """course_id -> [已选人数, 候补人数]；不指定 course_ids 时统计全部课程"""
+    query = db.query(Enrollment.course_id, Enrollment.status, func.count(Enrollment.id)).filter(
+        Enrollment.status.in_([STATUS_ACTIVE, STATUS_WAITLISTED])
+    )
+    if course_ids is not None:
+        query = query.filter(Enrollment.course_id.in_(list(course_ids)))
+    seats = {course_id: [0, 0] for course_id in course_ids or ()}
+    for course_id, status, count in query.group_by(Enrollment.course_id, Enrollment.status):
+        seats.setdefault(course_id, [0, 0])[0 if status == STATUS_ACTIVE else 1] = count
+    return seats
+
+
+class CatalogSnapshot:
+    """某一时刻的课程目录；课程信息和筛选索引不再变化，人数由 CourseCatalog 在锁内更新"""
+
+    def __init__(self, courses: List[dict], seats: Dict[int, List[int]]):
+        self.courses = courses
+        self.position = {course["id"]: i for i, course in enumerate(courses)}
+        self.all = frozenset(range(len(courses)))
+
+        digest = hashlib.sha1(json.dumps(courses, ensure_ascii=False, sort_keys=True).encode())
+        self.content_hash = digest.hexdigest()[:16]
+
+        self.index: Dict[str, Dict] = {facet: {} for facet in FACETS}
+        self.labels: Dict[object, str] = {}
+        for i, course in enumerate(courses):
+            self.index["department"].setdefault(course["department"], set()).add(i)
+            self.index["credits"].setdefault(course["credits"], set()).add(i)
+            for day in course["days"]:
+                self.index["day"].setdefault(day, set()).add(i)
+            if course["teacher_id"] is not None:
+                self.index["teacher"].setdefault(course["teacher_id"], set()).add(i)
+                self.labels[course["teacher_id"]] = course["teacher"]
+
+        self.seats: Dict[int, List[int]] = {}
+        self.seat_hash = 0
+        self.index["availability"] = {value: set() for value in AVAILABILITY_VALUES}
+        for course in courses:
+            enrolled, waitlisted = seats.get(course["id"], (0, 0))
+            self.set_seats(course["id"], enrolled, waitlisted)
+
+    def set_seats(self, course_id: int, enrolled: int, waitlisted: int):
+        i = self.position.get(course_id)
+        if i is None:
+            return
+        max_students = self.courses[i]["max_students"]
+        old = self.seats.get(course_id)
+        if old is not None:
+            self.seat_hash ^= _seat_hash(course_id, *old)
+            self.index["availability"][_availability(max_students, *old)].discard(i)
+        self.seats[course_id] = [enrolled, waitlisted]
+        self.seat_hash ^= _seat_hash(course_id, enrolled, waitlisted)
+        self.index["availability"][_availability(max_students, enrolled, waitlisted)].add(i)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.content_hash}-{self.seat_hash:016x}"'
+
+    def _matching(self, filters: Dict[str, object], text_matches: Optional[Set[int]], skip: Optional[str] = None):
+        result = self.all if text_matches is None else text_matches
+        for facet, value in filters.items():
+            if facet != skip:
+                result = result & self.index[facet].get(value, frozenset())
+        return result
+
+    def _facet_counts(self, facet: str, base) -> list:
+        counts = []
+        for value, members in self.index[facet].items():
+            count = len(members) if base is self.all else len(members & base)
+            if count:
+                counts.append((value, count))
+        counts.sort(key=lambda item: (-item[1], item[0]))
+        if facet == "teacher":
+            return [
+                {"value": value, "label": self.labels.get(value), "count": count}
+                for value, count in counts[:FACET_VALUE_LIMIT]
+            ]
+        return [{"value": value, "count": count} for value, count in counts[:FACET_VALUE_LIMIT]]
+
+    def search(self, filters: Dict[str, object], q: Optional[str], page: int, page_size: int) -> dict:
+        text_matches = None
+        if q:
+            keyword = q.strip().lower()
+            text_matches = frozenset(
+                i for i, course in enumerate(self.courses)
+                if keyword in course["name"].lower() or keyword in course["code"].lower()
+            )
+
+        matched = sorted(self._matching(filters, text_matches))
+        total = len(matched)
+        items = []
+        for i in matched[(page - 1) * page_size:page * page_size]:
+            course = self.courses[i]
+            enrolled, waitlisted = self.seats[course["id"]]
+            max_students = course["max_students"]
+            items.append({
+                **course,
+                "enrolled": enrolled,
+                "waitlisted": waitlisted,
+                "seats_left": max(max_students - enrolled, 0) if max_students is not None else None,
+                "availability": _availability(max_students, enrolled, waitlisted)
+            })
+
+        # 分面计数不受本维度筛选条件的影响，便于切换取值
+        facets = {
+            facet: self._facet_counts(facet, self._matching(filters, text_matches, skip=facet))
+            for facet in FACETS
+        }
+        return {
+            "courses": items,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "total_pages": (total + page_size - 1) // page_size,
+            "facets": facets
+        }
+
+
+def build_snapshot(db: Session) -> CatalogSnapshot:
+    rows = db.query(
+        Course.id, Course.name, Course.code, Course.description, Course.credits, Course.classroom,
+        Course.schedule, Course.max_students, Course.teacher_id, Teacher.department, User.full_name
+    ).outerjoin(Teacher, Course.teacher_id == Teacher.id).outerjoin(
+        User, Teacher.user_id == User.id
+    ).filter(Course.is_active == True).order_by(Course.code).all()
+    days: Dict[int, Set[int]] = {}
+    for course_id, day in db.query(CourseMeeting.course_id, CourseMeeting.day_of_week).distinct():
+        days.setdefault(course_id, set()).add(day)
+
+    courses = [
+        {
+            "id": row.id,
+            "name": row.name,
+            "code": row.code,
+            "description": row.description,
+            "credits": row.credits,
+            "teacher_id": row.teacher_id,
+            "teacher": row.full_name or "未分配",
+            "department": row.department or "未分配",
+            "classroom": row.classroom,
+            "schedule": row.schedule,
+            "days": sorted(days.get(row.id, ())),
+            "max_students": row.max_students
+        }
+        for row in rows
+    ]
+    return CatalogSnapshot(courses, _load_seats(db))
+
+
+class CourseCatalog:
+    def __init__(self, max_age: float = CATALOG_MAX_AGE_SECONDS, seats_max_age: float = SEATS_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self.seats_max_age = seats_max_age
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._built_at = 0.0
+        self._seats_at = 0.0
+        self._stale = True
+        self._dirty_seats: Set[int] = set()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def invalidate(self):
+        """课程信息变化后调用，下次读取时重建"""
+        self._stale = True
+
+    def seats_changed(self, course_ids: Iterable[int]):
+        """选课人数变化后调用，下次读取时刷新这些课程的人数"""
+        with self._lock:
+            self._dirty_seats.update(course_ids)
+
+    def _needs_rebuild(self) -> bool:
+        return self._snapshot is None or self._stale or time.monotonic() - self._built_at >= self.max_age
+
+    def _needs_seats(self) -> bool:
+        return bool(self._dirty_seats) or time.monotonic() - self._seats_at >= self.seats_max_age
+
+    def refresh(self):
+        """按需重建快照或刷新人数；并发调用时只有一个线程查询数据库"""
+        with self._build_lock:
+            if self._needs_rebuild():
+                self._stale = False
+                with self._lock:
+                    self._dirty_seats.clear()
+                db = SessionLocal()
+                try:
+                    snapshot = build_snapshot(db)
+                except Exception:
+                    self._stale = True
+                    raise
+                finally:
+                    db.close()
+                with self._lock:
+                    self._snapshot = snapshot
+                    self._built_at = self._seats_at = time.monotonic()
+            elif self._needs_seats():
+                full = time.monotonic() - self._seats_at >= self.seats_max_age
+                with self._lock:
+                    course_ids, self._dirty_seats = self._dirty_seats, set()
+                db = SessionLocal()
+                try:
+                    seats = _load_seats(db, None if full else course_ids)
+                except Exception:
+                    self.seats_changed(course_ids)
+                    raise
+                finally:
+                    db.close()
+                with self._lock:
+                    if full:
+                        # 全量统计只返回有选课记录的课程，其余课程人数归零
+                        seats = {course_id: seats.get(course_id, [0, 0]) for course_id in self._snapshot.position}
+                        self._seats_at = time.monotonic()
+                    for course_id, (enrolled, waitlisted) in seats.items():
+                        self._snapshot.set_seats(course_id, enrolled, waitlisted)
+
+    async def ensure_fresh(self):
+        if self._needs_rebuild() or self._needs_seats():
+            await run_in_threadpool(self.refresh)
+
+    def etag(self) -> str:
+        with self._lock:
+            return self._snapshot.etag
+
+    def search(self, filters: Dict[str, object], q: Optional[str] = None, page: int = 1, page_size: int = 20):
+        """返回 (ETag, 结果)，二者在同一把锁内取得，保证一致"""
+        with self._lock:
+            snapshot = self._snapshot
+            return snapshot.etag, snapshot.search(filters, q, page, page_size)
+
+
+course_catalog = CourseCatalog()
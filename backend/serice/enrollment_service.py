@@ -0,0 +1,249 @@
+"""
+学生选课、退课与候补队列
+
+容量检查和写入在同一个写事务内完成：SQLite 用 BEGIN IMMEDIATE 在事务开始时就取得写锁，
+其他数据库对课程行 SELECT ... FOR UPDATE，同一门课程的选课、退课、递补串行执行，
+不会出现两个请求都读到"还有名额"而超额选课。事务内只有少量走索引的语句，持锁时间很短。
+
+课程已满时进入候补队列（Enrollment.status = "waitlisted"），按入队先后（Enrollment.id）排队，
+有名额空出（退课、管理员扩容）时在同一事务内按顺序递补；有人候补时新的选课请求不能插队。
+与已选（含候补）课程上课时间冲突的选课请求直接拒绝。
+每门课程的候补人数、每名学生同时候补的课程数都有上限，避免个别学生占满候补位。
+等待写锁超时（选课开放瞬间的大量并发）时返回 503 和 Retry-After，由客户端稍后重试，
+而不是在服务端无限排队。
+"""
+
+import os
+from datetime import datetime
+from typing import Iterable, List
+
+from sqlalchemy import func, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, aliased
+
+from models import Course, Enrollment
+from serice.schedule_service import timetable
+
+STATUS_ACTIVE = "active"
+STATUS_WAITLISTED = "waitlisted"
+STATUS_DROPPED = "dropped"
+STATUS_COMPLETED = "completed"
+
+WAITLIST_LIMIT = int(os.getenv("WAITLIST_LIMIT", "50"))
+MAX_WAITLISTS_PER_STUDENT = int(os.getenv("MAX_WAITLISTS_PER_STUDENT", "5"))
+LOCK_RETRY_AFTER_SECONDS = 1
+
+
+class EnrollmentError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def lock_courses(db: Session, course_ids: Iterable[int]):
+    """
+    开启写事务并锁定课程。必须在本事务写入任何数据之前调用（SQLite 下之前只能有查询），
+    锁在 commit / rollback 时释放。多门课程按 id 顺序加锁，避免死锁。
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        db.execute(text("BEGIN IMMEDIATE"))
+    else:
+        db.query(Course.id).filter(Course.id.in_(sorted(set(course_ids)))).order_by(
+            Course.id
+        ).with_for_update().all()
+
+
+def _is_lock_timeout(error: OperationalError) -> bool:
+    message = str(error.orig).lower()
+    return "locked" in message or "lock timeout" in message or "could not obtain lock" in message
+
+
+def _count(db: Session, course_id: int, status: str) -> int:
+    return db.query(func.count(Enrollment.id)).filter(
+        Enrollment.course_id == course_id,
+        Enrollment.status == status
+    ).scalar()
+
+
+def _promote(db: Session, course_id: int, max_students, enrolled: int) -> List[int]:
+    """按排队顺序把候补转为正式选课，直到名额用完；调用方需持有课程锁"""
+    if max_students is None or enrolled >= max_students:
+        return []
+    promoted = [row_id for (row_id,) in db.query(Enrollment.id).filter(
+        Enrollment.course_id == course_id,
+        Enrollment.status == STATUS_WAITLISTED
+    ).order_by(Enrollment.id).limit(max_students - enrolled)]
+    if promoted:
+        db.query(Enrollment).filter(Enrollment.id.in_(promoted)).update(
+            {Enrollment.status: STATUS_ACTIVE, Enrollment.enrollment_date: datetime.utcnow()},
+            synchronize_session=False
+        )
+    return promoted
+
+
+def _run_locked(db: Session, course_id: int, action):
+    """在课程锁内执行 action 并提交；锁等待超时转为 503"""
+    try:
+        lock_courses(db, [course_id])
+        result = action()
+        db.commit()
+        return result
+    except OperationalError as e:
+        db.rollback()
+        if _is_lock_timeout(e):
+            raise EnrollmentError(503, "Enrollment is busy, please retry shortly")
+        raise
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _waitlist_full(db: Session, course_id: int) -> bool:
+    """不加锁读取：名额和候补都已满"""
+    max_students = db.query(Course.max_students).filter(Course.id == course_id).scalar()
+    if max_students is None:
+        return False
+    counts = dict(db.query(Enrollment.status, func.count(Enrollment.id)).filter(
+        Enrollment.course_id == course_id,
+        Enrollment.status.in_([STATUS_ACTIVE, STATUS_WAITLISTED])
+    ).group_by(Enrollment.status).all())
+    return counts.get(STATUS_ACTIVE, 0) >= max_students and counts.get(STATUS_WAITLISTED, 0) >= WAITLIST_LIMIT
+
+
+def enroll(db: Session, student_id: int, course_id: int) -> dict:
+    """选课：有名额且无人候补时直接选上，否则进入候补队列"""
+    # 满员后的大量请求直接拒绝，不去争抢写锁；名额只会在持锁时变化，锁内仍会重新检查
+    if _waitlist_full(db, course_id):
+        raise EnrollmentError(409, "Course is full and the waitlist is full")
+
+    # 时间冲突只取决于该学生自己的选课，同样在加锁前检查
+    enrolled_course_ids = [course for (course,) in db.query(Enrollment.course_id).filter(
+        Enrollment.student_id == student_id,
+        Enrollment.status.in_([STATUS_ACTIVE, STATUS_WAITLISTED])
+    )]
+    conflicts = timetable.student_conflicts(db, course_id, enrolled_course_ids)
+    if conflicts:
+        names = sorted({conflict["course_name"] for conflict in conflicts})
+        raise EnrollmentError(409, f"Schedule conflicts with: {', '.join(names)}")
+
+    def action():
+        course = db.query(Course.max_students, Course.is_active).filter(Course.id == course_id).first()
+        if course is None:
+            raise EnrollmentError(404, "Course not found")
+        if not course.is_active:
+            raise EnrollmentError(400, "Course is not open for enrollment")
+
+        current = db.query(Enrollment.status).filter(
+            Enrollment.student_id == student_id,
+            Enrollment.course_id == course_id,
+            Enrollment.status != STATUS_DROPPED
+        ).first()
+        if current is not None:
+            if current.status == STATUS_WAITLISTED:
+                raise EnrollmentError(409, "Already on the waitlist for this course")
+            raise EnrollmentError(409, "Already enrolled in this course")
+
+        # 扩容后尚未递补的名额先分给排队的学生
+        enrolled = _count(db, course_id, STATUS_ACTIVE)
+        enrolled += len(_promote(db, course_id, course.max_students, enrolled))
+        waiting = _count(db, course_id, STATUS_WAITLISTED)
+
+        if course.max_students is None or (enrolled < course.max_students and waiting == 0):
+            status, position = STATUS_ACTIVE, None
+        else:
+            if waiting >= WAITLIST_LIMIT:
+                raise EnrollmentError(409, "Course is full and the waitlist is full")
+            student_waitlists = db.query(func.count(Enrollment.id)).filter(
+                Enrollment.student_id == student_id,
+                Enrollment.status == STATUS_WAITLISTED
+            ).scalar()
+            if student_waitlists >= MAX_WAITLISTS_PER_STUDENT:
+                raise EnrollmentError(
+                    409, f"Cannot wait for more than {MAX_WAITLISTS_PER_STUDENT} courses at the same time"
+                )
+            status, position = STATUS_WAITLISTED, waiting + 1
+
+        # 每次选课新建记录，退课记录保留为历史；候补顺序即记录 id 顺序
+        enrollment = Enrollment(
+            student_id=student_id, course_id=course_id, status=status, enrollment_date=datetime.utcnow()
+        )
+        db.add(enrollment)
+        db.flush()
+        return {
+            "enrollment_id": enrollment.id,
+            "course_id": course_id,
+            "status": status,
+            "waitlist_position": position,
+            "enrolled": enrolled + (1 if status == STATUS_ACTIVE else 0),
+            "max_students": course.max_students
+        }
+
+    return _run_locked(db, course_id, action)
+
+
+def drop(db: Session, student_id: int, course_id: int) -> dict:
+    """退课或退出候补；退掉正式选课时按顺序递补候补学生"""
+    def action():
+        enrollment = db.query(Enrollment).filter(
+            Enrollment.student_id == student_id,
+            Enrollment.course_id == course_id,
+            Enrollment.status.in_([STATUS_ACTIVE, STATUS_WAITLISTED])
+        ).first()
+        if enrollment is None:
+            raise EnrollmentError(404, "Not enrolled in this course")
+
+        previous_status = enrollment.status
+        enrollment.status = STATUS_DROPPED
+        db.flush()
+
+        promoted = []
+        if previous_status == STATUS_ACTIVE:
+            max_students = db.query(Course.max_students).filter(Course.id == course_id).scalar()
+            promoted = _promote(db, course_id, max_students, _count(db, course_id, STATUS_ACTIVE))
+        return {
+            "course_id": course_id,
+            "status": STATUS_DROPPED,
+            "previous_status": previous_status,
+            "promoted": len(promoted)
+        }
+
+    return _run_locked(db, course_id, action)
+
+
+def fill_waitlist(db: Session, course_id: int) -> int:
+    """课程扩容后递补候补学生，返回递补人数"""
+    def action():
+        max_students = db.query(Course.max_students).filter(Course.id == course_id).scalar()
+        return len(_promote(db, course_id, max_students, _count(db, course_id, STATUS_ACTIVE)))
+
+    return _run_locked(db, course_id, action)
+
+
+def get_student_waitlist(db: Session, student_id: int) -> list:
+    """学生当前的候补课程及排队位置，一次查询"""
+    ahead = aliased(Enrollment)
+    position = db.query(func.count(ahead.id)).filter(
+        ahead.course_id == Enrollment.course_id,
+        ahead.status == STATUS_WAITLISTED,
+        ahead.id <= Enrollment.id
+    ).correlate(Enrollment).scalar_subquery()
+
+    rows = db.query(Enrollment, Course.name, Course.code, position).join(
+        Course, Enrollment.course_id == Course.id
+    ).filter(
+        Enrollment.student_id == student_id,
+        Enrollment.status == STATUS_WAITLISTED
+    ).order_by(Enrollment.id).all()
+
+    return [
+        {
+            "enrollment_id": enrollment.id,
+            "course_id": enrollment.course_id,
+            "course_name": name,
+            "course_code": code,
+            "position": pos,
+            "joined_at": enrollment.enrollment_date.isoformat() if enrollment.enrollment_date else None
+        }
+        for enrollment, name, code, pos in rows
+    ]
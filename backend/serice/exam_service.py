@@ -0,0 +1,610 @@
+"""
+考试管理与考试排期
+
+考试的增删改由管理员（全部课程）和任课教师（本人课程）调用，保存后返回与其他考试的冲突
+（时间重叠且有共同学生、同一考场时间重叠），冲突只提示不阻止保存。
+
+考试排期（后台任务 exam_timetable）为一批课程统一安排考试时间段和考场：
+  - 课程是图的顶点，有共同学生（或同一任课教师）的两门课程之间有边，
+    相邻课程不能排在同一时间段，即图着色，时间段是颜色
+  - 共同学生数来自 scheduling_service.co_enrollment_pairs（学生-课程关联矩阵的 AᵀA，
+    由数据库分组聚合得到的稀疏上三角），不需要在内存中建立稠密矩阵
+  - 着色用 DSatur：每次取相邻颜色数（饱和度）最大的课程，选不与相邻课程冲突、
+    考场容量够用、同一天共同学生最少的时间段；边和时间段都只扫描一遍，几千门课程在秒级完成
+  - 排期窗口内已有的其他考试视为已着色：占用考场，并禁止其课程及相邻课程使用重叠的时间段
+考场取自 rooms 表，人数超过最大考场时合并多个考场。结果先作为任务结果预览，确认后由 apply_plan 写入：
+  - 先用条件 UPDATE 把任务标记为已应用（与 job_service.claim 相同），重复提交只有一次能写入
+  - 求解前记下排期依赖的已有考试的指纹，应用时重新计算，期间有考试被新增、修改或删除则返回 409
+"""
+
+import hashlib
+import heapq
+import json
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+
+from cache import TTLCache
+from database import SessionLocal
+from models import Course, Enrollment, Exam, Job, Room, SystemLog
+from query_utils import chunked
+from serice.job_service import JobContext, enqueue, register_job
+from serice.scheduling_service import co_enrollment_pairs, parse_periods
+
+EXAM_TYPES = ("midterm", "final", "quiz")
+DEFAULT_EXAM_DURATION = 120
+MAX_EXAM_DURATION = 600
+
+JOB_TYPE = "exam_timetable"
+DEFAULT_EXAM_DAYS = 10
+DEFAULT_EXAM_PERIODS = ["9:00-11:00", "14:00-16:00", "19:00-21:00"]
+DEFAULT_EXAM_TITLES = {"midterm": "期中考试", "final": "期末考试", "quiz": "测验"}
+# 一门考试最多合并的考场数
+MAX_ROOMS_PER_EXAM = 4
+
+UPCOMING_EXAMS_TTL_SECONDS = 600
+UPCOMING_EXAMS_CACHE_SIZE = 20000
+
+
+class ExamError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class PlanConflictError(Exception):
+    """排期方案不能应用：已应用过，或求解后已有考试发生了变化"""
+
+
+class ExamFields(BaseModel):
+    title: str
+    exam_type: str
+    date: datetime
+    duration: Optional[int] = DEFAULT_EXAM_DURATION
+    location: Optional[str] = None
+    max_score: float = 100
+    description: Optional[str] = None
+
+
+class ExamCreateRequest(ExamFields):
+    course_id: int
+
+
+class ExamUpdateRequest(BaseModel):
+    title: Optional[str] = None
+    exam_type: Optional[str] = None
+    date: Optional[datetime] = None
+    duration: Optional[int] = None
+    location: Optional[str] = None
+    max_score: Optional[float] = None
+    description: Optional[str] = None
+
+
+def exam_end(exam) -> datetime:
+    return exam.date + timedelta(minutes=exam.duration or DEFAULT_EXAM_DURATION)
+
+
+def serialize_exam(exam: Exam, course_name: Optional[str] = None) -> dict:
+    return {
+        "id": exam.id,
+        "course_id": exam.course_id,
+        "course": course_name,
+        "title": exam.title,
+        "exam_type": exam.exam_type,
+        "date": exam.date.isoformat(),
+        "end": exam_end(exam).isoformat(),
+        "duration": exam.duration,
+        "location": exam.location,
+        "max_score": exam.max_score,
+        "description": exam.description
+    }
+
+
+def _validate(values: dict):
+    if "exam_type" in values and values["exam_type"] not in EXAM_TYPES:
+        raise ExamError(400, f"exam_type must be one of {', '.join(EXAM_TYPES)}")
+    if "title" in values and not (values["title"] or "").strip():
+        raise ExamError(400, "Title is required")
+    duration = values.get("duration")
+    if duration is not None and not 1 <= duration <= MAX_EXAM_DURATION:
+        raise ExamError(400, f"Duration must be between 1 and {MAX_EXAM_DURATION} minutes")
+    if values.get("max_score") is not None and values["max_score"] <= 0:
+        raise ExamError(400, "Max score must be positive")
+
+
+def create_exam(db: Session, course_id: int, fields: ExamFields) -> Exam:
+    values = fields.model_dump(include=set(ExamFields.model_fields))
+    _validate(values)
+    if not db.query(Course.id).filter(Course.id == course_id).first():
+        raise ExamError(404, "Course not found")
+    exam = Exam(course_id=course_id, **values)
+    db.add(exam)
+    db.commit()
+    db.refresh(exam)
+    return exam
+
+
+def update_exam(db: Session, exam: Exam, fields: ExamUpdateRequest) -> Exam:
+    values = fields.model_dump(exclude_unset=True)
+    # 标题、类型、时间不能清空
+    for key in ("title", "exam_type", "date"):
+        if key in values and values[key] is None:
+            raise ExamError(400, f"{key} cannot be empty")
+    _validate(values)
+    for key, value in values.items():
+        setattr(exam, key, value)
+    db.commit()
+    db.refresh(exam)
+    return exam
+
+
+def _locations(location: Optional[str]) -> Set[str]:
+    return {name.strip() for name in (location or "").replace("，", "、").replace(",", "、").split("、") if name.strip()}
+
+
+def exam_conflicts(db: Session, exam: Exam) -> dict:
+    """与该考试时间重叠的其他考试中，有共同学生的（按共同学生数）和使用相同考场的"""
+    start, end = exam.date, exam_end(exam)
+    candidates = db.query(Exam, Course.name).join(Course, Exam.course_id == Course.id).filter(
+        Exam.id != exam.id,
+        Exam.date < end,
+        Exam.date > start - timedelta(minutes=MAX_EXAM_DURATION)
+    ).all()
+    overlapping = [(other, name) for other, name in candidates if exam_end(other) > start]
+    if not overlapping:
+        return {"students": [], "room": []}
+
+    other = aliased(Enrollment)
+    shared = dict(db.query(other.course_id, func.count()).select_from(Enrollment).join(
+        other, other.student_id == Enrollment.student_id
+    ).filter(
+        Enrollment.course_id == exam.course_id,
+        Enrollment.status == "active",
+        other.status == "active",
+        other.course_id.in_({item.course_id for item, _ in overlapping} - {exam.course_id})
+    ).group_by(other.course_id).all())
+
+    rooms = _locations(exam.location)
+    students, room = [], []
+    for item, name in overlapping:
+        conflict = {"exam_id": item.id, "course_id": item.course_id, "course": name, "title": item.title,
+                    "date": item.date.isoformat(), "end": exam_end(item).isoformat(), "location": item.location}
+        if item.course_id == exam.course_id:
+            students.append({**conflict, "shared_students": None})
+        elif shared.get(item.course_id):
+            students.append({**conflict, "shared_students": shared[item.course_id]})
+        if rooms & _locations(item.location):
+            room.append(conflict)
+    return {"students": students, "room": room}
+
+
+# ---- 即将到来的考试 ----
+
+class UpcomingExams:
+    """
+    按课程缓存尚未开始的考试。考试很少修改，仪表板按学生已选课程逐门取缓存，
+    未命中的课程用一次 IN 查询补齐（走 (course_id, date) 索引）；没有考试的课程也缓存空列表。
+    读取时再按当前时间过滤，缓存期间开始的考试不会显示。考试增删改后按课程失效。
+    """
+
+    def __init__(self, ttl: float = UPCOMING_EXAMS_TTL_SECONDS):
+        self._cache = TTLCache(maxsize=UPCOMING_EXAMS_CACHE_SIZE, ttl=ttl, name="upcoming_exams")
+
+    def invalidate(self, course_ids: Iterable[int]):
+        for course_id in course_ids:
+            self._cache.delete(course_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def for_courses(self, db: Session, course_ids: Iterable[int]) -> List[dict]:
+        """这些课程尚未开始的考试，按时间排序；返回的字典来自缓存，调用方不应修改"""
+        cached, missing = {}, []
+        for course_id in set(course_ids):
+            exams = self._cache.get(course_id)
+            if exams is None:
+                missing.append(course_id)
+            else:
+                cached[course_id] = exams
+
+        now = datetime.now()
+        for values in chunked(missing):
+            loaded = {course_id: [] for course_id in values}
+            rows = db.query(
+                Exam.id, Exam.course_id, Exam.title, Exam.exam_type, Exam.date, Exam.duration, Exam.location, Course.name
+            ).join(Course, Exam.course_id == Course.id).filter(
+                Exam.course_id.in_(values),
+                Exam.date > now
+            ).order_by(Exam.date)
+            for row in rows:
+                loaded[row.course_id].append({
+                    "id": row.id,
+                    "course_id": row.course_id,
+                    "course": row.name,
+                    "title": row.title,
+                    "exam_type": row.exam_type,
+                    "date": row.date,
+                    "duration": row.duration,
+                    "location": row.location
+                })
+            for course_id, exams in loaded.items():
+                self._cache.set(course_id, exams)
+            cached.update(loaded)
+
+        upcoming = [exam for exams in cached.values() for exam in exams if exam["date"] > now]
+        upcoming.sort(key=lambda exam: (exam["date"], exam["id"]))
+        return upcoming
+
+
+upcoming_exams = UpcomingExams()
+
+
+# ---- 考试排期 ----
+
+def _parse_date(value) -> datetime:
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}, expected YYYY-MM-DD")
+
+
+def build_exam_slots(payload: dict) -> List[Tuple[datetime, datetime, int]]:
+    """排期窗口内的考试时间段 [(开始, 结束, 第几个考试日)]，按时间排序"""
+    first_day = _parse_date(payload["start_date"])
+    day_count = int(payload.get("days") or DEFAULT_EXAM_DAYS)
+    periods = parse_periods(payload.get("periods") or DEFAULT_EXAM_PERIODS)
+    for (_, end), (start, _) in zip(periods, periods[1:]):
+        if start < end:
+            raise ValueError("Exam periods must not overlap")
+    skip_weekends = payload.get("skip_weekends", True)
+
+    slots, day, exam_day = [], first_day, 0
+    while exam_day < day_count:
+        if not (skip_weekends and day.weekday() >= 5):
+            for start, end in periods:
+                slots.append((day + timedelta(minutes=start), day + timedelta(minutes=end), exam_day))
+            exam_day += 1
+        day += timedelta(days=1)
+    return slots
+
+
+class ExamTimetable:
+    """DSatur 着色：顶点为待排考试的课程，颜色为考试时间段"""
+
+    def __init__(self, slots, courses: List[dict], rooms: List[Tuple[int, str]]):
+        self.slots = slots
+        self.courses = courses
+        self.neighbors: List[Dict[int, int]] = [{} for _ in courses]
+        self.blocked: List[Set[int]] = [set() for _ in courses]
+        self.free_rooms = [list(rooms) for _ in slots]
+        self.color: List[Optional[int]] = [None] * len(courses)
+        self.rooms: List[List[str]] = [[] for _ in courses]
+        # saturation[c]: 相邻课程已使用的时间段；same_day[c][d]: 与相邻课程在第 d 天同考的共同学生数
+        self.saturation: List[Set[int]] = [set() for _ in courses]
+        self.same_day: List[Dict[int, int]] = [{} for _ in courses]
+        self.unplaced: Dict[int, str] = {}
+
+    def add_edge(self, a: int, b: int, weight: int):
+        self.neighbors[a][b] = self.neighbors[a].get(b, 0) + weight
+        self.neighbors[b][a] = self.neighbors[b].get(a, 0) + weight
+
+    def occupy_room(self, slot: int, name: str):
+        self.free_rooms[slot] = [room for room in self.free_rooms[slot] if room[1] != name]
+
+    def _pick_rooms(self, slot: int, size: int) -> Optional[List[Tuple[int, str]]]:
+        """容量够用的最小考场；没有时从大到小合并考场"""
+        rooms = self.free_rooms[slot]
+        position = bisect_left(rooms, (size, ""))
+        if position < len(rooms):
+            return [rooms[position]]
+        picked, total = [], 0
+        for room in reversed(rooms[-MAX_ROOMS_PER_EXAM:]):
+            picked.append(room)
+            total += room[0]
+            if total >= size:
+                return picked
+        return None
+
+    def _place(self, c: int, slot: int, rooms: List[Tuple[int, str]]):
+        self.color[c] = slot
+        self.rooms[c] = [name for _, name in rooms]
+        taken = set(rooms)
+        self.free_rooms[slot] = [room for room in self.free_rooms[slot] if room not in taken]
+        day = self.slots[slot][2]
+        for neighbor, weight in self.neighbors[c].items():
+            self.saturation[neighbor].add(slot)
+            self.same_day[neighbor][day] = self.same_day[neighbor].get(day, 0) + weight
+
+    def solve(self, ctx: Optional[JobContext] = None):
+        degree = [sum(weights.values()) for weights in self.neighbors]
+        heap = [(0, -degree[c], c) for c in range(len(self.courses))]
+        heapq.heapify(heap)
+        done = 0
+        while heap:
+            negative_saturation, _, c = heapq.heappop(heap)
+            if self.color[c] is not None or c in self.unplaced:
+                continue
+            if -negative_saturation != len(self.saturation[c]):
+                # 饱和度已变化，按新的优先级重新入堆
+                heapq.heappush(heap, (-len(self.saturation[c]), -degree[c], c))
+                continue
+
+            size = self.courses[c]["students"]
+            best, best_cost, best_rooms, room_shortage = None, None, None, False
+            for slot, (_, _, day) in enumerate(self.slots):
+                if slot in self.saturation[c] or slot in self.blocked[c]:
+                    continue
+                cost = self.same_day[c].get(day, 0)
+                if best_cost is not None and cost >= best_cost:
+                    continue
+                rooms = self._pick_rooms(slot, size)
+                if rooms is None:
+                    room_shortage = True
+                    continue
+                best, best_cost, best_rooms = slot, cost, rooms
+            if best is None:
+                self.unplaced[c] = "考场容量不足" if room_shortage else "可用的考试时间段不足（与共同选课的考试全部冲突）"
+            else:
+                self._place(c, best, best_rooms)
+                for neighbor in self.neighbors[c]:
+                    if self.color[neighbor] is None:
+                        heapq.heappush(heap, (-len(self.saturation[neighbor]), -degree[neighbor], neighbor))
+
+            done += 1
+            if ctx and done % 200 == 0:
+                ctx.update(progress=0.3 + 0.6 * done / len(self.courses), message=f"已排 {done}/{len(self.courses)} 门课程")
+                ctx.check_cancelled()
+
+
+def _window_bounds(slots) -> Tuple[datetime, datetime]:
+    """与排期窗口可能重叠的考试的开始时间范围（开区间）"""
+    return slots[0][0] - timedelta(minutes=MAX_EXAM_DURATION), slots[-1][1]
+
+
+def exam_fingerprint(db: Session, payload: dict, slots) -> str:
+    """
+    排期依赖的已有考试：可能与窗口重叠的全部考试，以及可能参与排期的课程（payload 中的 course_ids，
+    未指定时为全部课程）的同类型考试；其中任何一场被新增、修改或删除，指纹都会变化
+    """
+    columns = (Exam.id, Exam.course_id, Exam.exam_type, Exam.date, Exam.duration, Exam.location)
+    exam_type = payload.get("exam_type") or "final"
+    window_start, window_end = _window_bounds(slots)
+    rows = {tuple(row) for row in db.query(*columns).filter(Exam.date < window_end, Exam.date > window_start)}
+    if payload.get("course_ids"):
+        for values in chunked([int(course_id) for course_id in payload["course_ids"]]):
+            rows.update(tuple(row) for row in db.query(*columns).filter(
+                Exam.course_id.in_(values), Exam.exam_type == exam_type
+            ))
+    else:
+        rows.update(tuple(row) for row in db.query(*columns).filter(Exam.exam_type == exam_type))
+    digest = hashlib.sha256()
+    for row in sorted(rows, key=lambda row: row[0]):
+        digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+def load_timetable(db: Session, payload: dict, slots, ctx: Optional[JobContext] = None):
+    """读取待排课程、考场、共同选课和窗口内已有考试，返回 (ExamTimetable, 将被替换的考试数)"""
+    exam_type = payload.get("exam_type") or "final"
+    replace_existing = bool(payload.get("replace_existing", False))
+
+    enrolled = dict(db.query(Enrollment.course_id, func.count(Enrollment.id)).filter(
+        Enrollment.status == "active"
+    ).group_by(Enrollment.course_id).all())
+    query = db.query(Course.id, Course.code, Course.name, Course.teacher_id).filter(Course.is_active == True)
+    if payload.get("course_ids"):
+        query = query.filter(Course.id.in_([int(course_id) for course_id in payload["course_ids"]]))
+    rows = [row for row in query.order_by(Course.id) if enrolled.get(row.id)]
+
+    # 已有同类型考试的课程：替换或跳过
+    existing_type = {
+        course_id for (course_id,) in db.query(Exam.course_id).filter(Exam.exam_type == exam_type).distinct()
+    }
+    replaced = 0
+    if replace_existing:
+        replaced = sum(1 for row in rows if row.id in existing_type)
+    else:
+        rows = [row for row in rows if row.id not in existing_type]
+
+    courses = [
+        {"id": row.id, "code": row.code, "name": row.name, "teacher_id": row.teacher_id, "students": enrolled[row.id]}
+        for row in rows
+    ]
+    index = {course["id"]: i for i, course in enumerate(courses)}
+    rooms = sorted(
+        (capacity, name) for name, capacity in db.query(Room.name, Room.capacity).filter(Room.is_active == True)
+    )
+    timetable = ExamTimetable(slots, courses, rooms)
+
+    if ctx:
+        ctx.update(progress=0.05, message="统计共同选课", force=True)
+    # 非待排课程的相邻关系只用于已有考试的禁排
+    outside: Dict[int, List[int]] = {}
+    for course_a, course_b, weight in co_enrollment_pairs(db):
+        a, b = index.get(course_a), index.get(course_b)
+        if a is not None and b is not None:
+            timetable.add_edge(a, b, weight)
+        elif a is not None:
+            outside.setdefault(course_b, []).append(a)
+        elif b is not None:
+            outside.setdefault(course_a, []).append(b)
+
+    # 同一教师的考试不安排在同一时间段
+    by_teacher: Dict[int, List[int]] = {}
+    for i, course in enumerate(courses):
+        if course["teacher_id"] is not None:
+            by_teacher.setdefault(course["teacher_id"], []).append(i)
+    for members in by_teacher.values():
+        for k, a in enumerate(members):
+            for b in members[k + 1:]:
+                timetable.add_edge(a, b, 0)
+
+    # 窗口内已有的考试（被替换的除外）
+    window_start, window_end = _window_bounds(slots)
+    fixed = db.query(Exam.course_id, Exam.exam_type, Exam.date, Exam.duration, Exam.location).filter(
+        Exam.date < window_end,
+        Exam.date > window_start
+    ).all()
+    for exam in fixed:
+        if replace_existing and exam.exam_type == exam_type and exam.course_id in index:
+            continue
+        end = exam_end(exam)
+        for slot, (start, slot_end, _) in enumerate(slots):
+            if exam.date < slot_end and end > start:
+                for name in _locations(exam.location):
+                    timetable.occupy_room(slot, name)
+                affected = outside.get(exam.course_id, [])
+                if exam.course_id in index:
+                    i = index[exam.course_id]
+                    affected = [i] + list(timetable.neighbors[i])
+                for i in affected:
+                    timetable.blocked[i].add(slot)
+    return timetable, replaced
+
+
+@register_job(JOB_TYPE)
+def generate_exam_timetable(ctx: JobContext):
+    started = time.monotonic()
+    payload = ctx.payload
+    exam_type = payload.get("exam_type") or "final"
+    slots = build_exam_slots(payload)
+    if not slots:
+        raise ValueError("No exam slots in the requested window")
+
+    db = SessionLocal()
+    try:
+        # 在读取之前计算：读取期间的修改也会使应用时的指纹不一致
+        fingerprint = exam_fingerprint(db, payload, slots)
+        ctx.update(progress=0.0, message="加载课程、考场和选课数据", force=True)
+        timetable, replaced = load_timetable(db, payload, slots, ctx)
+    finally:
+        db.close()
+    if not any(timetable.free_rooms):
+        raise ValueError("没有可用的考场，请先在 /admin/rooms 中添加教室")
+
+    timetable.solve(ctx)
+
+    title = payload.get("title") or DEFAULT_EXAM_TITLES.get(exam_type, "考试")
+    duration_by_slot = [int((end - start).total_seconds() // 60) for start, end, _ in slots]
+    exams, same_day_weight = [], 0
+    for c, course in enumerate(timetable.courses):
+        slot = timetable.color[c]
+        if slot is None:
+            continue
+        start, end, day = slots[slot]
+        same_day_weight += sum(
+            weight for neighbor, weight in timetable.neighbors[c].items()
+            if neighbor > c and timetable.color[neighbor] is not None and slots[timetable.color[neighbor]][2] == day
+        )
+        exams.append({
+            "course_id": course["id"],
+            "code": course["code"],
+            "name": course["name"],
+            "students": course["students"],
+            "title": title,
+            "exam_type": exam_type,
+            "date": start.isoformat(),
+            "end": end.isoformat(),
+            "duration": duration_by_slot[slot],
+            "location": "、".join(timetable.rooms[c]),
+            "rooms": timetable.rooms[c]
+        })
+    exams.sort(key=lambda item: (item["date"], item["code"]))
+
+    used_slots = {timetable.color[c] for c in range(len(timetable.courses)) if timetable.color[c] is not None}
+    return {
+        "summary": {
+            "courses": len(timetable.courses),
+            "scheduled": len(exams),
+            "unplaced": len(timetable.unplaced),
+            "replaced_existing": replaced,
+            "slots": len(slots),
+            "slots_used": len(used_slots),
+            "conflict_edges": sum(len(weights) for weights in timetable.neighbors) // 2,
+            "same_day_shared_students": same_day_weight,
+            "elapsed_seconds": round(time.monotonic() - started, 2)
+        },
+        "settings": {
+            "exam_type": exam_type,
+            "title": title,
+            "start_date": payload["start_date"],
+            "days": int(payload.get("days") or DEFAULT_EXAM_DAYS),
+            "replace_existing": bool(payload.get("replace_existing", False))
+        },
+        "unplaced": [
+            {"course_id": timetable.courses[c]["id"], "code": timetable.courses[c]["code"],
+             "students": timetable.courses[c]["students"], "reason": reason}
+            for c, reason in timetable.unplaced.items()
+        ],
+        "exams": exams,
+        "exam_fingerprint": fingerprint,
+        "applied_at": None
+    }
+
+
+def enqueue_timetable(db: Session, payload: dict, created_by: int) -> Job:
+    return enqueue(db, JOB_TYPE, payload, created_by=created_by)
+
+
+def apply_plan(db: Session, job: Job, applied_by: int) -> dict:
+    """
+    写入排期方案中的考试。replace_existing 时先删除参与排期的全部课程（含未能排期的）原有的同类型考试：
+    求解时已忽略这些考试，保留未能排期课程的旧考试可能与新安排冲突，未能排期的课程需另行安排。
+    """
+    result = json.loads(job.result or "{}")
+    if job.job_type != JOB_TYPE or job.status != "completed":
+        raise PlanConflictError("Only completed exam timetable jobs can be applied")
+    if result.get("applied_at"):
+        raise PlanConflictError(f"Plan already applied at {result['applied_at']}")
+
+    # 条件 UPDATE 抢占：同时提交的应用请求只有一个能更新到这一行，其余在写锁释放后更新 0 行
+    now = datetime.utcnow()
+    result["applied_at"] = now.isoformat()
+    result["applied_by"] = applied_by
+    claimed = db.query(Job).filter(
+        Job.id == job.id, func.json_extract(Job.result, "$.applied_at").is_(None)
+    ).update({Job.result: json.dumps(result, ensure_ascii=False, default=str)}, synchronize_session=False)
+    if not claimed:
+        raise PlanConflictError("Plan already applied")
+
+    # 持有写锁后重新检查，求解后新增或修改的考试可能与方案冲突
+    settings = result["settings"]
+    exams = result.get("exams", [])
+    unplaced = result.get("unplaced", [])
+    payload = json.loads(job.payload or "{}")
+    if exam_fingerprint(db, payload, build_exam_slots(payload)) != result.get("exam_fingerprint"):
+        raise PlanConflictError("Exams in the window changed after the timetable was generated, please generate again")
+    if settings.get("replace_existing"):
+        course_ids = [exam["course_id"] for exam in exams] + [item["course_id"] for item in unplaced]
+        for values in chunked(course_ids):
+            db.query(Exam).filter(
+                Exam.course_id.in_(values), Exam.exam_type == settings["exam_type"]
+            ).delete(synchronize_session=False)
+    db.bulk_insert_mappings(Exam, [
+        {
+            "course_id": exam["course_id"],
+            "title": exam["title"],
+            "exam_type": exam["exam_type"],
+            "date": datetime.fromisoformat(exam["date"]),
+            "duration": exam["duration"],
+            "location": exam["location"],
+            "max_score": 100
+        }
+        for exam in exams
+    ])
+
+    db.add(SystemLog(
+        user_id=applied_by,
+        action=f"应用考试排期: 任务 {job.id}，{len(exams)} 门课程",
+        resource_type="job",
+        resource_id=str(job.id),
+        status="success"
+    ))
+    db.commit()
+    return {"job_id": job.id, "created_exams": len(exams), "applied_at": result["applied_at"]}
@@ -0,0 +1,270 @@
+"""
+成绩分析
+
+课程（任课教师、管理员）和院系（管理员）的成绩分布：各项成绩的直方图、分位数、均值和标准差，
+期中/平时成绩与期末成绩的相关系数，以及按绩点档次统计的人数。
+
+  - 每次分析只查询一次成绩表，取出需要的几列（列式读取，不加载 ORM 对象），
+    统计在内存中完成：每列排序一次，分位数、直方图和档次人数都在有序列表上二分得到，
+    均值、方差和相关系数各扫描一遍；院系十万条成绩在百毫秒量级
+  - 只统计已提交和已审核的成绩，草稿不计入
+  - 结果按课程、院系缓存。提交成绩后调用 invalidate_course：课程的版本号加一，
+    所有院系结果的版本号加一（课程所属院系随任课教师变化，不单独维护对应关系）；
+    版本号是缓存键的一部分，计算期间发生的失效不会让旧结果被后续请求读到
+"""
+
+import math
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from models import Course, Grade, Teacher
+
+SCORE_FIELDS = ("total_score", "midterm_score", "final_score", "usual_score")
+ANALYZED_STATUSES = ("submitted", "approved")
+PERCENTILES = (10, 25, 50, 75, 90)
+HISTOGRAM_BIN_WIDTH = 10
+HISTOGRAM_MAX_SCORE = 100
+PASS_SCORE = 60
+# 与教师提交成绩时的绩点换算一致：(档次, 最低总评成绩, 绩点)
+GRADE_BANDS = (
+    ("A", 90, 4.0),
+    ("A-", 85, 3.7),
+    ("B+", 82, 3.3),
+    ("B", 78, 3.0),
+    ("B-", 75, 2.7),
+    ("C+", 72, 2.3),
+    ("C", 68, 2.0),
+    ("C-", 64, 1.5),
+    ("D", 60, 1.0),
+    ("F", 0, 0.0),
+)
+
+ANALYTICS_TTL_SECONDS = 1800
+ANALYTICS_CACHE_SIZE = 2000
+
+
+def percentile(ordered: Sequence[float], q: float) -> Optional[float]:
+    """有序列表的 q 分位数（0-100），相邻两值之间线性插值"""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def histogram(ordered: Sequence[float]) -> List[dict]:
+    """按 HISTOGRAM_BIN_WIDTH 分段计数；低于 0 的计入第一段，满分及以上计入最后一段"""
+    edges = list(range(0, HISTOGRAM_MAX_SCORE, HISTOGRAM_BIN_WIDTH))
+    positions = [bisect_left(ordered, edge) for edge in edges[1:]]
+    counts = [b - a for a, b in zip([0] + positions, positions + [len(ordered)])]
+    return [
+        {"min": edge, "max": min(edge + HISTOGRAM_BIN_WIDTH, HISTOGRAM_MAX_SCORE), "count": count}
+        for edge, count in zip(edges, counts)
+    ]
+
+
+def describe(values: Sequence[float]) -> dict:
+    """一列成绩（已去掉空值）的描述统计；标准差为总体标准差"""
+    ordered = sorted(values)
+    count = len(ordered)
+    if not count:
+        return {"count": 0, "mean": None, "stddev": None, "min": None, "max": None,
+                "percentiles": {f"p{q}": None for q in PERCENTILES}, "histogram": histogram(ordered)}
+    mean = math.fsum(ordered) / count
+    variance = math.fsum((value - mean) ** 2 for value in ordered) / count
+    return {
+        "count": count,
+        "mean": round(mean, 2),
+        "stddev": round(math.sqrt(variance), 2),
+        "min": ordered[0],
+        "max": ordered[-1],
+        "percentiles": {f"p{q}": round(percentile(ordered, q), 2) for q in PERCENTILES},
+        "histogram": histogram(ordered)
+    }
+
+
+def correlation(xs: Sequence[Optional[float]], ys: Sequence[Optional[float]]) -> dict:
+    """两列成绩的皮尔逊相关系数，只用两项都有成绩的记录；样本不足或某列无差异时 r 为 None"""
+    pairs = [(x, y) for x, y in zip(xs, ys) if x is not None and y is not None]
+    count = len(pairs)
+    if count < 2:
+        return {"count": count, "r": None}
+    mean_x = math.fsum(x for x, _ in pairs) / count
+    mean_y = math.fsum(y for _, y in pairs) / count
+    sxy = math.fsum((x - mean_x) * (y - mean_y) for x, y in pairs)
+    sxx = math.fsum((x - mean_x) ** 2 for x, _ in pairs)
+    syy = math.fsum((y - mean_y) ** 2 for _, y in pairs)
+    if sxx == 0 or syy == 0:
+        return {"count": count, "r": None}
+    return {"count": count, "r": round(sxy / math.sqrt(sxx * syy), 4)}
+
+
+def grade_bands(ordered_totals: Sequence[float]) -> List[dict]:
+    """按总评成绩统计各档次人数，ordered_totals 已排序"""
+    count = len(ordered_totals)
+    bands, upper_position = [], count
+    for band, min_score, gpa in GRADE_BANDS:
+        position = bisect_left(ordered_totals, min_score) if min_score > 0 else 0
+        band_count = upper_position - position
+        bands.append({
+            "band": band,
+            "min_score": min_score,
+            "gpa": gpa,
+            "count": band_count,
+            "ratio": round(band_count / count, 4) if count else 0.0
+        })
+        upper_position = position
+    return bands
+
+
+def analyze_columns(columns: Dict[str, Sequence[Optional[float]]]) -> dict:
+    """对列式成绩数据（字段名 -> 值列表，各列等长，可含空值）做完整分析"""
+    scores = {
+        field: describe([value for value in columns[field] if value is not None])
+        for field in SCORE_FIELDS
+    }
+    totals = sorted(value for value in columns["total_score"] if value is not None)
+    gpas = [value for value in columns["gpa"] if value is not None]
+    passed = len(totals) - bisect_left(totals, PASS_SCORE)
+    return {
+        "count": len(columns["total_score"]),
+        "scores": scores,
+        "gpa_mean": round(math.fsum(gpas) / len(gpas), 2) if gpas else None,
+        "pass_rate": round(passed / len(totals), 4) if totals else None,
+        "grade_bands": grade_bands(totals),
+        "correlations": {
+            "midterm_final": correlation(columns["midterm_score"], columns["final_score"]),
+            "usual_final": correlation(columns["usual_score"], columns["final_score"])
+        }
+    }
+
+
+def _grade_columns(db: Session, *criteria, extra=()) -> Dict[str, list]:
+    """一次查询取出成绩表的各列，转成字段名 -> 值列表"""
+    fields = SCORE_FIELDS + ("gpa",)
+    stmt = select(*extra, *(getattr(Grade, field) for field in fields)).where(
+        Grade.status.in_(ANALYZED_STATUSES), *criteria
+    )
+    rows = db.execute(stmt).all()
+    names = [column.key for column in extra] + list(fields)
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    return dict(zip(names, columns))
+
+
+def compute_course_analytics(db: Session, course: Course, semester: Optional[str] = None) -> dict:
+    criteria = [Grade.course_id == course.id]
+    if semester:
+        criteria.append(Grade.semester == semester)
+    return {
+        "course_id": course.id,
+        "course_code": course.code,
+        "course_name": course.name,
+        "semester": semester,
+        **analyze_columns(_grade_columns(db, *criteria)),
+        "computed_at": datetime.now()
+    }
+
+
+def compute_department_analytics(db: Session, department: str, semester: Optional[str] = None) -> Optional[dict]:
+    """院系所有课程（按任课教师所属院系）的成绩分析，附各课程的人数、均分和及格率；院系没有课程时返回 None"""
+    courses = db.execute(
+        select(Course.id, Course.code, Course.name)
+        .join(Teacher, Course.teacher_id == Teacher.id)
+        .where(Teacher.department == department)
+        .order_by(Course.code)
+    ).all()
+    if not courses:
+        return None
+
+    department_courses = select(Course.id).join(Teacher, Course.teacher_id == Teacher.id).where(
+        Teacher.department == department
+    )
+    criteria = [Grade.course_id.in_(department_courses)]
+    if semester:
+        criteria.append(Grade.semester == semester)
+    columns = _grade_columns(db, *criteria, extra=(Grade.course_id,))
+
+    # 各课程汇总：人数、总分、及格人数
+    per_course = {}
+    for course_id, total in zip(columns["course_id"], columns["total_score"]):
+        summary = per_course.setdefault(course_id, [0, 0.0, 0])
+        if total is None:
+            continue
+        summary[0] += 1
+        summary[1] += total
+        summary[2] += total >= PASS_SCORE
+
+    course_summaries = []
+    for course_id, course_code, name in courses:
+        count, score_sum, passed = per_course.get(course_id, (0, 0.0, 0))
+        course_summaries.append({
+            "course_id": course_id,
+            "course_code": course_code,
+            "course_name": name,
+            "count": count,
+            "mean": round(score_sum / count, 2) if count else None,
+            "pass_rate": round(passed / count, 4) if count else None
+        })
+
+    return {
+        "department": department,
+        "semester": semester,
+        "course_count": len(courses),
+        **analyze_columns(columns),
+        "courses": course_summaries,
+        "computed_at": datetime.now()
+    }
+
+
+class GradeAnalyticsCache:
+    """课程、院系成绩分析结果的缓存，键中带版本号，失效时只需把版本号加一"""
+
+    def __init__(self, ttl: float = ANALYTICS_TTL_SECONDS):
+        self._cache = TTLCache(maxsize=ANALYTICS_CACHE_SIZE, ttl=ttl, name="grade_analytics")
+        self._lock = threading.Lock()
+        self._course_versions: Dict[int, int] = {}
+        self._department_version = 0
+        self._generation = 0
+
+    def invalidate_course(self, course_id: int):
+        """课程成绩或任课教师变化"""
+        with self._lock:
+            self._course_versions[course_id] = self._course_versions.get(course_id, 0) + 1
+            self._department_version += 1
+
+    def clear(self):
+        with self._lock:
+            self._course_versions.clear()
+            self._generation += 1
+        self._cache.clear()
+
+    def course(self, db: Session, course: Course, semester: Optional[str] = None) -> dict:
+        """课程成绩分析；返回的字典来自缓存，调用方不应修改"""
+        with self._lock:
+            key = ("course", course.id, semester, self._generation, self._course_versions.get(course.id, 0))
+        result = self._cache.get(key)
+        if result is None:
+            result = compute_course_analytics(db, course, semester)
+            self._cache.set(key, result)
+        return result
+
+    def department(self, db: Session, department: str, semester: Optional[str] = None) -> Optional[dict]:
+        """院系成绩分析，院系没有课程时返回 None"""
+        with self._lock:
+            key = ("department", department, semester, self._generation, self._department_version)
+        result = self._cache.get(key)
+        if result is None:
+            result = compute_department_analytics(db, department, semester)
+            if result is not None:
+                self._cache.set(key, result)
+        return result
+
+
+grade_analytics = GradeAnalyticsCache()
@@ -0,0 +1,186 @@
+"""
+成绩审核流程
+
+  draft（教师录入）--提交--> submitted --审核通过--> approved（锁定，不能再修改）
+                               |  ^
+                            退回  | 重新提交
+                               v  |
+                             returned（教师修改后重新提交）
+
+  - 教师按课程（和学期）整批提交，管理员按学期整批审核通过，可限定院系或课程，也可退回一门课程的成绩；
+    每个操作是一条带状态条件的 UPDATE（RETURNING 取回受影响的行），不逐条加载成绩
+  - 每次状态变化或修改成绩都把 version 加一。请求中可以带上读取时的 (成绩 ID, version)，
+    这时只更新版本号仍然一致的成绩；有任何一条对不上（已被他人修改或状态不对）则整体回滚并返回 409
+  - 已提交、已审核的成绩计入成绩分析和排名，提交和退回后相应更新，审核通过不改变统计范围
+"""
+
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy import case, func, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from models import Course, Grade, Teacher, User
+from query_utils import chunked
+from serice.grade_analytics_service import grade_analytics
+from serice.ranking_service import rankings
+
+GRADE_STATUSES = ("draft", "submitted", "returned", "approved")
+# 教师可以修改的状态；修改已提交的成绩会撤回到草稿，需要重新提交
+EDITABLE_STATUSES = ("draft", "submitted", "returned")
+LOCKED_STATUS = "approved"
+
+
+class GradeWorkflowError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class GradeVersion(BaseModel):
+    id: int
+    version: int
+
+
+class GradeSubmitRequest(BaseModel):
+    semester: str
+    grades: Optional[List[GradeVersion]] = None
+
+
+class GradeApproveRequest(BaseModel):
+    semester: str
+    department: Optional[str] = None
+    course_ids: Optional[List[int]] = None
+    grades: Optional[List[GradeVersion]] = None
+
+
+class GradeReturnRequest(BaseModel):
+    course_id: int
+    semester: str
+    reason: str
+    grades: Optional[List[GradeVersion]] = None
+
+
+def _transition(db: Session, from_statuses: Sequence[str], to_status: str, criteria: list,
+                expected: Optional[List[GradeVersion]] = None, **values) -> List[Tuple[int, int]]:
+    """
+    把满足条件、处于 from_statuses 的成绩改为 to_status，返回受影响成绩的 (student_id, course_id)。
+    指定 expected 时只更新其中版本号一致的成绩，数量不符则回滚并抛出 409。
+    """
+    stmt = update(Grade).where(Grade.status.in_(from_statuses), *criteria).values(
+        status=to_status, version=Grade.version + 1, **values
+    ).returning(Grade.student_id, Grade.course_id).execution_options(synchronize_session=False)
+
+    if expected is None:
+        rows = db.execute(stmt).all()
+    else:
+        pairs = {(grade.id, grade.version) for grade in expected}
+        rows = []
+        for values_chunk in chunked(pairs):
+            rows.extend(db.execute(stmt.where(tuple_(Grade.id, Grade.version).in_(values_chunk))).all())
+        if len(rows) != len(pairs):
+            db.rollback()
+            raise GradeWorkflowError(
+                409,
+                f"{len(pairs) - len(rows)} of {len(pairs)} grades were modified or are not {'/'.join(from_statuses)}; "
+                "reload and retry"
+            )
+    db.commit()
+    return [(student_id, course_id) for student_id, course_id in rows]
+
+
+def _counted_grades_changed(db: Session, rows: Iterable[Tuple[int, int]]):
+    """计入统计的成绩集合变化后，更新成绩分析和排名"""
+    rows = list(rows)
+    course_ids = {course_id for _, course_id in rows}
+    for course_id in course_ids:
+        grade_analytics.invalidate_course(course_id)
+    rankings.invalidate_courses(course_ids)
+    rankings.update_students(db, {student_id for student_id, _ in rows})
+
+
+def submit_course_grades(db: Session, course_id: int, semester: str,
+                         expected: Optional[List[GradeVersion]] = None) -> dict:
+    """教师提交一门课程某学期的草稿和被退回的成绩"""
+    rows = _transition(db, ("draft", "returned"), "submitted",
+                       [Grade.course_id == course_id, Grade.semester == semester], expected)
+    _counted_grades_changed(db, rows)
+    return {"course_id": course_id, "semester": semester, "submitted": len(rows)}
+
+
+def approve_grades(db: Session, request: GradeApproveRequest, reviewer_id: int) -> dict:
+    """审核通过一个学期已提交的成绩，可限定院系（任课教师所属院系）或课程"""
+    criteria = [Grade.semester == request.semester]
+    if request.course_ids:
+        criteria.append(Grade.course_id.in_(request.course_ids))
+    if request.department:
+        criteria.append(Grade.course_id.in_(
+            select(Course.id).join(Teacher, Course.teacher_id == Teacher.id).where(Teacher.department == request.department)
+        ))
+    rows = _transition(db, ("submitted",), LOCKED_STATUS, criteria, request.grades,
+                       reviewed_by=reviewer_id, reviewed_at=datetime.utcnow(), review_comment=None)
+    # 已提交和已审核都计入统计，审核通过不改变统计范围
+    return {
+        "semester": request.semester,
+        "approved": len(rows),
+        "courses": len({course_id for _, course_id in rows})
+    }
+
+
+def return_grades(db: Session, request: GradeReturnRequest, reviewer_id: int) -> dict:
+    """退回一门课程某学期已提交的成绩（可只退回 grades 中列出的），教师修改后重新提交"""
+    if not request.reason.strip():
+        raise GradeWorkflowError(400, "A reason is required when returning grades")
+    rows = _transition(db, ("submitted",), "returned",
+                       [Grade.course_id == request.course_id, Grade.semester == request.semester], request.grades,
+                       reviewed_by=reviewer_id, reviewed_at=datetime.utcnow(), review_comment=request.reason.strip())
+    _counted_grades_changed(db, rows)
+    return {"course_id": request.course_id, "semester": request.semester, "returned": len(rows)}
+
+
+def status_counts_columns():
+    """按状态计数的聚合列，标签为状态名"""
+    return [func.sum(case((Grade.status == status, 1), else_=0)).label(status) for status in GRADE_STATUSES]
+
+
+def review_queue(db: Session, semester: Optional[str] = None, department: Optional[str] = None,
+                 status: str = "submitted", page: int = 1, page_size: int = 20) -> dict:
+    """按课程汇总各状态的成绩数，只列出有 status 状态成绩的课程，一次分组查询"""
+    if status not in GRADE_STATUSES:
+        raise GradeWorkflowError(400, f"status must be one of {', '.join(GRADE_STATUSES)}")
+    query = select(
+        Course.id, Course.code, Course.name, Grade.semester, Teacher.department, User.full_name,
+        *status_counts_columns()
+    ).join(Course, Grade.course_id == Course.id).outerjoin(
+        Teacher, Course.teacher_id == Teacher.id
+    ).outerjoin(User, Teacher.user_id == User.id).group_by(
+        Course.id, Grade.semester
+    ).having(func.sum(case((Grade.status == status, 1), else_=0)) > 0)
+    if semester:
+        query = query.where(Grade.semester == semester)
+    if department:
+        query = query.where(Teacher.department == department)
+
+    total = db.execute(select(func.count()).select_from(query.subquery())).scalar()
+    rows = db.execute(query.order_by(Grade.semester, Course.code).offset((page - 1) * page_size).limit(page_size))
+    items = [
+        {
+            "course_id": row.id,
+            "course_code": row.code,
+            "course_name": row.name,
+            "semester": row.semester,
+            "department": row.department,
+            "teacher": row.full_name,
+            "counts": {status_name: getattr(row, status_name) for status_name in GRADE_STATUSES}
+        }
+        for row in rows
+    ]
+    return {
+        "items": items,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": (total + page_size - 1) // page_size
+    }
@@ -0,0 +1,304 @@
+"""
+服务健康监测
+
+后台定时探测数据库往返延迟、连接池占用、事件循环延迟和 AI 上游连通性，
+结果写入滚动时间窗口，供 /health/ready、/health/live 和管理员仪表板使用。
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from cache import CACHES
+from database import engine
+
+# 滚动窗口长度（秒）
+HEALTH_WINDOW_SECONDS = 300
+# 探测间隔（秒）
+DB_PROBE_INTERVAL = 5
+LOOP_LAG_INTERVAL = 0.5
+AI_PROBE_INTERVAL = 60
+AI_PROBE_TIMEOUT = 3
+
+# 阈值：超过 warn 为“警告”，超过 fail 为“异常”，异常时 /health/ready 返回 503
+DB_LATENCY_WARN_MS = 100
+DB_LATENCY_FAIL_MS = 1000
+POOL_SATURATION_WARN = 0.8
+POOL_SATURATION_FAIL = 0.95
+LOOP_LAG_WARN_MS = 50
+LOOP_LAG_FAIL_MS = 500
+
+STATUS_OK = "正常"
+STATUS_WARN = "警告"
+STATUS_FAIL = "异常"
+
+DEFAULT_AI_HOST = "open.bigmodel.cn"
+
+
+class RollingWindow:
+    """按时间滚动的采样窗口，记录数值和成功/失败"""
+
+    def __init__(self, window_seconds: float = HEALTH_WINDOW_SECONDS, maxlen: int = 4096):
+        self.window_seconds = window_seconds
+        self._samples = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, value: Optional[float], ok: bool = True):
+        with self._lock:
+            self._samples.append((time.monotonic(), value, ok))
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return list(self._samples)
+
+    def summary(self) -> dict:
+        samples = self._recent()
+        values = sorted(value for _, value, ok in samples if ok and value is not None)
+        successes = sum(1 for _, _, ok in samples if ok)
+        last = samples[-1] if samples else None
+        return {
+            "count": len(samples),
+            "success_rate": successes / len(samples) if samples else None,
+            "avg": sum(values) / len(values) if values else None,
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))] if values else None,
+            "max": values[-1] if values else None,
+            "last": last[1] if last else None,
+            "last_ok": last[2] if last else None
+        }
+
+
+def _grade(value: Optional[float], warn: float, fail: float) -> str:
+    if value is None:
+        return STATUS_OK
+    if value >= fail:
+        return STATUS_FAIL
+    if value >= warn:
+        return STATUS_WARN
+    return STATUS_OK
+
+
+def _round(value: Optional[float], digits: int = 2):
+    return round(value, digits) if value is not None else None
+
+
+def pool_status() -> dict:
+    """连接池占用情况，非 QueuePool（如 StaticPool）只返回类型"""
+    pool = engine.pool
+    status = {"type": type(pool).__name__}
+    if not hasattr(pool, "checkedout"):
+        return status
+    size = pool.size()
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    checked_out = pool.checkedout()
+    capacity = size + max_overflow if max_overflow >= 0 else None
+    status.update({
+        "size": size,
+        "max_overflow": max_overflow,
+        "checked_out": checked_out,
+        "overflow": pool.overflow(),
+        "saturation": round(checked_out / capacity, 4) if capacity else 0.0
+    })
+    return status
+
+
+def cache_status() -> dict:
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+class HealthMonitor:
+    def __init__(self):
+        self.db_latency = RollingWindow()
+        self.pool_saturation = RollingWindow()
+        self.loop_lag = RollingWindow()
+        self.ai_latency = RollingWindow()
+        self.started_at = time.monotonic()
+        self._tasks = []
+
+    # ---- 探测 ----
+
+    def probe_database(self):
+        start = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception as e:
+            print(f"数据库健康检查失败: {e}")
+            self.db_latency.add(None, ok=False)
+        else:
+            self.db_latency.add((time.perf_counter() - start) * 1000)
+        self.pool_saturation.add(pool_status().get("saturation", 0.0))
+
+    async def probe_ai_upstream(self):
+        from serice.ai_service import client
+        if client is None:
+            self.ai_latency.add(None, ok=False)
+            return
+        host = urlparse(str(getattr(client, "base_url", ""))).hostname or DEFAULT_AI_HOST
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, 443), AI_PROBE_TIMEOUT)
+            writer.close()
+        except Exception:
+            self.ai_latency.add(None, ok=False)
+        else:
+            self.ai_latency.add((time.perf_counter() - start) * 1000)
+
+    async def _database_loop(self):
+        while True:
+            await run_in_threadpool(self.probe_database)
+            await asyncio.sleep(DB_PROBE_INTERVAL)
+
+    async def _loop_lag_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lag.add(max(0.0, (loop.time() - start - LOOP_LAG_INTERVAL) * 1000))
+
+    async def _ai_loop(self):
+        while True:
+            await self.probe_ai_upstream()
+            await asyncio.sleep(AI_PROBE_INTERVAL)
+
+    def start(self):
+        if self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._database_loop()),
+            loop.create_task(self._loop_lag_loop()),
+            loop.create_task(self._ai_loop())
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---- 汇总 ----
+
+    def report(self) -> dict:
+        db = self.db_latency.summary()
+        if db["last_ok"] is False:
+            db_status = STATUS_FAIL
+        else:
+            db_status = _grade(db["p95"], DB_LATENCY_WARN_MS, DB_LATENCY_FAIL_MS)
+
+        pool = pool_status()
+        pool_window = self.pool_saturation.summary()
+        pool_state = _grade(pool_window["max"], POOL_SATURATION_WARN, POOL_SATURATION_FAIL)
+
+        lag = self.loop_lag.summary()
+        lag_status = _grade(lag["p95"], LOOP_LAG_WARN_MS, LOOP_LAG_FAIL_MS)
+
+        ai = self.ai_latency.summary()
+        if ai["count"] == 0:
+            ai_status = STATUS_WARN
+        else:
+            ai_status = STATUS_OK if ai["last_ok"] else STATUS_WARN
+
+        caches = cache_status()
+
+        # AI 为可选依赖，不影响就绪状态
+        ready = STATUS_FAIL not in (db_status, pool_state, lag_status)
+        degraded = STATUS_WARN in (db_status, pool_state, lag_status, ai_status)
+
+        return {
+            "status": "healthy" if ready and not degraded else ("degraded" if ready else "unhealthy"),
+            "ready": ready,
+            "uptime_seconds": round(time.monotonic() - self.started_at),
+            "window_seconds": HEALTH_WINDOW_SECONDS,
+            "checks": {
+                "database": {
+                    "status": db_status,
+                    "latency_ms": {
+                        "last": _round(db["last"]),
+                        "avg": _round(db["avg"]),
+                        "p95": _round(db["p95"]),
+                        "max": _round(db["max"])
+                    },
+                    "success_rate": _round(db["success_rate"], 4)
+                },
+                "connection_pool": {
+                    "status": pool_state,
+                    **pool,
+                    "max_saturation": _round(pool_window["max"], 4)
+                },
+                "event_loop": {
+                    "status": lag_status,
+                    "lag_ms": {
+                        "avg": _round(lag["avg"]),
+                        "p95": _round(lag["p95"]),
+                        "max": _round(lag["max"])
+                    }
+                },
+                "ai_upstream": {
+                    "status": ai_status,
+                    "reachable": ai["last_ok"],
+                    "latency_ms": _round(ai["last"]),
+                    "success_rate": _round(ai["success_rate"], 4)
+                },
+                "caches": caches
+            }
+        }
+
+    def dashboard_services(self, report: Optional[dict] = None) -> list:
+        """管理员仪表板的服务状态列表"""
+        report = report or self.report()
+        checks = report["checks"]
+
+        def uptime(rate):
+            return f"{rate * 100:.1f}%" if rate is not None else "-"
+
+        def ms(value):
+            return f"{value:.0f}ms" if value is not None else "-"
+
+        caches = checks["caches"]
+        hits = sum(cache["hits"] for cache in caches.values())
+        lookups = hits + sum(cache["misses"] for cache in caches.values())
+
+        return [
+            {
+                "service": "数据库服务",
+                "status": checks["database"]["status"],
+                "uptime": uptime(checks["database"]["success_rate"]),
+                "response": ms(checks["database"]["latency_ms"]["p95"])
+            },
+            {
+                "service": "连接池",
+                "status": checks["connection_pool"]["status"],
+                "uptime": f"占用 {checks['connection_pool'].get('checked_out', 0)}/{checks['connection_pool'].get('size', '-')}",
+                "response": "-"
+            },
+            {
+                "service": "事件循环",
+                "status": checks["event_loop"]["status"],
+                "uptime": f"{report['uptime_seconds']}s",
+                "response": ms(checks["event_loop"]["lag_ms"]["p95"])
+            },
+            {
+                "service": "AI服务",
+                "status": checks["ai_upstream"]["status"],
+                "uptime": uptime(checks["ai_upstream"]["success_rate"]),
+                "response": ms(checks["ai_upstream"]["latency_ms"])
+            },
+            {
+                "service": "缓存服务",
+                "status": STATUS_OK,
+                "uptime": f"命中率 {hits / lookups * 100:.1f}%" if lookups else "-",
+                "response": "-"
+            }
+        ]
+
+
+health_monitor = HealthMonitor()
@@ -0,0 +1,617 @@
+"""
+学生和选课批量导入
+
+上传的 CSV/XLSX 先写入临时文件，再逐行流式读取，按块（IMPORT_CHUNK_SIZE 行）处理：
+先做行内校验，再用集合查询一次性检查该块与 users.username、users.email、
+students.student_id 的重复，最后批量插入并提交。每块独立提交，出错的行记录行号和原因，
+不影响其他行。导入作为后台任务执行（见 job_service），进度和错误明细通过
+/admin/jobs/{id} 查询；取消时已提交的块会保留。
+学生账号的密码用 bcrypt 哈希，在进程池中并行计算；文件中没有提供密码的账号生成随机初始密码，
+与账号在同一事务中写入 import_credentials，任务失败或取消时已提交块的密码也不会丢失。
+任务结果只记录生成的个数，明文通过 take_initial_passwords 下载一次后即删除，由管理员分发。
+上传文件保存在 IMPORT_UPLOAD_DIR 中，任务完成或取消后删除；失败的任务保留文件以便重试，
+超过 UPLOAD_RETENTION_DAYS 的失败任务文件和没有对应任务的遗留文件由 cleanup_import_uploads 任务清理。
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import Executor
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, tuple_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Job, ImportCredential, User, UserRole, Student, Course, Enrollment, SystemLog
+from query_utils import chunked, existing_values
+from security import generate_initial_password, get_password_hashes, password_hash_pool
+from serice.catalog_service import course_catalog
+from serice.calendar_service import calendar_feeds
+from serice.enrollment_service import lock_courses
+from serice.job_service import (
+    STATUS_FAILED, STATUS_PENDING, STATUS_RUNNING, JobCancelled, JobContext, enqueue, register_job
+)
+
+IMPORT_CHUNK_SIZE = 1000
+# 每个导入任务最多保留的错误明细条数，超出部分只计数
+MAX_REPORTED_ERRORS = 1000
+UPLOAD_READ_SIZE = 1024 * 1024
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_UPLOAD_DIR = os.getenv("IMPORT_UPLOAD_DIR", os.path.join(BASE_DIR, "uploads", "imports"))
+# 失败任务的上传文件保留天数，期间可以重试
+UPLOAD_RETENTION_DAYS = 7
+# 保存上传文件到入队之间的宽限时间，没有对应任务的文件超过该时间才清理
+ORPHAN_UPLOAD_GRACE_SECONDS = 3600
+
+KIND_STUDENTS = "students"
+KIND_ENROLLMENTS = "enrollments"
+JOB_TYPES = {
+    KIND_STUDENTS: "import_students",
+    KIND_ENROLLMENTS: "import_enrollments",
+}
+
+# 表头别名 -> 字段名
+STUDENT_COLUMNS = {
+    "username": "username", "用户名": "username",
+    "email": "email", "邮箱": "email",
+    "full_name": "full_name", "name": "full_name", "姓名": "full_name",
+    "student_id": "student_id", "学号": "student_id",
+    "class_name": "class_name", "班级": "class_name",
+    "enrollment_year": "enrollment_year", "入学年份": "enrollment_year",
+    "phone": "phone", "电话": "phone",
+    "address": "address", "地址": "address",
+    "password": "password", "初始密码": "password",
+}
+ENROLLMENT_COLUMNS = {
+    "student_id": "student_id", "学号": "student_id",
+    "course_code": "course_code", "code": "course_code", "课程代码": "course_code",
+    "status": "status", "状态": "status",
+}
+REQUIRED_COLUMNS = {
+    KIND_STUDENTS: ("email", "full_name", "student_id"),
+    KIND_ENROLLMENTS: ("student_id", "course_code"),
+}
+ENROLLMENT_STATUSES = ("active", "completed")
+
+FIELD_LABELS = {"username": "用户名", "email": "邮箱", "student_id": "学号"}
+
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+class ImportFileError(ValueError):
+    """文件格式错误（无法读取、缺少必填列等），整个导入失败"""
+
+
+# ---- 文件读取 ----
+
+def _normalize_header(header) -> str:
+    return str(header or "").strip().lower()
+
+
+def _map_header(headers, aliases, kind) -> List[Optional[str]]:
+    fields = [aliases.get(_normalize_header(header)) for header in headers]
+    missing = [column for column in REQUIRED_COLUMNS[kind] if column not in fields]
+    if missing:
+        raise ImportFileError(f"缺少必填列: {', '.join(missing)}")
+    return fields
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    # Excel 中的数字学号会被读成浮点数
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _iter_csv(path: str) -> Iterator[list]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.reader(f)
+
+
+def _iter_xlsx(path: str) -> Iterator[list]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError("读取 XLSX 需要安装 openpyxl")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def iter_records(path: str, file_format: str, kind: str) -> Iterator[Tuple[int, dict]]:
+    """逐行产生 (行号, 记录)，行号与表格中看到的一致（表头为第 1 行）"""
+    aliases = STUDENT_COLUMNS if kind == KIND_STUDENTS else ENROLLMENT_COLUMNS
+    rows = _iter_xlsx(path) if file_format == "xlsx" else _iter_csv(path)
+    try:
+        headers = next(rows)
+    except StopIteration:
+        raise ImportFileError("文件为空")
+    except UnicodeDecodeError:
+        raise ImportFileError("CSV 文件必须使用 UTF-8 编码")
+    fields = _map_header(headers, aliases, kind)
+
+    for row_number, row in enumerate(rows, start=2):
+        values = [_cell(value) for value in row]
+        if not any(values):
+            continue
+        yield row_number, {
+            field: value for field, value in zip(fields, values) if field is not None
+        }
+
+
+def count_rows(path: str, file_format: str) -> Optional[int]:
+    """数据行数（不含表头），用于计算进度"""
+    if file_format == "xlsx":
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            return None
+        workbook = load_workbook(path, read_only=True)
+        try:
+            max_row = workbook.active.max_row
+        finally:
+            workbook.close()
+        return max(0, max_row - 1) if max_row else None
+    with open(path, "rb") as f:
+        return max(0, sum(1 for line in f if line.strip()) - 1)
+
+
+def detect_format(filename: str) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".xlsx", ".xlsm"):
+        return "xlsx"
+    raise ImportFileError("只支持 .csv 或 .xlsx 文件")
+
+
+async def save_upload(upload) -> str:
+    """分块把上传文件写入临时文件，返回路径"""
+    suffix = os.path.splitext(upload.filename or "")[1]
+    os.makedirs(IMPORT_UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="import_", suffix=suffix, dir=IMPORT_UPLOAD_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_READ_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+# ---- 进度 ----
+
+class ImportProgress:
+    """导入计数和错误明细，作为任务的进度详情和最终结果"""
+
+    def __init__(self, kind: str, filename: str, dry_run: bool = False, job_id: Optional[int] = None):
+        self.kind = kind
+        self.job_id = job_id
+        self.filename = filename
+        self.dry_run = dry_run
+        self.total_rows: Optional[int] = None
+        self.processed_rows = 0
+        self.inserted_rows = 0
+        self.failed_rows = 0
+        self.errors: List[dict] = []
+        # 生成随机初始密码的账号数，明文只保存在 import_credentials 中
+        self.initial_passwords = 0
+
+    def add_error(self, row_number: int, message: str, value: Optional[str] = None):
+        self.failed_rows += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            error = {"row": row_number, "error": message}
+            if value:
+                error["value"] = value
+            self.errors.append(error)
+
+    @property
+    def fraction(self) -> Optional[float]:
+        return self.processed_rows / self.total_rows if self.total_rows else None
+
+    def to_dict(self, include_errors: bool = False) -> dict:
+        data = {
+            "kind": self.kind,
+            "filename": self.filename,
+            "dry_run": self.dry_run,
+            "total_rows": self.total_rows,
+            "processed_rows": self.processed_rows,
+            "inserted_rows": self.inserted_rows,
+            "failed_rows": self.failed_rows,
+            "initial_passwords": self.initial_passwords,
+        }
+        if include_errors:
+            data["errors"] = sorted(self.errors, key=lambda error: error["row"])
+            data["errors_truncated"] = self.failed_rows > len(self.errors)
+        return data
+
+
+# ---- 校验和插入 ----
+
+def _import_students_chunk(db: Session, chunk, progress: ImportProgress, seen: Dict[str, set],
+                           executor: Optional[Executor] = None):
+    valid = []
+    for row_number, record in chunk:
+        student_id = record.get("student_id", "")
+        email = record.get("email", "").lower()
+        username = record.get("username") or student_id
+        full_name = record.get("full_name", "")
+
+        if not student_id or not email or not full_name:
+            progress.add_error(row_number, "学号、邮箱和姓名不能为空")
+            continue
+        if len(student_id) > 20 or len(username) > 50:
+            progress.add_error(row_number, "学号或用户名过长", student_id)
+            continue
+        if not EMAIL_PATTERN.match(email):
+            progress.add_error(row_number, "邮箱格式不正确", email)
+            continue
+        year = record.get("enrollment_year", "")
+        if year and not (year.isdigit() and 1900 < int(year) < 2200):
+            progress.add_error(row_number, "入学年份格式不正确", year)
+            continue
+
+        # 文件内重复
+        duplicate = next((
+            (field, value) for field, value in (("username", username), ("email", email), ("student_id", student_id))
+            if value in seen[field]
+        ), None)
+        if duplicate:
+            progress.add_error(row_number, f"文件中重复的{FIELD_LABELS[duplicate[0]]}", duplicate[1])
+            continue
+        seen["username"].add(username)
+        seen["email"].add(email)
+        seen["student_id"].add(student_id)
+
+        valid.append((row_number, {
+            "username": username,
+            "email": email,
+            "full_name": full_name,
+            "student_id": student_id,
+            "class_name": record.get("class_name") or None,
+            "enrollment_year": int(year) if year else None,
+            "phone": record.get("phone") or None,
+            "address": record.get("address") or None,
+            "password": record.get("password") or None,
+        }))
+
+    if not valid:
+        return
+
+    # 先计算哈希再查询：计算耗时较长，期间不持有数据库的读事务
+    if not progress.dry_run:
+        for _, row in valid:
+            if row["password"] is None:
+                row["password"] = generate_initial_password()
+                row["generated_password"] = True
+        hashes = get_password_hashes([row["password"] for _, row in valid], executor)
+        for (_, row), password_hash in zip(valid, hashes):
+            row["password_hash"] = password_hash
+
+    # 与数据库中已有数据的重复，每个字段一次集合查询
+    existing_usernames = existing_values(db, User.username, [row["username"] for _, row in valid])
+    existing_emails = existing_values(db, User.email, [row["email"] for _, row in valid])
+    existing_student_ids = existing_values(db, Student.student_id, [row["student_id"] for _, row in valid])
+
+    rows = []
+    for row_number, row in valid:
+        if row["username"] in existing_usernames:
+            progress.add_error(row_number, "用户名已存在", row["username"])
+        elif row["email"] in existing_emails:
+            progress.add_error(row_number, "邮箱已存在", row["email"])
+        elif row["student_id"] in existing_student_ids:
+            progress.add_error(row_number, "学号已存在", row["student_id"])
+        else:
+            rows.append(row)
+
+    if not rows or progress.dry_run:
+        progress.inserted_rows += len(rows)
+        return
+
+    now = datetime.utcnow()
+    user_ids = db.execute(
+        insert(User).returning(User.id, User.username, sort_by_parameter_order=True),
+        [
+            {
+                "username": row["username"],
+                "email": row["email"],
+                "password_hash": row["password_hash"],
+                "full_name": row["full_name"],
+                "role": UserRole.STUDENT,
+                "is_active": True,
+                "token_version": 0,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for row in rows
+        ]
+    ).all()
+    db.execute(insert(Student), [
+        {
+            "user_id": user_id,
+            "student_id": row["student_id"],
+            "class_name": row["class_name"],
+            "enrollment_year": row["enrollment_year"],
+            "phone": row["phone"],
+            "address": row["address"],
+        }
+        for (user_id, _), row in zip(user_ids, rows)
+    ])
+    credentials = [
+        {
+            "job_id": progress.job_id,
+            "username": row["username"],
+            "student_id": row["student_id"],
+            "password": row["password"],
+            "created_at": now,
+        }
+        for row in rows if row.get("generated_password")
+    ]
+    if credentials:
+        db.execute(insert(ImportCredential), credentials)
+    db.commit()
+    progress.inserted_rows += len(rows)
+    progress.initial_passwords += len(credentials)
+
+
+def _import_enrollments_chunk(db: Session, chunk, progress: ImportProgress, seen: Dict[str, set],
+                              executor: Optional[Executor] = None):
+    valid = []
+    for row_number, record in chunk:
+        student_number = record.get("student_id", "")
+        course_code = record.get("course_code", "")
+        status = (record.get("status") or "active").lower()
+        if not student_number or not course_code:
+            progress.add_error(row_number, "学号和课程代码不能为空")
+            continue
+        if status not in ENROLLMENT_STATUSES:
+            progress.add_error(row_number, "状态必须为 active 或 completed", status)
+            continue
+        key = (student_number, course_code)
+        if key in seen["pairs"]:
+            progress.add_error(row_number, "文件中重复的选课", f"{student_number} {course_code}")
+            continue
+        seen["pairs"].add(key)
+        valid.append((row_number, student_number, course_code, status))
+
+    if not valid:
+        return
+
+    # 学号、课程代码 -> 主键，各一次集合查询
+    student_ids = {}
+    for values in chunked({student_number for _, student_number, _, _ in valid}):
+        student_ids.update(db.query(Student.student_id, Student.id).filter(Student.student_id.in_(values)))
+    courses = {}
+    for values in chunked({course_code for _, _, course_code, _ in valid}):
+        for code, course_id, max_students, is_active in db.query(
+            Course.code, Course.id, Course.max_students, Course.is_active
+        ).filter(Course.code.in_(values)):
+            courses[code] = (course_id, max_students, is_active)
+
+    resolved = []
+    for row_number, student_number, course_code, status in valid:
+        if student_number not in student_ids:
+            progress.add_error(row_number, "学号不存在", student_number)
+        elif course_code not in courses:
+            progress.add_error(row_number, "课程代码不存在", course_code)
+        elif not courses[course_code][2]:
+            progress.add_error(row_number, "课程已停用", course_code)
+        else:
+            resolved.append((row_number, student_ids[student_number], courses[course_code][0], status))
+
+    if not resolved:
+        return
+
+    # 已有的有效选课和各课程当前人数；先锁定课程，与学生选课接口互斥，统计到提交期间人数不会变化
+    course_ids = {course_id for _, _, course_id, _ in resolved}
+    if not progress.dry_run:
+        lock_courses(db, course_ids)
+    pairs = [(student_id, course_id) for _, student_id, course_id, _ in resolved]
+    existing_pairs = set()
+    for values in chunked(pairs):
+        existing_pairs.update(
+            db.query(Enrollment.student_id, Enrollment.course_id).filter(
+                tuple_(Enrollment.student_id, Enrollment.course_id).in_(values),
+                Enrollment.status != "dropped"
+            )
+        )
+    enrolled = {}
+    for values in chunked(course_ids):
+        enrolled.update(
+            db.query(Enrollment.course_id, func.count(Enrollment.id)).filter(
+                Enrollment.course_id.in_(values),
+                Enrollment.status == "active"
+            ).group_by(Enrollment.course_id)
+        )
+    capacity = {course_id: max_students for course_id, max_students, _ in courses.values()}
+
+    rows = []
+    for row_number, student_id, course_id, status in resolved:
+        if (student_id, course_id) in existing_pairs:
+            progress.add_error(row_number, "已选过该课程")
+            continue
+        if status == "active":
+            limit = capacity.get(course_id)
+            if limit is not None and enrolled.get(course_id, 0) >= limit:
+                progress.add_error(row_number, "课程人数已满")
+                continue
+            enrolled[course_id] = enrolled.get(course_id, 0) + 1
+        rows.append({"student_id": student_id, "course_id": course_id, "status": status})
+
+    if rows and not progress.dry_run:
+        now = datetime.utcnow()
+        db.execute(insert(Enrollment), [{**row, "enrollment_date": now} for row in rows])
+        db.commit()
+        course_catalog.seats_changed({row["course_id"] for row in rows})
+        calendar_feeds.clear()
+    else:
+        db.rollback()
+    progress.inserted_rows += len(rows)
+
+
+CHUNK_HANDLERS = {
+    KIND_STUDENTS: _import_students_chunk,
+    KIND_ENROLLMENTS: _import_enrollments_chunk,
+}
+
+
+def run_import(ctx: JobContext, progress: ImportProgress, path: str, file_format: str):
+    """逐块导入，每块提交后更新任务进度并检查取消请求"""
+    handler = CHUNK_HANDLERS[progress.kind]
+    seen = {"username": set(), "email": set(), "student_id": set(), "pairs": set()}
+    executor = password_hash_pool() if progress.kind == KIND_STUDENTS and not progress.dry_run else None
+    db = SessionLocal()
+    try:
+        progress.total_rows = count_rows(path, file_format)
+        chunk = []
+        for item in iter_records(path, file_format, progress.kind):
+            chunk.append(item)
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                handler(db, chunk, progress, seen, executor)
+                progress.processed_rows += len(chunk)
+                chunk = []
+                ctx.update(progress.fraction, f"已处理 {progress.processed_rows} 行", progress.to_dict())
+                ctx.check_cancelled()
+        if chunk:
+            handler(db, chunk, progress, seen, executor)
+            progress.processed_rows += len(chunk)
+
+        if not progress.dry_run:
+            db.add(SystemLog(
+                user_id=ctx.created_by,
+                action="批量导入学生" if progress.kind == KIND_STUDENTS else "批量导入选课",
+                resource_type=progress.kind,
+                status="success" if progress.failed_rows == 0 else "warning",
+                details=f"{progress.filename}: 导入 {progress.inserted_rows} 行，失败 {progress.failed_rows} 行"
+            ))
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _remove_upload(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def upload_available(job: Job) -> bool:
+    """导入任务的上传文件是否还在（重试前检查）"""
+    path = (json.loads(job.payload or "{}")).get("path")
+    return bool(path) and os.path.exists(path)
+
+
+def take_initial_passwords(db: Session, job_id: int) -> List[dict]:
+    """取出任务生成的初始密码并删除，同一批密码只能取到一次"""
+    rows = db.execute(
+        delete(ImportCredential).where(ImportCredential.job_id == job_id).returning(
+            ImportCredential.id, ImportCredential.username, ImportCredential.student_id, ImportCredential.password
+        )
+    ).all()
+    db.commit()
+    return [
+        {"username": row.username, "student_id": row.student_id, "password": row.password}
+        for row in sorted(rows, key=lambda row: row.id)
+    ]
+
+
+def render_initial_passwords(credentials: List[dict]) -> bytes:
+    """带 BOM 的 UTF-8 CSV，Excel 可以直接打开"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["用户名", "学号", "初始密码"])
+    for credential in credentials:
+        writer.writerow([credential["username"], credential["student_id"], credential["password"]])
+    return output.getvalue().encode("utf-8-sig")
+
+
+def _import_job(kind: str):
+    def handler(ctx: JobContext):
+        payload = ctx.payload
+        progress = ImportProgress(kind, payload["filename"], payload.get("dry_run", False), ctx.job_id)
+        try:
+            run_import(ctx, progress, payload["path"], payload["file_format"])
+        except JobCancelled:
+            _remove_upload(payload["path"])
+            raise
+        # 失败时保留上传文件，重试时重新读取
+        _remove_upload(payload["path"])
+        return progress.to_dict(include_errors=True)
+    return handler
+
+
+for _kind, _job_type in JOB_TYPES.items():
+    register_job(_job_type)(_import_job(_kind))
+
+
+def enqueue_import(db: Session, kind: str, path: str, file_format: str, filename: str, created_by: int,
+                   dry_run: bool = False) -> Job:
+    return enqueue(db, JOB_TYPES[kind], {
+        "path": path,
+        "file_format": file_format,
+        "filename": filename,
+        "dry_run": dry_run
+    }, created_by=created_by)
+
+
+@register_job("cleanup_import_uploads", max_attempts=2, enqueueable=True)
+def cleanup_import_uploads(ctx: JobContext):
+    """
+    清理上传目录：保留待执行、运行中和 retention_days 天内失败的导入任务的文件，
+    其余文件（任务已完成或取消、失败已久、没有对应任务的遗留文件）删除
+    """
+    days = int(ctx.payload.get("retention_days", UPLOAD_RETENTION_DAYS))
+    if not os.path.isdir(IMPORT_UPLOAD_DIR):
+        return {"deleted_files": 0, "retention_days": days}
+
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    db = SessionLocal()
+    try:
+        jobs = db.query(Job.payload, Job.status, Job.finished_at).filter(
+            Job.job_type.in_(list(JOB_TYPES.values()))
+        ).all()
+    finally:
+        db.close()
+    referenced, keep = set(), set()
+    for payload, job_status, finished_at in jobs:
+        path = json.loads(payload or "{}").get("path")
+        if not path:
+            continue
+        path = os.path.abspath(path)
+        referenced.add(path)
+        if job_status in (STATUS_PENDING, STATUS_RUNNING) or (
+            job_status == STATUS_FAILED and (finished_at is None or finished_at >= cutoff)
+        ):
+            keep.add(path)
+
+    deleted = 0
+    for name in os.listdir(IMPORT_UPLOAD_DIR):
+        path = os.path.abspath(os.path.join(IMPORT_UPLOAD_DIR, name))
+        if path in keep or not os.path.isfile(path):
+            continue
+        if path not in referenced and time.time() - os.path.getmtime(path) < ORPHAN_UPLOAD_GRACE_SECONDS:
+            continue
+        _remove_upload(path)
+        deleted += 1
+    return {"deleted_files": deleted, "retention_days": days}
@@ -0,0 +1,385 @@
+"""
+后台任务执行器
+
+任务保存在 jobs 表中，不依赖外部消息队列。启动时开启 JOB_WORKERS 个工作线程，
+轮询待执行任务并用条件 UPDATE 抢占（同一任务只会被一个线程取到），
+本进程内入队时会立即唤醒工作线程。
+
+任务处理函数通过 register_job 登记，接收 JobContext：
+  - ctx.payload            入队时的参数
+  - ctx.update(...)        更新进度（写库有节流）
+  - ctx.check_cancelled()  检查取消请求，已取消时抛出 JobCancelled
+处理函数的返回值作为任务结果保存。抛出异常时，若还有重试次数则按指数退避重新排队。
+运行中的任务以 updated_at 作为心跳，由执行线程旁的心跳线程每 HEARTBEAT_INTERVAL_SECONDS 写一次，
+与处理函数是否更新进度无关；超过 JOB_STALE_SECONDS 没有心跳的任务（进程崩溃或重启遗留）
+会重新排队或标记失败。进度、心跳和结束状态都只写入仍由本线程持有（worker_id 一致且运行中）的任务，
+任务被恢复或重新排队后，原线程不会覆盖新的状态；处理函数在下一个检查点按取消退出。
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Job
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = 1.0
+# 进度写库的最小间隔（秒）
+PROGRESS_WRITE_INTERVAL = 0.5
+RETRY_BACKOFF_SECONDS = 5
+JOB_STALE_SECONDS = 300
+HEARTBEAT_INTERVAL_SECONDS = 30
+RECOVER_INTERVAL_SECONDS = 60
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobDefinition:
+    def __init__(self, job_type: str, handler: Callable, max_attempts: int, enqueueable: bool):
+        self.job_type = job_type
+        self.handler = handler
+        self.max_attempts = max_attempts
+        self.enqueueable = enqueueable
+
+
+JOB_HANDLERS: Dict[str, JobDefinition] = {}
+
+
+def register_job(job_type: str, max_attempts: int = 1, enqueueable: bool = False):
+    """
+    登记任务处理函数。enqueueable 为 True 的任务可以由管理员通过 POST /admin/jobs 直接创建，
+    参数来自内部代码的任务（如导入任务的临时文件路径）不应开放。
+    """
+    def decorator(handler):
+        JOB_HANDLERS[job_type] = JobDefinition(job_type, handler, max_attempts, enqueueable)
+        return handler
+    return decorator
+
+
+def _dumps(value) -> Optional[str]:
+    return json.dumps(value, ensure_ascii=False, default=str) if value is not None else None
+
+
+def _loads(value: Optional[str]):
+    return json.loads(value) if value else None
+
+
+def serialize_job(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "job_type": job.job_type,
+        "status": job.status,
+        "progress": round(job.progress or 0.0, 4),
+        "progress_message": job.progress_message,
+        "payload": _loads(job.payload),
+        "result": _loads(job.result),
+        "error": job.error,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "cancel_requested": job.cancel_requested,
+        "created_by": job.created_by,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def enqueue(db: Session, job_type: str, payload: Optional[dict] = None, created_by: Optional[int] = None,
+            max_attempts: Optional[int] = None) -> Job:
+    """创建任务并提交，随后唤醒工作线程"""
+    definition = JOB_HANDLERS.get(job_type)
+    if definition is None:
+        raise ValueError(f"Unknown job type: {job_type}")
+    job = Job(
+        job_type=job_type,
+        status=STATUS_PENDING,
+        payload=_dumps(payload or {}),
+        max_attempts=max_attempts or definition.max_attempts,
+        created_by=created_by,
+        run_after=datetime.utcnow()
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    job_runner.notify()
+    return job
+
+
+def request_cancel(db: Session, job_id: int) -> Optional[Job]:
+    """待执行的任务直接取消，运行中的任务设置取消标记，由处理函数在检查点退出"""
+    db.query(Job).filter(Job.id == job_id, Job.status == STATUS_PENDING).update(
+        {Job.status: STATUS_CANCELLED, Job.finished_at: datetime.utcnow()}, synchronize_session=False
+    )
+    db.query(Job).filter(Job.id == job_id, Job.status == STATUS_RUNNING).update(
+        {Job.cancel_requested: True}, synchronize_session=False
+    )
+    db.commit()
+    return db.query(Job).filter(Job.id == job_id).first()
+
+
+def retry_job(db: Session, job_id: int) -> Optional[Job]:
+    """失败或已取消的任务重新排队，重试次数清零；任务处于其他状态时抛出 ValueError"""
+    updated = db.query(Job).filter(
+        Job.id == job_id, Job.status.in_([STATUS_FAILED, STATUS_CANCELLED])
+    ).update({
+        Job.status: STATUS_PENDING,
+        Job.attempts: 0,
+        Job.cancel_requested: False,
+        Job.error: None,
+        Job.progress: 0.0,
+        Job.progress_message: None,
+        Job.run_after: datetime.utcnow(),
+        Job.finished_at: None
+    }, synchronize_session=False)
+    db.commit()
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if job is not None and not updated:
+        raise ValueError(f"Only failed or cancelled jobs can be retried (job is {job.status})")
+    job_runner.notify()
+    return job
+
+
+def _owned(query, job_id: int, worker_id: str):
+    """只匹配仍由 worker_id 执行中的任务"""
+    return query.filter(Job.id == job_id, Job.worker_id == worker_id, Job.status == STATUS_RUNNING)
+
+
+class JobContext:
+    def __init__(self, job_id: int, worker_id: str, payload: dict, created_by: Optional[int]):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.payload = payload
+        self.created_by = created_by
+        self._last_write = 0.0
+        self._cancelled = False
+        # 任务已被恢复、重新排队或结束，不再由本线程持有
+        self.lost = False
+
+    def _refresh_cancelled(self, db: Session):
+        row = db.query(Job.cancel_requested, Job.worker_id, Job.status).filter(Job.id == self.job_id).first()
+        if row is None or row.worker_id != self.worker_id or row.status != STATUS_RUNNING:
+            self.lost = True
+        self._cancelled = self.lost or bool(row.cancel_requested)
+
+    def update(self, progress: Optional[float] = None, message: Optional[str] = None,
+               details: Optional[dict] = None, force: bool = False):
+        """写入进度（0~1）、进度说明和运行中的详情；同时读取取消标记"""
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        self._last_write = now
+        values = {}
+        if progress is not None:
+            values[Job.progress] = max(0.0, min(1.0, progress))
+        if message is not None:
+            values[Job.progress_message] = message[:255]
+        if details is not None:
+            values[Job.result] = _dumps(details)
+        db = SessionLocal()
+        try:
+            if values:
+                _owned(db.query(Job), self.job_id, self.worker_id).update(values, synchronize_session=False)
+                db.commit()
+            self._refresh_cancelled(db)
+        finally:
+            db.close()
+
+    def check_cancelled(self):
+        if not self._cancelled:
+            db = SessionLocal()
+            try:
+                self._refresh_cancelled(db)
+            finally:
+                db.close()
+        if self._cancelled:
+            raise JobCancelled()
+
+
+class JobRunner:
+    def __init__(self, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_SECONDS):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._instance = uuid.uuid4().hex[:8]
+
+    def notify(self):
+        self._wakeup.set()
+
+    def recover(self):
+        """长时间没有心跳的运行中任务：还有重试次数的重新排队，否则标记失败"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            stale = db.query(Job).filter(
+                Job.status == STATUS_RUNNING,
+                Job.updated_at < now - timedelta(seconds=JOB_STALE_SECONDS)
+            )
+            stale.filter(Job.attempts < Job.max_attempts, Job.cancel_requested == False).update(
+                {Job.status: STATUS_PENDING, Job.worker_id: None, Job.run_after: now}, synchronize_session=False
+            )
+            stale.update(
+                {Job.status: STATUS_FAILED, Job.error: "任务中断（工作进程退出或长时间无进度）", Job.finished_at: now},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def claim(self, worker_id: str) -> Optional[Job]:
+        """取一个到期的待执行任务，条件 UPDATE 保证只有一个线程能取到"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            candidates = db.query(Job.id).filter(
+                Job.status == STATUS_PENDING, Job.run_after <= now
+            ).order_by(Job.id).limit(self.workers + 1).all()
+            for (job_id,) in candidates:
+                claimed = db.query(Job).filter(Job.id == job_id, Job.status == STATUS_PENDING).update({
+                    Job.status: STATUS_RUNNING,
+                    Job.worker_id: worker_id,
+                    Job.attempts: Job.attempts + 1,
+                    Job.started_at: now,
+                    Job.error: None
+                }, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    job = db.query(Job).filter(Job.id == job_id).first()
+                    db.expunge(job)
+                    return job
+            return None
+        finally:
+            db.close()
+
+    def _finish(self, job: Job, **values):
+        """写入结束状态；任务已不由本线程持有（被恢复或重新排队）时不覆盖"""
+        db = SessionLocal()
+        try:
+            updated = _owned(db.query(Job), job.id, job.worker_id).update(
+                {getattr(Job, key): value for key, value in values.items()}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+        if not updated:
+            print(f"任务 {job.id} ({job.job_type}) 已不由 {job.worker_id} 执行，忽略本次结果")
+
+    def _heartbeat(self, job: Job, done: threading.Event):
+        """任务执行期间定期刷新 updated_at，长时间的单条查询或批次不会被误判为中断"""
+        while not done.wait(HEARTBEAT_INTERVAL_SECONDS):
+            db = SessionLocal()
+            try:
+                updated = _owned(db.query(Job), job.id, job.worker_id).update(
+                    {Job.updated_at: datetime.utcnow()}, synchronize_session=False
+                )
+                db.commit()
+            except Exception as e:
+                print(f"任务 {job.id} 心跳写入失败: {e}")
+                continue
+            finally:
+                db.close()
+            if not updated:
+                return
+
+    def execute(self, job: Job):
+        definition = JOB_HANDLERS.get(job.job_type)
+        now = datetime.utcnow
+        if definition is None:
+            self._finish(job, status=STATUS_FAILED, error=f"未知任务类型 {job.job_type}", finished_at=now())
+            return
+
+        ctx = JobContext(job.id, job.worker_id, _loads(job.payload) or {}, job.created_by)
+        done = threading.Event()
+        threading.Thread(
+            target=self._heartbeat, args=(job, done), name=f"job-heartbeat-{job.id}", daemon=True
+        ).start()
+        try:
+            self._run(job, definition, ctx)
+        finally:
+            done.set()
+
+    def _run(self, job: Job, definition: JobDefinition, ctx: JobContext):
+        now = datetime.utcnow
+        try:
+            ctx.check_cancelled()
+            result = definition.handler(ctx)
+        except JobCancelled:
+            self._finish(job, status=STATUS_CANCELLED, finished_at=now())
+        except Exception as e:
+            print(f"任务 {job.id} ({job.job_type}) 第 {job.attempts} 次执行失败: {e}")
+            if job.attempts < job.max_attempts:
+                delay = RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1)
+                self._finish(
+                    job, status=STATUS_PENDING, error=str(e), worker_id=None,
+                    run_after=now() + timedelta(seconds=delay)
+                )
+            else:
+                self._finish(job, status=STATUS_FAILED, error=str(e), finished_at=now())
+        else:
+            values = {"status": STATUS_COMPLETED, "progress": 1.0, "finished_at": now()}
+            if result is not None:
+                values["result"] = _dumps(result)
+            self._finish(job, **values)
+
+    def _work(self, worker_id: str, recover: bool):
+        last_recover = time.monotonic()
+        while not self._stopping.is_set():
+            if recover and time.monotonic() - last_recover >= RECOVER_INTERVAL_SECONDS:
+                last_recover = time.monotonic()
+                try:
+                    self.recover()
+                except Exception as e:
+                    print(f"恢复后台任务失败: {e}")
+            try:
+                job = self.claim(worker_id)
+            except Exception as e:
+                print(f"获取后台任务失败: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self.execute(job)
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping.clear()
+        try:
+            self.recover()
+        except Exception as e:
+            print(f"恢复后台任务失败: {e}")
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, args=(f"{self._instance}-{i}", i == 0), name=f"job-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        """通知线程退出；正在执行的任务会运行到结束或超时（守护线程随进程退出）"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+job_runner = JobRunner()
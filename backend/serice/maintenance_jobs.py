@@ -0,0 +1,63 @@
+"""
+管理员可直接创建的维护任务（POST /admin/jobs）
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from database import SessionLocal
+from models import UserSession, SystemLog
+from serice.job_service import JobContext, register_job
+from serice.stats_service import dashboard_stats
+
+SESSION_RETENTION_DAYS = 30
+LOG_RETENTION_DAYS = 180
+DELETE_BATCH_SIZE = 5000
+
+
+def _delete_in_batches(ctx: JobContext, model, condition, label: str) -> int:
+    """分批删除，每批单独提交，避免长时间占用写锁"""
+    deleted = 0
+    db = SessionLocal()
+    try:
+        while True:
+            ids = [row_id for (row_id,) in db.query(model.id).filter(condition).limit(DELETE_BATCH_SIZE)]
+            if not ids:
+                break
+            db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            deleted += len(ids)
+            ctx.update(message=f"{label}: 已删除 {deleted} 条")
+            ctx.check_cancelled()
+    finally:
+        db.close()
+    return deleted
+
+
+@register_job("cleanup_sessions", max_attempts=3, enqueueable=True)
+def cleanup_sessions(ctx: JobContext):
+    """删除过期或撤销超过保留期的登录会话"""
+    days = int(ctx.payload.get("retention_days", SESSION_RETENTION_DAYS))
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = _delete_in_batches(ctx, UserSession, or_(
+        UserSession.expires_at < cutoff,
+        UserSession.revoked_at < cutoff
+    ), "登录会话")
+    return {"deleted_sessions": deleted, "retention_days": days}
+
+
+@register_job("archive_system_logs", max_attempts=3, enqueueable=True)
+def archive_system_logs(ctx: JobContext):
+    """删除超过保留期的系统日志"""
+    days = int(ctx.payload.get("retention_days", LOG_RETENTION_DAYS))
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = _delete_in_batches(ctx, SystemLog, SystemLog.created_at < cutoff, "系统日志")
+    return {"deleted_logs": deleted, "retention_days": days}
+
+
+@register_job("refresh_dashboard_stats", max_attempts=2, enqueueable=True)
+def refresh_dashboard_stats(ctx: JobContext):
+    """立即重新计算管理员仪表板统计快照"""
+    snapshot = dashboard_stats.refresh()
+    return {"computed_at": snapshot["computed_at"]}
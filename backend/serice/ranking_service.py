@@ -0,0 +1,313 @@
+"""
+学生排名
+
+按学分加权 GPA 计算学生在全校、班级（Student.class_name）和专业中的名次与百分位，
+以及每门课程按总评成绩的名次，显示在学生仪表板上。
+
+  - 专业没有单独的字段，取班级名称中年级之前的部分（“计算机科学2023-1班” -> “计算机科学”）
+  - 每个学生的汇总（加权 GPA、学分、班级、专业）保存在内存中，每个分组一个有序的 GPA 列表，
+    名次和百分位在有序列表上二分得到
+  - 全量重建按学生 ID 分批读取，每批是一条很短的只读查询，批与批之间不持有锁，
+    重建期间提交成绩不会被阻塞；重建期间有变化的学生在替换结果后重新计算
+  - 提交成绩后只重新计算这个学生的汇总并调整所在分组的有序列表，课程名次按课程失效；
+    课程学分变化等影响面较大的修改标记过期，下次读取时在后台重建
+"""
+
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from database import SessionLocal
+from models import Course, Grade, Student
+from query_utils import chunked
+from serice.grade_analytics_service import ANALYZED_STATUSES
+from serice.job_service import JobContext, register_job
+
+# 与成绩分析一致，只统计已提交和已审核的成绩
+RANKED_STATUSES = ANALYZED_STATUSES
+REBUILD_BATCH_SIZE = 2000
+RANKINGS_MAX_AGE_SECONDS = 3600
+COURSE_RANKS_TTL_SECONDS = 1800
+COURSE_RANKS_CACHE_SIZE = 20000
+
+MAJOR_PATTERN = re.compile(r"^(\D+?)\d{4}")
+
+StudentSummary = namedtuple("StudentSummary", ["gpa", "credits", "class_name", "major"])
+
+
+def major_of(class_name: Optional[str]) -> Optional[str]:
+    match = MAJOR_PATTERN.match(class_name or "")
+    return match.group(1) if match else None
+
+
+def _summary_query(*criteria):
+    """每个学生计入排名的成绩的学分加权 GPA 和总学分"""
+    return select(
+        Grade.student_id,
+        func.sum(Grade.gpa * Course.credits),
+        func.sum(Course.credits)
+    ).join(Course, Grade.course_id == Course.id).where(
+        Grade.status.in_(RANKED_STATUSES),
+        Grade.gpa.isnot(None),
+        Course.credits > 0,
+        *criteria
+    ).group_by(Grade.student_id)
+
+
+def _summary(weighted: float, credits: int, class_name: Optional[str]) -> StudentSummary:
+    return StudentSummary(round(weighted / credits, 4), credits, class_name, major_of(class_name))
+
+
+def load_summaries(db: Session, after_id: int = 0, limit: int = REBUILD_BATCH_SIZE) -> Tuple[Dict[int, StudentSummary], Optional[int]]:
+    """ID 大于 after_id 的一批学生的汇总，返回 (汇总, 本批最大学生 ID)；没有更多学生时 ID 为 None"""
+    students = db.execute(
+        select(Student.id, Student.class_name).where(Student.id > after_id).order_by(Student.id).limit(limit)
+    ).all()
+    if not students:
+        return {}, None
+    class_names = dict(students)
+    first_id, last_id = students[0][0], students[-1][0]
+    summaries = {
+        student_id: _summary(weighted, credits, class_names[student_id])
+        for student_id, weighted, credits in db.execute(
+            _summary_query(Grade.student_id >= first_id, Grade.student_id <= last_id)
+        )
+        if student_id in class_names and credits
+    }
+    return summaries, last_id
+
+
+def _group_keys(summary: StudentSummary) -> List[Tuple[str, Optional[str]]]:
+    keys = [("overall", None)]
+    if summary.class_name:
+        keys.append(("class", summary.class_name))
+    if summary.major:
+        keys.append(("major", summary.major))
+    return keys
+
+
+def _position(ordered: List[float], value: float) -> dict:
+    """value 在升序列表中的名次（并列取最好名次）和百分位（同组中低于它的比例）"""
+    total = len(ordered)
+    below = bisect_left(ordered, value)
+    return {
+        "rank": total - bisect_right(ordered, value) + 1,
+        "total": total,
+        "percentile": round(below / (total - 1) * 100, 1) if total > 1 else 100.0
+    }
+
+
+class RankingService:
+    def __init__(self, max_age: float = RANKINGS_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._summaries: Optional[Dict[int, StudentSummary]] = None
+        self._groups: Dict[Tuple[str, Optional[str]], List[float]] = {}
+        self._built_at = 0.0
+        self._stale = False
+        self._building = False
+        # 重建期间有变化的学生，替换结果后重新计算
+        self._changed: Set[int] = set()
+        self._course_ranks = TTLCache(maxsize=COURSE_RANKS_CACHE_SIZE, ttl=COURSE_RANKS_TTL_SECONDS, name="course_ranks")
+
+    def _add(self, student_id: int, summary: StudentSummary):
+        self._summaries[student_id] = summary
+        for key in _group_keys(summary):
+            insort(self._groups.setdefault(key, []), summary.gpa)
+
+    def _remove(self, student_id: int):
+        summary = self._summaries.pop(student_id, None)
+        if summary is None:
+            return
+        for key in _group_keys(summary):
+            ordered = self._groups[key]
+            del ordered[bisect_left(ordered, summary.gpa)]
+            if not ordered:
+                del self._groups[key]
+
+    def rebuild(self):
+        """全量重建：分批读取，全部读完后一次替换"""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._stale = False
+            self._changed.clear()
+        try:
+            summaries, after_id = {}, 0
+            db = SessionLocal()
+            try:
+                while after_id is not None:
+                    batch, after_id = load_summaries(db, after_id)
+                    summaries.update(batch)
+                    # 结束读事务，释放共享锁
+                    db.rollback()
+            finally:
+                db.close()
+
+            groups: Dict[Tuple[str, Optional[str]], List[float]] = {}
+            for summary in summaries.values():
+                for key in _group_keys(summary):
+                    groups.setdefault(key, []).append(summary.gpa)
+            for ordered in groups.values():
+                ordered.sort()
+
+            with self._lock:
+                self._summaries, self._groups = summaries, groups
+                self._built_at = time.monotonic()
+                changed = list(self._changed)
+                self._changed.clear()
+        finally:
+            with self._lock:
+                self._building = False
+
+        if changed:
+            db = SessionLocal()
+            try:
+                self.update_students(db, changed)
+            finally:
+                db.close()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"重建学生排名失败: {e}")
+            with self._lock:
+                self._stale = True
+
+    def ensure_built(self):
+        """尚未建立时同步重建一次；已过期时在后台线程重建，期间继续使用旧结果"""
+        if self._summaries is None:
+            self.rebuild()
+            return
+        with self._lock:
+            expired = self._stale or time.monotonic() - self._built_at >= self.max_age
+            if not expired or self._building:
+                return
+            # 避免重建线程启动前的其他请求重复启动；重建失败时重新标记过期
+            self._stale = False
+            self._built_at = time.monotonic()
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    @property
+    def ranked_students(self) -> int:
+        return len(self._summaries or {})
+
+    def mark_stale(self):
+        self._stale = True
+
+    def update_students(self, db: Session, student_ids: Iterable[int]):
+        """重新计算这些学生的汇总并调整分组；尚未建立时不做处理，重建期间记下等重建完成后再算"""
+        student_ids = list(set(student_ids))
+        with self._lock:
+            if self._building:
+                self._changed.update(student_ids)
+                return
+            if self._summaries is None:
+                return
+
+        summaries = {}
+        for values in chunked(student_ids):
+            class_names = dict(db.execute(select(Student.id, Student.class_name).where(Student.id.in_(values))).all())
+            for student_id, weighted, credits in db.execute(_summary_query(Grade.student_id.in_(values))):
+                if credits:
+                    summaries[student_id] = _summary(weighted, credits, class_names.get(student_id))
+
+        with self._lock:
+            if self._building:
+                self._changed.update(student_ids)
+                return
+            for student_id in student_ids:
+                self._remove(student_id)
+                if student_id in summaries:
+                    self._add(student_id, summaries[student_id])
+
+    def grade_changed(self, db: Session, student_id: int, course_id: int):
+        """提交成绩后调用"""
+        self.invalidate_courses([course_id])
+        self.update_students(db, [student_id])
+
+    def invalidate_courses(self, course_ids: Iterable[int]):
+        for course_id in course_ids:
+            self._course_ranks.delete(course_id)
+
+    def _course_scores(self, db: Session, course_ids: Iterable[int]) -> Dict[int, Dict[Optional[str], List[float]]]:
+        """课程各学期的总评成绩升序列表，按课程缓存，未命中的课程一次查询补齐"""
+        result, missing = {}, []
+        for course_id in set(course_ids):
+            scores = self._course_ranks.get(course_id)
+            if scores is None:
+                missing.append(course_id)
+            else:
+                result[course_id] = scores
+
+        for values in chunked(missing):
+            loaded = {course_id: {} for course_id in values}
+            rows = db.execute(
+                select(Grade.course_id, Grade.semester, Grade.total_score).where(
+                    Grade.course_id.in_(values),
+                    Grade.status.in_(RANKED_STATUSES),
+                    Grade.total_score.isnot(None)
+                )
+            )
+            for course_id, semester, score in rows:
+                loaded[course_id].setdefault(semester, []).append(score)
+            for course_id, semesters in loaded.items():
+                for ordered in semesters.values():
+                    ordered.sort()
+                self._course_ranks.set(course_id, semesters)
+                result[course_id] = semesters
+        return result
+
+    def student_ranks(self, db: Session, student_id: int, grades: Iterable[Grade]) -> dict:
+        """学生的加权 GPA 名次（全校、班级、专业）和 grades 中各门课程的名次"""
+        self.ensure_built()
+        with self._lock:
+            # 另一个线程正在首次重建时还没有结果
+            summary = self._summaries.get(student_id) if self._summaries is not None else None
+            groups = {}
+            if summary is not None:
+                groups = {
+                    scope: {"name": name, **_position(self._groups[(scope, name)], summary.gpa)}
+                    for scope, name in _group_keys(summary)
+                }
+
+        ranked_grades = [
+            grade for grade in grades
+            if grade.status in RANKED_STATUSES and grade.total_score is not None
+        ]
+        scores = self._course_scores(db, [grade.course_id for grade in ranked_grades])
+        courses = []
+        for grade in ranked_grades:
+            ordered = scores.get(grade.course_id, {}).get(grade.semester)
+            if not ordered:
+                continue
+            courses.append({"course_id": grade.course_id, "semester": grade.semester,
+                            **_position(ordered, grade.total_score)})
+
+        return {
+            "weighted_gpa": summary.gpa if summary else None,
+            "credits": summary.credits if summary else 0,
+            "overall": groups.get("overall"),
+            "class": groups.get("class"),
+            "major": groups.get("major"),
+            "courses": courses
+        }
+
+
+rankings = RankingService()
+
+
+@register_job("rebuild_rankings", max_attempts=2, enqueueable=True)
+def rebuild_rankings(ctx: JobContext):
+    """立即全量重建学生排名（例如批量修改成绩或课程学分之后）"""
+    rankings.rebuild()
+    return {"ranked_students": rankings.ranked_students}
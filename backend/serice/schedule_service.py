@@ -0,0 +1,353 @@
+"""
+课程上课时间与冲突检测
+
+Course.schedule 是自由文本（如 "周一、三 8:00-9:30"、"周二 10:00-11:30 B203 单周"），
+解析后保存为 CourseMeeting：每条记录是某一天的一个时间段，带教室和单双周。
+原文本保留用于展示，修改课程时间或教室时同步重建 CourseMeeting。
+
+冲突检测使用内存中的时间段索引（IntervalIndex），同一分组（教室、教师）同一天的时间段
+按开始时间排序，查询时二分定位，只检查可能重叠的少数记录。
+全部有效课程的时间段由 timetable 缓存，课程修改、启停后失效；
+学生选课时用已选课程的时间段现场建索引，只涉及几十个时间段，单次检查远低于 1 毫秒。
+"""
+
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Course, CourseMeeting, Room
+
+TIMETABLE_MAX_AGE_SECONDS = 300
+
+WEEK_ALL = "all"
+WEEK_ODD = "odd"
+WEEK_EVEN = "even"
+# 单双周用位掩码表示，两个时间段的掩码有交集才可能冲突
+WEEK_MASKS = {WEEK_ALL: 3, WEEK_ODD: 1, WEEK_EVEN: 2}
+
+WEEKDAY_NUMBERS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "日": 7, "天": 7}
+ENGLISH_WEEKDAYS = {
+    "mon": 1, "tue": 2, "tues": 2, "wed": 3, "thu": 4, "thur": 4, "thurs": 4, "fri": 5, "sat": 6, "sun": 7,
+    "monday": 1, "tuesday": 2, "wednesday": 3, "thursday": 4, "friday": 5, "saturday": 6, "sunday": 7,
+}
+
+_SEGMENT_SPLIT = re.compile(r"[;；\n]+")
+_CHINESE_DAYS = re.compile(r"(?:周|星期)([一二三四五六日天](?:[、,，/和及]?[一二三四五六日天])*)")
+_ENGLISH_DAYS = re.compile(r"\b(" + "|".join(sorted(ENGLISH_WEEKDAYS, key=len, reverse=True)) + r")\b", re.IGNORECASE)
+_TIME_RANGE = re.compile(r"(\d{1,2})[:：](\d{2})\s*[-~～—至到]+\s*(\d{1,2})[:：](\d{2})")
+_ODD_WEEKS = re.compile(r"单周|\(单\)|（单）|odd", re.IGNORECASE)
+_EVEN_WEEKS = re.compile(r"双周|\(双\)|（双）|even", re.IGNORECASE)
+_ROOM = re.compile(r"[A-Za-z]{1,3}-?\d{2,4}[A-Za-z]?|[一-龥]+楼\s*\d+|\d{3,4}(?:教室|室)")
+
+
+class MeetingSlot(NamedTuple):
+    course_id: int
+    day: int  # 1-7，周一为 1
+    start: int  # 当天第几分钟
+    end: int
+    room: Optional[str]
+    week_pattern: str
+
+    def overlaps(self, other: "MeetingSlot") -> bool:
+        return (
+            self.day == other.day
+            and self.start < other.end
+            and other.start < self.end
+            and bool(WEEK_MASKS[self.week_pattern] & WEEK_MASKS[other.week_pattern])
+        )
+
+
+def format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_schedule(schedule: Optional[str], default_room: Optional[str] = None) -> List[dict]:
+    """
+    把上课时间文本解析为时间段列表 [{day_of_week, start_minute, end_minute, room, week_pattern}]。
+    用 ; 或换行分隔多段，每段包含星期（中文或英文）和一个时间范围，可选教室和单双周；
+    段内未写教室时使用 default_room。无法解析的段被忽略。
+    """
+    meetings = []
+    for segment in _SEGMENT_SPLIT.split(schedule or ""):
+        time_match = _TIME_RANGE.search(segment)
+        if not time_match:
+            continue
+        start_hour, start_minute, end_hour, end_minute = (int(value) for value in time_match.groups())
+        start = start_hour * 60 + start_minute
+        end = end_hour * 60 + end_minute
+        if not (0 <= start < end <= 24 * 60):
+            continue
+
+        days = set()
+        for group in _CHINESE_DAYS.findall(segment):
+            days.update(WEEKDAY_NUMBERS[char] for char in group if char in WEEKDAY_NUMBERS)
+        days.update(ENGLISH_WEEKDAYS[name.lower()] for name in _ENGLISH_DAYS.findall(segment))
+        if not days:
+            continue
+
+        if _ODD_WEEKS.search(segment):
+            week_pattern = WEEK_ODD
+        elif _EVEN_WEEKS.search(segment):
+            week_pattern = WEEK_EVEN
+        else:
+            week_pattern = WEEK_ALL
+
+        rest = segment[time_match.end():]
+        room_match = _ROOM.search(rest)
+        room = room_match.group(0).strip() if room_match else default_room
+
+        for day in sorted(days):
+            meetings.append({
+                "day_of_week": day,
+                "start_minute": start,
+                "end_minute": end,
+                "room": room,
+                "week_pattern": week_pattern
+            })
+    return meetings
+
+
+WEEKDAY_NAMES = {number: char for char, number in WEEKDAY_NUMBERS.items() if char != "天"}
+WEEK_PATTERN_LABELS = {WEEK_ODD: "单周", WEEK_EVEN: "双周"}
+
+
+def format_schedule(meetings: List[dict], classroom: Optional[str] = None) -> str:
+    """
+    parse_schedule 的逆操作：时间、教室、单双周相同的时间段合并为一段，如 "周一、三 8:00-9:30"。
+    教室与 classroom 相同时省略，不同时写在段内。
+    """
+    groups: Dict[tuple, List[int]] = {}
+    for meeting in sorted(meetings, key=lambda m: (m["day_of_week"], m["start_minute"])):
+        key = (meeting["start_minute"], meeting["end_minute"], meeting.get("room"), meeting.get("week_pattern") or WEEK_ALL)
+        groups.setdefault(key, []).append(meeting["day_of_week"])
+
+    segments = []
+    for (start, end, room, week_pattern), days in groups.items():
+        segment = f"周{'、'.join(WEEKDAY_NAMES[day] for day in days)} {start // 60}:{start % 60:02d}-{end // 60}:{end % 60:02d}"
+        if room and room != classroom:
+            segment += f" {room}"
+        if week_pattern in WEEK_PATTERN_LABELS:
+            segment += f" {WEEK_PATTERN_LABELS[week_pattern]}"
+        segments.append(segment)
+    return "；".join(segments)
+
+
+def replace_course_meetings(db: Session, course_id: int, schedule: Optional[str], classroom: Optional[str]) -> int:
+    """按课程的上课时间文本和教室重建时间段（不提交），返回时间段数"""
+    db.query(CourseMeeting).filter(CourseMeeting.course_id == course_id).delete(synchronize_session=False)
+    meetings = parse_schedule(schedule, classroom)
+    db.add_all(CourseMeeting(course_id=course_id, **meeting) for meeting in meetings)
+    return len(meetings)
+
+
+def backfill_course_meetings(db: Session) -> Tuple[int, List[int]]:
+    """
+    为有上课时间文本但还没有时间段的课程解析并写入 CourseMeeting（不提交），
+    返回 (写入的课程数, 无法解析的课程ID)
+    """
+    has_meetings = db.query(CourseMeeting.course_id)
+    rows = db.query(Course.id, Course.schedule, Course.classroom).filter(
+        Course.schedule.isnot(None),
+        Course.schedule != "",
+        ~Course.id.in_(has_meetings)
+    ).all()
+
+    parsed, unparsed = 0, []
+    meeting_rows = []
+    for course_id, schedule, classroom in rows:
+        meetings = parse_schedule(schedule, classroom)
+        if not meetings:
+            unparsed.append(course_id)
+            continue
+        parsed += 1
+        meeting_rows.extend({"course_id": course_id, **meeting} for meeting in meetings)
+    if meeting_rows:
+        db.bulk_insert_mappings(CourseMeeting, meeting_rows)
+    return parsed, unparsed
+
+
+def backfill_rooms(db: Session) -> int:
+    """
+    教室表为空时，按课程现有的教室名称创建教室（不提交），
+    容量取使用该教室的课程中最大的人数上限，保证现有安排满足容量约束
+    """
+    if db.query(Room.id).first() is not None:
+        return 0
+    capacities: Dict[str, int] = {}
+    for name, capacity in db.query(Course.classroom, func.max(Course.max_students)).filter(
+        Course.classroom.isnot(None), Course.classroom != ""
+    ).group_by(Course.classroom):
+        capacities[name] = capacity or 0
+    for name, capacity in db.query(CourseMeeting.room, func.max(Course.max_students)).join(
+        Course, CourseMeeting.course_id == Course.id
+    ).filter(CourseMeeting.room.isnot(None)).group_by(CourseMeeting.room):
+        capacities[name] = max(capacities.get(name, 0), capacity or 0)
+    db.bulk_insert_mappings(Room, [
+        {"name": name, "building": re.match(r"[A-Za-z]*", name).group(0) or None, "capacity": capacity, "is_active": True}
+        for name, capacity in capacities.items()
+    ])
+    return len(capacities)
+
+
+def serialize_slot(slot: MeetingSlot) -> dict:
+    return {
+        "day": slot.day,
+        "start": format_minutes(slot.start),
+        "end": format_minutes(slot.end),
+        "room": slot.room,
+        "week_pattern": slot.week_pattern
+    }
+
+
+def slot_from_meeting(meeting: CourseMeeting) -> MeetingSlot:
+    return MeetingSlot(
+        meeting.course_id, meeting.day_of_week, meeting.start_minute, meeting.end_minute,
+        meeting.room, meeting.week_pattern or WEEK_ALL
+    )
+
+
+def load_course_meetings(db: Session, course_ids: Iterable[int], week: Optional[int] = None) -> Dict[int, List[dict]]:
+    """一次查询取出多门课程的时间段，按星期、开始时间排序；指定 week（第几周）时只保留该周上课的时间段"""
+    course_ids = list(set(course_ids))
+    if not course_ids:
+        return {}
+    query = db.query(CourseMeeting).filter(CourseMeeting.course_id.in_(course_ids))
+    if week is not None:
+        query = query.filter(CourseMeeting.week_pattern.in_([WEEK_ALL, WEEK_ODD if week % 2 else WEEK_EVEN]))
+    meetings: Dict[int, List[dict]] = {}
+    for meeting in query.order_by(CourseMeeting.day_of_week, CourseMeeting.start_minute):
+        meetings.setdefault(meeting.course_id, []).append(serialize_slot(slot_from_meeting(meeting)))
+    return meetings
+
+
+class IntervalIndex:
+    """按 (分组键, 星期) 保存的有序时间段，查询与给定时间段重叠的记录"""
+
+    def __init__(self):
+        self._starts: Dict[tuple, List[int]] = {}
+        self._slots: Dict[tuple, List[MeetingSlot]] = {}
+        # 每组最长时间段，查询时开始时间早于 start - 最长时长的记录不可能重叠
+        self._longest: Dict[tuple, int] = {}
+
+    def add(self, key, slot: MeetingSlot):
+        bucket = (key, slot.day)
+        starts = self._starts.setdefault(bucket, [])
+        slots = self._slots.setdefault(bucket, [])
+        position = bisect_left(starts, slot.start)
+        starts.insert(position, slot.start)
+        slots.insert(position, slot)
+        self._longest[bucket] = max(self._longest.get(bucket, 0), slot.end - slot.start)
+
+    def overlapping(self, key, slot: MeetingSlot, exclude_course_id: Optional[int] = None) -> List[MeetingSlot]:
+        bucket = (key, slot.day)
+        starts = self._starts.get(bucket)
+        if not starts:
+            return []
+        slots = self._slots[bucket]
+        low = bisect_left(starts, slot.start - self._longest[bucket] + 1)
+        high = bisect_left(starts, slot.end)
+        return [
+            other for other in slots[low:high]
+            if other.course_id != exclude_course_id and slot.overlaps(other)
+        ]
+
+
+class Timetable:
+    """全部有效课程的时间段，以及按教室、教师分组的时间段索引"""
+
+    def __init__(self, max_age: float = TIMETABLE_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self._loaded_at = 0.0
+        self._stale = True
+        self._lock = threading.Lock()
+        self._slots: Dict[int, List[MeetingSlot]] = {}
+        self._courses: Dict[int, Tuple[str, str, Optional[int]]] = {}
+        self._rooms = IntervalIndex()
+        self._teachers = IntervalIndex()
+
+    def invalidate(self):
+        """课程时间、教室、教师或启停状态变化后调用，下次使用时重新加载"""
+        self._stale = True
+
+    def _load(self, db: Session):
+        courses = {
+            course_id: (name, code, teacher_id)
+            for course_id, name, code, teacher_id in db.query(
+                Course.id, Course.name, Course.code, Course.teacher_id
+            ).filter(Course.is_active == True)
+        }
+        slots: Dict[int, List[MeetingSlot]] = {}
+        rooms, teachers = IntervalIndex(), IntervalIndex()
+        for meeting in db.query(CourseMeeting).join(Course, CourseMeeting.course_id == Course.id).filter(
+            Course.is_active == True
+        ).order_by(CourseMeeting.course_id, CourseMeeting.day_of_week, CourseMeeting.start_minute):
+            slot = slot_from_meeting(meeting)
+            slots.setdefault(slot.course_id, []).append(slot)
+            if slot.room:
+                rooms.add(slot.room, slot)
+            teacher_id = courses[slot.course_id][2]
+            if teacher_id is not None:
+                teachers.add(teacher_id, slot)
+        self._courses, self._slots, self._rooms, self._teachers = courses, slots, rooms, teachers
+
+    def ensure_loaded(self, db: Session):
+        if not self._stale and time.monotonic() - self._loaded_at < self.max_age:
+            return
+        with self._lock:
+            if not self._stale and time.monotonic() - self._loaded_at < self.max_age:
+                return
+            self._stale = False
+            try:
+                self._load(db)
+            except Exception:
+                self._stale = True
+                raise
+            self._loaded_at = time.monotonic()
+
+    def course_slots(self, db: Session, course_id: int) -> List[MeetingSlot]:
+        self.ensure_loaded(db)
+        return self._slots.get(course_id, [])
+
+    def _describe(self, slot: MeetingSlot) -> dict:
+        name, code, _ = self._courses.get(slot.course_id, (None, None, None))
+        return {"course_id": slot.course_id, "course_name": name, "course_code": code, **serialize_slot(slot)}
+
+    def student_conflicts(self, db: Session, course_id: int, enrolled_course_ids: Iterable[int]) -> List[dict]:
+        """course_id 与学生已选课程（enrolled_course_ids）的时间冲突"""
+        self.ensure_loaded(db)
+        index = IntervalIndex()
+        for other_id in enrolled_course_ids:
+            for slot in self._slots.get(other_id, ()):
+                index.add(None, slot)
+        conflicts = []
+        for slot in self._slots.get(course_id, ()):
+            conflicts.extend(self._describe(other) for other in index.overlapping(None, slot, course_id))
+        return conflicts
+
+    def slot_conflicts(self, db: Session, slots: Iterable[MeetingSlot], teacher_id: Optional[int],
+                       exclude_course_id: Optional[int] = None) -> Dict[str, List[dict]]:
+        """给定时间段与其他课程的教室冲突和教师冲突"""
+        self.ensure_loaded(db)
+        rooms, teachers = [], []
+        for slot in slots:
+            if slot.room:
+                rooms.extend(self._describe(other) for other in self._rooms.overlapping(
+                    slot.room, slot, exclude_course_id))
+            if teacher_id is not None:
+                teachers.extend(self._describe(other) for other in self._teachers.overlapping(
+                    teacher_id, slot, exclude_course_id))
+        return {"room": rooms, "teacher": teachers}
+
+    def course_conflicts(self, db: Session, course_id: int) -> Dict[str, List[dict]]:
+        """某门课程当前时间安排与其他有效课程的教室、教师冲突"""
+        self.ensure_loaded(db)
+        _, _, teacher_id = self._courses.get(course_id, (None, None, None))
+        return self.slot_conflicts(db, self._slots.get(course_id, []), teacher_id, course_id)
+
+
+timetable = Timetable()
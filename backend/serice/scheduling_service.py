@@ -0,0 +1,659 @@
+"""
+排课求解：为全部有效课程分配上课时间段和教室
+
+硬约束：教室容量不小于课程人数上限（max_students）；同一时间段内教室、教师不重复占用；
+教师不可用的时间段不排课；同一课程的几次课不在同一天。
+软约束（代价越小越好）：
+  - 有共同学生的两门课程排在同一时间段，代价为共同学生数
+  - 与当前安排不同，每次课计 stability_weight（尽量少改动）
+  - 同一课程的两次课在相邻两天、晚上的时间段
+
+求解分两步：先保留各课程当前可行的时间段，其余课次按难度（冲突权重、人数、教师课程数）从难到易
+贪心放置，教室优先沿用原教室，否则取容量够用的最小教室；
+再做局部搜索，反复把冲突代价最高的课次移到更好的时间段，直到没有改进或达到时间上限。
+每门课程在各时间段上的冲突代价增量维护（放置或移走一次课时只更新它的相邻课程），
+挑选时间段只需扫描一遍时间段，几千门课程的规模可以在后台任务中完成。
+
+无法排满课次的课程不做修改，保留数据库中的原安排，列在结果的 unassigned 中，需要手动调整：
+有这样的课程时重新初始排课，先把它们当前的时间段、教室和教师时间固定占用（pin），
+其他课程不会排进去；重复到没有新的未排满课程为止（最多 MAX_CONSTRUCT_ROUNDS 轮）。
+
+求解结果（变更列表和统计）作为任务结果保存，管理员预览后再调用 apply_plan 写回课程；
+写回前检查涉及的课程在求解之后没有被修改过，并检查写回后的教室、教师时间不重叠。
+"""
+
+import json
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.exc import StaleDataError
+
+from database import SessionLocal
+from models import Course, CourseMeeting, Enrollment, Job, Room, SystemLog
+from query_utils import chunked
+from serice.job_service import JobContext, register_job, enqueue
+from serice.schedule_service import (
+    WEEK_ALL, IntervalIndex, MeetingSlot, format_minutes, format_schedule, parse_schedule, slot_from_meeting
+)
+
+JOB_TYPE = "schedule_solver"
+
+DEFAULT_DAYS = [1, 2, 3, 4, 5]
+DEFAULT_PERIODS = ["8:00-9:30", "10:00-11:30", "14:00-15:30", "16:00-17:30", "19:00-20:30"]
+DEFAULT_MEETINGS_PER_COURSE = 2
+DEFAULT_TIME_LIMIT_SECONDS = 60
+DEFAULT_STABILITY_WEIGHT = 1.0
+
+ADJACENT_DAY_PENALTY = 2.0
+EVENING_PENALTY = 1.0
+EVENING_START_MINUTE = 18 * 60
+# 预览中最多保存的变更数（超过时只保存统计）
+MAX_CHANGES_IN_RESULT = 20000
+# 固定未排满课程的原安排后重新初始排课的最多轮数
+MAX_CONSTRUCT_ROUNDS = 3
+
+
+class PlanConflictError(Exception):
+    """方案不能应用：已应用过、涉及的课程在求解后被修改，或写回后教室、教师时间重叠"""
+
+
+def parse_periods(periods: List[str]) -> List[Tuple[int, int]]:
+    """"8:00-9:30" -> (480, 570)，复用上课时间解析"""
+    result = []
+    for period in periods:
+        meetings = parse_schedule(f"周一 {period}")
+        if not meetings:
+            raise ValueError(f"Invalid period: {period}")
+        result.append((meetings[0]["start_minute"], meetings[0]["end_minute"]))
+    return sorted(set(result))
+
+
+class SchedulingProblem:
+    """求解输入：课程、教室、共同选课权重和时间段网格"""
+
+    def __init__(self, days: List[int], periods: List[Tuple[int, int]]):
+        self.days = days
+        self.periods = periods
+        self.slot_count = len(days) * len(periods)
+        self.courses: List[dict] = []
+        self.neighbors: List[List[Tuple[int, int]]] = []
+        self.rooms: List[Tuple[int, str]] = []
+        self.unavailable: Dict[int, Set[int]] = {}
+
+    def slot(self, day: int, start: int, end: int) -> Optional[int]:
+        """(星期, 开始, 结束) 对应的时间段编号，不在网格上时返回 None"""
+        if day not in self.days or (start, end) not in self.periods:
+            return None
+        return self.days.index(day) * len(self.periods) + self.periods.index((start, end))
+
+    def day_of(self, slot: int) -> int:
+        return self.days[slot // len(self.periods)]
+
+    def period_of(self, slot: int) -> Tuple[int, int]:
+        return self.periods[slot % len(self.periods)]
+
+
+def co_enrollment_pairs(db: Session):
+    """
+    共同选课人数 (course_a, course_b, 学生数)，course_a < course_b，只含有共同学生的课程对。
+    相当于学生-课程关联矩阵 A 的 AᵀA 的非零上三角元素：按学生自连接后分组计数，由数据库完成聚合。
+    """
+    other = aliased(Enrollment)
+    return db.query(Enrollment.course_id, other.course_id, func.count()).join(
+        other, (other.student_id == Enrollment.student_id) & (other.course_id > Enrollment.course_id)
+    ).filter(
+        Enrollment.status == "active",
+        other.status == "active"
+    ).group_by(Enrollment.course_id, other.course_id).yield_per(50000)
+
+
+def load_problem(db: Session, payload: dict, ctx: Optional[JobContext] = None) -> SchedulingProblem:
+    days = sorted(set(payload.get("days") or DEFAULT_DAYS))
+    problem = SchedulingProblem(days, parse_periods(payload.get("periods") or DEFAULT_PERIODS))
+
+    rows = db.query(
+        Course.id, Course.code, Course.name, Course.teacher_id, Course.max_students,
+        Course.schedule, Course.classroom, Course.updated_at
+    ).filter(Course.is_active == True).order_by(Course.id).all()
+    index = {row.id: i for i, row in enumerate(rows)}
+
+    meetings: Dict[int, List[MeetingSlot]] = {}
+    for meeting in db.query(CourseMeeting).join(Course, CourseMeeting.course_id == Course.id).filter(
+        Course.is_active == True
+    ):
+        meetings.setdefault(meeting.course_id, []).append(slot_from_meeting(meeting))
+
+    for row in rows:
+        current = meetings.get(row.id, [])
+        problem.courses.append({
+            "id": row.id,
+            "code": row.code,
+            "name": row.name,
+            "teacher_id": row.teacher_id,
+            "size": row.max_students or 0,
+            "schedule": row.schedule,
+            "classroom": row.classroom,
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+            "current": current,
+            "meetings": min(len(current) or DEFAULT_MEETINGS_PER_COURSE, len(days))
+        })
+
+    problem.rooms = sorted(
+        (capacity, name) for name, capacity in db.query(Room.name, Room.capacity).filter(Room.is_active == True)
+    )
+
+    for item in payload.get("teacher_unavailable") or []:
+        teacher_id, day = int(item["teacher_id"]), int(item["day"])
+        if day not in days:
+            continue
+        period = item.get("period")
+        targets = problem.periods if not period else parse_periods([period])
+        for start, end in targets:
+            slot = problem.slot(day, start, end)
+            if slot is not None:
+                problem.unavailable.setdefault(teacher_id, set()).add(slot)
+
+    if ctx:
+        ctx.update(progress=0.05, message="统计共同选课", force=True)
+    problem.neighbors = [[] for _ in rows]
+    for course_a, course_b, weight in co_enrollment_pairs(db):
+        a, b = index.get(course_a), index.get(course_b)
+        if a is not None and b is not None:
+            problem.neighbors[a].append((b, weight))
+            problem.neighbors[b].append((a, weight))
+    return problem
+
+
+class Solver:
+    def __init__(self, problem: SchedulingProblem, stability_weight: float = DEFAULT_STABILITY_WEIGHT):
+        self.problem = problem
+        self.stability_weight = stability_weight
+        n, slot_count = len(problem.courses), problem.slot_count
+        # conflict[c][s]: 已放在时间段 s 的相邻课程与课程 c 的共同学生数之和
+        self.conflict = [[0] * slot_count for _ in range(n)]
+        self.assigned: List[List[Tuple[int, str]]] = [[] for _ in range(n)]
+        self.free_rooms = [list(problem.rooms) for _ in range(slot_count)]
+        self.room_capacity = {name: capacity for capacity, name in problem.rooms}
+        self.teacher_busy: Dict[int, Set[int]] = {}
+        self.unassigned: Dict[int, str] = {}
+
+        self.current_slots: List[Set[int]] = []
+        self.current_rooms: List[Dict[int, str]] = []
+        for course in problem.courses:
+            slots, rooms = set(), {}
+            for meeting in course["current"]:
+                slot = problem.slot(meeting.day, meeting.start, meeting.end)
+                if slot is not None:
+                    slots.add(slot)
+                    rooms[slot] = meeting.room
+            self.current_slots.append(slots)
+            self.current_rooms.append(rooms)
+
+    # ---- 放置与移除 ----
+
+    def _take_named_room(self, slot: int, size: int, name: str) -> Optional[str]:
+        """取空闲且容量够用的指定教室"""
+        rooms = self.free_rooms[slot]
+        capacity = self.room_capacity.get(name)
+        if capacity is None or capacity < size:
+            return None
+        i = bisect_left(rooms, (capacity, name))
+        if i < len(rooms) and rooms[i] == (capacity, name):
+            return rooms.pop(i)[1]
+        return None
+
+    def _take_room(self, slot: int, size: int, preferred: List[str]) -> Optional[str]:
+        """按优先顺序取空闲的指定教室，都不可用时取容量够用的最小教室"""
+        rooms = self.free_rooms[slot]
+        position = bisect_left(rooms, (size, ""))
+        if position >= len(rooms):
+            return None
+        for name in preferred:
+            room = self._take_named_room(slot, size, name)
+            if room is not None:
+                return room
+        return rooms.pop(position)[1]
+
+    def _release_room(self, slot: int, room: str, capacity: int):
+        insort(self.free_rooms[slot], (capacity, room))
+
+    def place(self, c: int, slot: int, required_room: Optional[str] = None) -> bool:
+        """放置一次课；指定 required_room 时只使用该教室"""
+        course = self.problem.courses[c]
+        if required_room is not None:
+            room = self._take_named_room(slot, course["size"], required_room)
+        else:
+            # 依次尝试：该时间段原来的教室、本课程其他课次的教室、课程教室
+            preferred = [self.current_rooms[c].get(slot)] + [room for _, room in self.assigned[c]] + [course["classroom"]]
+            room = self._take_room(slot, course["size"], [name for name in preferred if name])
+        if room is None:
+            return False
+        self.assigned[c].append((slot, room))
+        if course["teacher_id"] is not None:
+            self.teacher_busy.setdefault(course["teacher_id"], set()).add(slot)
+        for neighbor, weight in self.problem.neighbors[c]:
+            self.conflict[neighbor][slot] += weight
+        return True
+
+    def remove(self, c: int, i: int):
+        slot, room = self.assigned[c].pop(i)
+        course = self.problem.courses[c]
+        self._release_room(slot, room, self.room_capacity[room])
+        if course["teacher_id"] is not None:
+            self.teacher_busy[course["teacher_id"]].discard(slot)
+        for neighbor, weight in self.problem.neighbors[c]:
+            self.conflict[neighbor][slot] -= weight
+
+    # ---- 代价 ----
+
+    def cost(self, c: int, slot: int) -> float:
+        problem = self.problem
+        cost = float(self.conflict[c][slot])
+        if slot not in self.current_slots[c]:
+            cost += self.stability_weight
+        if problem.period_of(slot)[0] >= EVENING_START_MINUTE:
+            cost += EVENING_PENALTY
+        day = problem.day_of(slot)
+        for other, _ in self.assigned[c]:
+            if abs(problem.day_of(other) - day) == 1:
+                cost += ADJACENT_DAY_PENALTY
+        return cost
+
+    def feasible(self, c: int, slot: int) -> bool:
+        course = self.problem.courses[c]
+        day = self.problem.day_of(slot)
+        if any(self.problem.day_of(other) == day for other, _ in self.assigned[c]):
+            return False
+        teacher_id = course["teacher_id"]
+        if teacher_id is not None and (
+            slot in self.teacher_busy.get(teacher_id, ()) or slot in self.problem.unavailable.get(teacher_id, ())
+        ):
+            return False
+        rooms = self.free_rooms[slot]
+        return bool(rooms) and rooms[-1][0] >= course["size"]
+
+    def best_slot(self, c: int) -> Optional[int]:
+        best, best_cost = None, None
+        for slot in range(self.problem.slot_count):
+            if self.feasible(c, slot):
+                cost = self.cost(c, slot)
+                if best_cost is None or cost < best_cost:
+                    best, best_cost = slot, cost
+        return best
+
+    # ---- 求解 ----
+
+    def pin(self, unassigned: Dict[int, str]):
+        """
+        固定保持原安排的课程：占用它当前在网格上的时间段、教室和教师时间，不检查可行性，
+        这些课程不参与排课和局部搜索。原安排中的教室已被占用（原本就重叠）时只占用时间
+        """
+        for c, reason in unassigned.items():
+            self.unassigned[c] = reason
+            course = self.problem.courses[c]
+            for slot in sorted(self.current_slots[c]):
+                room = self.current_rooms[c].get(slot)
+                if room is not None:
+                    room = self._take_named_room(slot, 0, room)
+                self.assigned[c].append((slot, room))
+                if course["teacher_id"] is not None:
+                    self.teacher_busy.setdefault(course["teacher_id"], set()).add(slot)
+                for neighbor, weight in self.problem.neighbors[c]:
+                    self.conflict[neighbor][slot] += weight
+
+    def construct(self, ctx: Optional[JobContext] = None):
+        problem = self.problem
+        teacher_load: Dict[int, int] = {}
+        for course in problem.courses:
+            if course["teacher_id"] is not None:
+                teacher_load[course["teacher_id"]] = teacher_load.get(course["teacher_id"], 0) + course["meetings"]
+        order = sorted(
+            (c for c in range(len(problem.courses)) if c not in self.unassigned),
+            key=lambda c: (
+                -sum(weight for _, weight in problem.neighbors[c]),
+                -problem.courses[c]["size"],
+                -teacher_load.get(problem.courses[c]["teacher_id"], 0)
+            )
+        )
+        # 先保留全部课程当前可行的时间段和教室，避免其他课程占用；之后由局部搜索消除冲突。
+        # 第一轮只保留时间段和教室都与当前安排相同的课次，课程未能排满、保持原安排时，
+        # 这些占用与数据库一致；第二轮保留其余当前可行的时间段，教室另选
+        for c in order:
+            course = problem.courses[c]
+            for slot in sorted(self.current_slots[c]):
+                room = self.current_rooms[c].get(slot)
+                if room and len(self.assigned[c]) < course["meetings"] and self.feasible(c, slot):
+                    self.place(c, slot, room)
+        for c in order:
+            course = problem.courses[c]
+            kept_slots = {slot for slot, _ in self.assigned[c]}
+            for slot in sorted(self.current_slots[c] - kept_slots):
+                if len(self.assigned[c]) < course["meetings"] and self.feasible(c, slot):
+                    self.place(c, slot)
+        for done, c in enumerate(order):
+            course = problem.courses[c]
+            kept = len(self.assigned[c])
+            while len(self.assigned[c]) < course["meetings"]:
+                slot = self.best_slot(c)
+                if slot is None or not self.place(c, slot):
+                    self.unassigned[c] = "没有满足教室容量和教师时间的时间段"
+                    # 只移除新放置的课次；课程保持原安排，保留的时间段和教室仍被它占用
+                    while len(self.assigned[c]) > kept:
+                        self.remove(c, len(self.assigned[c]) - 1)
+                    break
+            if ctx and done % 200 == 0:
+                ctx.update(progress=0.1 + 0.4 * done / max(len(order), 1), message=f"初始排课 {done}/{len(order)}")
+                ctx.check_cancelled()
+
+    def improve(self, deadline: float, ctx: Optional[JobContext] = None) -> int:
+        """局部搜索：把有冲突的课次移到代价更低的时间段，返回移动次数"""
+        moves = 0
+        passes = 0
+        while time.monotonic() < deadline:
+            passes += 1
+            candidates = sorted(
+                (
+                    (self.conflict[c][slot], c, slot)
+                    for c in range(len(self.problem.courses))
+                    if c not in self.unassigned
+                    for slot, _ in self.assigned[c]
+                    if self.conflict[c][slot] > 0
+                ),
+                reverse=True
+            )
+            improved = False
+            for _, c, slot in candidates:
+                if time.monotonic() >= deadline:
+                    break
+                i = next((k for k, (s, _) in enumerate(self.assigned[c]) if s == slot), None)
+                if i is None:
+                    continue
+                old_room = self.assigned[c][i][1]
+                self.remove(c, i)
+                old_cost = self.cost(c, slot)
+                best = self.best_slot(c)
+                if best is not None and best != slot and self.cost(c, best) < old_cost and self.place(c, best):
+                    moves += 1
+                    improved = True
+                else:
+                    # 放回原教室
+                    self.free_rooms[slot].remove((self.room_capacity[old_room], old_room))
+                    self._restore(c, slot, old_room)
+            if ctx:
+                ctx.update(
+                    progress=min(0.95, 0.5 + 0.05 * passes),
+                    message=f"局部搜索第 {passes} 轮，累计调整 {moves} 次，冲突 {self.total_conflict()}"
+                )
+                ctx.check_cancelled()
+            if not improved:
+                break
+        return moves
+
+    def _restore(self, c: int, slot: int, room: str):
+        course = self.problem.courses[c]
+        self.assigned[c].append((slot, room))
+        if course["teacher_id"] is not None:
+            self.teacher_busy.setdefault(course["teacher_id"], set()).add(slot)
+        for neighbor, weight in self.problem.neighbors[c]:
+            self.conflict[neighbor][slot] += weight
+
+    def total_conflict(self) -> int:
+        return sum(self.conflict[c][slot] for c in range(len(self.assigned)) for slot, _ in self.assigned[c]) // 2
+
+
+def current_conflict_weight(problem: SchedulingProblem) -> int:
+    """当前安排下的冲突代价：有共同学生的两门课程每有一对课次时间重叠，计一次共同学生数（与求解代价口径一致）"""
+    total = 0
+    for c, neighbors in enumerate(problem.neighbors):
+        mine = problem.courses[c]["current"]
+        for n, weight in neighbors:
+            if n > c:
+                total += weight * sum(1 for a in mine for b in problem.courses[n]["current"] if a.overlaps(b))
+    return total
+
+
+def build_plan(problem: SchedulingProblem, solver: Solver) -> dict:
+    changes, unchanged = [], 0
+    for c, course in enumerate(problem.courses):
+        if c in solver.unassigned:
+            continue
+        meetings = []
+        for slot, room in sorted(solver.assigned[c]):
+            start, end = problem.period_of(slot)
+            meetings.append({
+                "day_of_week": problem.day_of(slot), "start_minute": start, "end_minute": end,
+                "room": room, "week_pattern": WEEK_ALL
+            })
+        before = {(m.day, m.start, m.end, m.room) for m in course["current"]}
+        after = {(m["day_of_week"], m["start_minute"], m["end_minute"], m["room"]) for m in meetings}
+        if before == after:
+            unchanged += 1
+            continue
+        # 各次课教室相同时作为课程教室，否则取第一次课的教室
+        classroom = meetings[0]["room"]
+        changes.append({
+            "course_id": course["id"],
+            "code": course["code"],
+            "name": course["name"],
+            "updated_at": course["updated_at"],
+            "before": {"schedule": course["schedule"], "classroom": course["classroom"]},
+            "after": {"schedule": format_schedule(meetings, classroom), "classroom": classroom},
+            "meetings": [
+                {**m, "start": format_minutes(m["start_minute"]), "end": format_minutes(m["end_minute"])}
+                for m in meetings
+            ],
+            "time_changed": {(d, s, e) for d, s, e, _ in before} != {(d, s, e) for d, s, e, _ in after},
+            "room_changed": {r for *_, r in before} != {r for *_, r in after}
+        })
+    return {"changes": changes, "unchanged": unchanged}
+
+
+@register_job(JOB_TYPE)
+def solve_schedule(ctx: JobContext):
+    started = time.monotonic()
+    payload = ctx.payload
+    time_limit = float(payload.get("time_limit") or DEFAULT_TIME_LIMIT_SECONDS)
+    db = SessionLocal()
+    try:
+        ctx.update(progress=0.0, message="加载课程、教室和选课数据", force=True)
+        problem = load_problem(db, payload, ctx)
+    finally:
+        db.close()
+    if not problem.rooms:
+        raise ValueError("没有可用的教室，请先在 /admin/rooms 中添加教室")
+
+    stability_weight = float(payload.get("stability_weight", DEFAULT_STABILITY_WEIGHT))
+    pinned: Dict[int, str] = {}
+    for _ in range(MAX_CONSTRUCT_ROUNDS):
+        solver = Solver(problem, stability_weight)
+        solver.pin(pinned)
+        solver.construct(ctx)
+        if len(solver.unassigned) == len(pinned):
+            break
+        # 本轮新出现的未排满课程固定原安排后重新排课，其他课程不再占用它们的教室和教师时间
+        pinned = dict(solver.unassigned)
+    constructed_conflict = solver.total_conflict()
+    moves = solver.improve(started + time_limit, ctx)
+
+    plan = build_plan(problem, solver)
+    changes = plan["changes"]
+    summary = {
+        "courses": len(problem.courses),
+        "rooms": len(problem.rooms),
+        "slots": problem.slot_count,
+        "assigned": len(problem.courses) - len(solver.unassigned),
+        "unassigned": len(solver.unassigned),
+        "changed_courses": len(changes),
+        "unchanged_courses": plan["unchanged"],
+        "time_changes": sum(1 for change in changes if change["time_changed"]),
+        "room_changes": sum(1 for change in changes if change["room_changed"]),
+        "student_conflicts_before": current_conflict_weight(problem),
+        "student_conflicts_after_construct": constructed_conflict,
+        "student_conflicts_after": solver.total_conflict(),
+        "local_search_moves": moves,
+        "elapsed_seconds": round(time.monotonic() - started, 2)
+    }
+    return {
+        "summary": summary,
+        "settings": {
+            "days": problem.days,
+            "periods": [f"{format_minutes(s)}-{format_minutes(e)}" for s, e in problem.periods],
+            "stability_weight": solver.stability_weight,
+            "time_limit": time_limit
+        },
+        # 这些课程保持原安排不变，需要手动调整
+        "unassigned": [
+            {
+                "course_id": problem.courses[c]["id"],
+                "code": problem.courses[c]["code"],
+                "reason": reason,
+                "schedule": problem.courses[c]["schedule"],
+                "classroom": problem.courses[c]["classroom"],
+                "kept_meetings": len(solver.assigned[c]),
+                "required_meetings": problem.courses[c]["meetings"]
+            }
+            for c, reason in solver.unassigned.items()
+        ],
+        "changes": changes[:MAX_CHANGES_IN_RESULT],
+        "changes_truncated": len(changes) > MAX_CHANGES_IN_RESULT,
+        "applied_at": None
+    }
+
+
+def enqueue_solve(db: Session, payload: dict, created_by: int) -> Job:
+    return enqueue(db, JOB_TYPE, payload, created_by=created_by)
+
+
+def plan_clashes(db: Session, changes: List[dict]) -> List[dict]:
+    """
+    方案引入的教室、教师时间重叠：方案中的课次与未修改课程（含未能排课、保持原安排的课程）的现有课次、
+    以及方案课次之间比较；课程原安排就已与同一课程在同一教室或教师上重叠的不算（不是方案造成的）
+    """
+    changed_ids = {change["course_id"] for change in changes}
+    teachers = dict(db.query(Course.id, Course.teacher_id).filter(Course.is_active == True).all())
+    current = IntervalIndex()
+    index = IntervalIndex()
+
+    def keys(slot: MeetingSlot):
+        result = []
+        if slot.room:
+            result.append(("room", slot.room))
+        if teachers.get(slot.course_id) is not None:
+            result.append(("teacher", teachers[slot.course_id]))
+        return result
+
+    current_slots: Dict[int, List[MeetingSlot]] = {}
+    for meeting in db.query(CourseMeeting).join(Course, CourseMeeting.course_id == Course.id).filter(
+        Course.is_active == True
+    ):
+        slot = slot_from_meeting(meeting)
+        for key in keys(slot):
+            current.add(key, slot)
+            if meeting.course_id not in changed_ids:
+                index.add(key, slot)
+        if meeting.course_id in changed_ids:
+            current_slots.setdefault(meeting.course_id, []).append(slot)
+
+    clashes = []
+    for change in changes:
+        existing = {
+            (key, other.course_id)
+            for slot in current_slots.get(change["course_id"], [])
+            for key in keys(slot)
+            for other in current.overlapping(key, slot, exclude_course_id=slot.course_id)
+        }
+        for meeting in change["meetings"]:
+            slot = MeetingSlot(
+                change["course_id"], meeting["day_of_week"], meeting["start_minute"], meeting["end_minute"],
+                meeting["room"], meeting["week_pattern"]
+            )
+            for kind, value in keys(slot):
+                for other in index.overlapping((kind, value), slot, exclude_course_id=slot.course_id):
+                    if ((kind, value), other.course_id) in existing:
+                        continue
+                    clashes.append({"course_id": slot.course_id, "other_course_id": other.course_id, kind: value,
+                                    "day_of_week": slot.day, "start": format_minutes(slot.start)})
+            for key in keys(slot):
+                index.add(key, slot)
+    return clashes
+
+
+def apply_plan(db: Session, job: Job, applied_by: int) -> dict:
+    """
+    把求解结果写回课程（时间文本、教室和时间段）；已应用、课程已被修改或写回后教室、教师时间重叠时
+    抛出 PlanConflictError
+    """
+    result = json.loads(job.result or "{}")
+    if job.job_type != JOB_TYPE or job.status != "completed":
+        raise PlanConflictError("Only completed scheduling jobs can be applied")
+    if result.get("applied_at"):
+        raise PlanConflictError(f"Plan already applied at {result['applied_at']}")
+    if result.get("changes_truncated"):
+        raise PlanConflictError("Plan is too large to apply from the stored preview")
+
+    changes = result.get("changes", [])
+    course_ids = [change["course_id"] for change in changes]
+    current = {}
+    for values in chunked(course_ids):
+        for course_id, updated_at, is_active, version in db.query(
+            Course.id, Course.updated_at, Course.is_active, Course.version
+        ).filter(Course.id.in_(values)):
+            current[course_id] = (updated_at.isoformat() if updated_at else None, is_active, version)
+    stale = [
+        change["course_id"] for change in changes
+        if current.get(change["course_id"], (None, None, None))[:2] != (change["updated_at"], True)
+    ]
+    if stale:
+        raise PlanConflictError(
+            f"{len(stale)} courses changed after the plan was computed, please solve again: {stale[:20]}"
+        )
+
+    clashes = plan_clashes(db, changes)
+    if clashes:
+        raise PlanConflictError(
+            f"{len(clashes)} meetings would overlap existing room or teacher bookings, please solve again: {clashes[:20]}"
+        )
+
+    now = datetime.utcnow()
+    # 带上读取到的版本号，写入前被修改的课程会使整个应用失败
+    try:
+        db.bulk_update_mappings(Course, [
+            {
+                "id": change["course_id"],
+                "schedule": change["after"]["schedule"],
+                "classroom": change["after"]["classroom"],
+                "updated_at": now,
+                "version": current[change["course_id"]][2]
+            }
+            for change in changes
+        ])
+    except StaleDataError:
+        db.rollback()
+        raise PlanConflictError("Courses were modified while the plan was being applied, please solve again")
+    for values in chunked(course_ids):
+        db.query(CourseMeeting).filter(CourseMeeting.course_id.in_(values)).delete(synchronize_session=False)
+    db.bulk_insert_mappings(CourseMeeting, [
+        {
+            "course_id": change["course_id"],
+            **{key: meeting[key] for key in ("day_of_week", "start_minute", "end_minute", "room", "week_pattern")}
+        }
+        for change in changes
+        for meeting in change["meetings"]
+    ])
+
+    result["applied_at"] = now.isoformat()
+    result["applied_by"] = applied_by
+    job.result = json.dumps(result, ensure_ascii=False, default=str)
+    db.add(SystemLog(
+        user_id=applied_by,
+        action=f"应用排课方案: 任务 {job.id}，修改 {len(changes)} 门课程",
+        resource_type="job",
+        resource_id=str(job.id),
+        status="success"
+    ))
+    db.commit()
+    return {"job_id": job.id, "applied_courses": len(changes), "applied_at": result["applied_at"]}
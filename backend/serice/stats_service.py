@@ -0,0 +1,254 @@
+"""
+管理员仪表板统计快照
+
+统计数据在后台定时计算一次并保存在内存快照中，仪表板请求直接读取快照。
+相关表（用户、学生、教师、课程、日志、通知）有写入并提交后，快照被标记为过期，
+后台任务会在下一个检查周期内重新计算。
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, distinct, event, func, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal
+from models import User, UserRole, Student, Teacher, Course, SystemLog, Notice
+from routers.auth import LOGIN_FAILED_ACTION
+
+# 快照最长有效期（秒），过期后即使没有写入也会重新计算
+STATS_MAX_AGE_SECONDS = 60
+# 后台任务检查快照是否需要刷新的间隔（秒），同时也是两次刷新之间的最小间隔
+STATS_POLL_SECONDS = 5
+
+WATCHED_TABLES = frozenset(
+    model.__tablename__ for model in (User, Student, Teacher, Course, SystemLog, Notice)
+)
+
+
+def _growth_months(now: datetime):
+    months = []
+    for i in range(6):
+        month_date = now - timedelta(days=30 * i)
+        months.insert(0, month_date.strftime('%Y-%m'))
+    return months
+
+
+def compute_dashboard_stats(db: Session) -> dict:
+    """一次性计算仪表板所需的全部统计数据"""
+    now = datetime.now()
+
+    # 各项总数合并为一条查询
+    totals = db.query(
+        func.count(User.id),
+        func.count(case((User.is_active == True, 1))),
+        select(func.count(Student.id)).scalar_subquery(),
+        select(func.count(Teacher.id)).scalar_subquery(),
+        select(func.count(Course.id)).where(Course.is_active == True).scalar_subquery(),
+        select(func.count(distinct(Teacher.department))).scalar_subquery()
+    ).select_from(User).one()
+    total_users, active_users, total_students, total_teachers, total_courses, total_departments = totals
+
+    # 最近活动日志，与用户一起查询
+    recent_activities = db.query(SystemLog, User).outerjoin(
+        User, SystemLog.user_id == User.id
+    ).order_by(SystemLog.created_at.desc()).limit(10).all()
+
+    activities = []
+    for activity, user in recent_activities:
+        activities.append({
+            "id": activity.id,
+            "user": user.full_name if user else "系统",
+            "action": activity.action,
+            "time": activity.created_at.strftime("%Y-%m-%d %H:%M"),
+            "role": user.role.value if user else "系统",
+            "status": activity.status
+        })
+
+    # 用户增长趋势（最近6个月），学生和教师在同一个 GROUP BY 中统计
+    six_months_ago = now - timedelta(days=180)
+    growth_rows = db.query(
+        func.strftime('%Y-%m', User.created_at).label('month'),
+        func.count(case((User.role == UserRole.STUDENT, Student.id))).label('students'),
+        func.count(case((User.role == UserRole.TEACHER, Teacher.id))).label('teachers')
+    ).select_from(User).outerjoin(
+        Student, Student.user_id == User.id
+    ).outerjoin(
+        Teacher, Teacher.user_id == User.id
+    ).filter(
+        User.created_at >= six_months_ago,
+        User.role.in_([UserRole.STUDENT, UserRole.TEACHER])
+    ).group_by('month').all()
+    growth_by_month = {row.month: row for row in growth_rows}
+
+    months = _growth_months(now)
+    user_growth_data = []
+    for month in months:
+        row = growth_by_month.get(month)
+        user_growth_data.append({
+            "month": month,
+            "students": row.students if row else 0,
+            "teachers": row.teachers if row else 0
+        })
+
+    # 系统通知
+    notices = db.query(Notice).filter(
+        Notice.is_active == True
+    ).order_by(Notice.created_at.desc()).limit(5).all()
+
+    notice_list = []
+    for notice in notices:
+        notice_list.append({
+            "id": notice.id,
+            "title": notice.title,
+            "date": notice.created_at.strftime("%Y-%m-%d"),
+            "urgent": notice.priority == 'urgent'
+        })
+
+    # 安全相关日志：最近1小时登录失败次数，最近24小时其他失败/警告操作次数
+    utc_now = datetime.utcnow()
+    one_hour_ago = utc_now - timedelta(hours=1)
+    failed_logins, abnormal_operations = db.query(
+        func.count(case((and_(
+            SystemLog.action == LOGIN_FAILED_ACTION,
+            SystemLog.created_at >= one_hour_ago
+        ), 1))),
+        func.count(case((and_(
+            SystemLog.action != LOGIN_FAILED_ACTION,
+            SystemLog.status.in_(["failed", "warning"])
+        ), 1)))
+    ).filter(SystemLog.created_at >= utc_now - timedelta(hours=24)).one()
+
+    active_rate = (active_users / total_users * 100) if total_users > 0 else 0
+    last_month = user_growth_data[-2]
+
+    return {
+        "system_stats": {
+            "total_users": total_users,
+            "active_users": active_users,
+            "total_students": total_students,
+            "total_teachers": total_teachers,
+            "total_courses": total_courses,
+            "total_departments": total_departments
+        },
+        "recent_activities": activities,
+        "user_growth_data": user_growth_data,
+        "notices": notice_list,
+        "security": {
+            "failed_logins_1h": failed_logins,
+            "abnormal_operations_24h": abnormal_operations
+        },
+        "calculated_stats": {
+            "active_rate": round(active_rate, 1),
+            "recent_new_students": last_month["students"],
+            "recent_new_teachers": last_month["teachers"]
+        },
+        "computed_at": utc_now.isoformat()
+    }
+
+
+class DashboardStatsService:
+    def __init__(self, max_age: float = STATS_MAX_AGE_SECONDS, poll_interval: float = STATS_POLL_SECONDS):
+        self.max_age = max_age
+        self.poll_interval = poll_interval
+        self._snapshot = None
+        self._computed_at = 0.0
+        self._stale = True
+        self._lock = threading.Lock()
+        self._task = None
+
+    def mark_stale(self):
+        self._stale = True
+
+    def refresh(self) -> dict:
+        # 先清除标记，计算期间发生的写入会再次标记过期
+        self._stale = False
+        with self._lock:
+            db = SessionLocal()
+            try:
+                snapshot = compute_dashboard_stats(db)
+            except Exception:
+                self._stale = True
+                raise
+            finally:
+                db.close()
+            self._snapshot = snapshot
+            self._computed_at = time.monotonic()
+            return snapshot
+
+    def needs_refresh(self) -> bool:
+        if self._snapshot is None:
+            return True
+        age = time.monotonic() - self._computed_at
+        return age >= self.max_age or (self._stale and age >= self.poll_interval)
+
+    async def get_snapshot(self) -> dict:
+        """返回当前快照，仅在尚未计算过时同步计算一次"""
+        if self._snapshot is None:
+            return await run_in_threadpool(self.refresh)
+        return self._snapshot
+
+    async def _run(self):
+        while True:
+            try:
+                if self.needs_refresh():
+                    await run_in_threadpool(self.refresh)
+            except Exception as e:
+                print(f"刷新仪表板统计失败: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+dashboard_stats = DashboardStatsService()
+
+
+# ---- 写入事件：相关表提交后标记快照过期 ----
+
+def _touches_watched_tables(tables) -> bool:
+    return any(table in WATCHED_TABLES for table in tables)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    tables = {
+        obj.__table__.name
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if hasattr(obj, "__table__")
+    }
+    if _touches_watched_tables(tables):
+        session.info["dashboard_stats_dirty"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_write(orm_execute_state):
+    # query.update() / insert() 等批量语句不经过 flush
+    if orm_execute_state.is_update or orm_execute_state.is_insert or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None and table.name in WATCHED_TABLES:
+            orm_execute_state.session.info["dashboard_stats_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_stale_on_commit(session):
+    if session.info.pop("dashboard_stats_dirty", False):
+        dashboard_stats.mark_stale()
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_on_rollback(session):
+    session.info.pop("dashboard_stats_dirty", None)
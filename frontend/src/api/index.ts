@@ -39,12 +39,54 @@ apiClient.interceptors.request.use(
   }
 )
 
+// 刷新访问令牌，多个并发的401请求共用同一次刷新
+let refreshPromise: Promise<string | null> | null = null
+
+const refreshAccessToken = (): Promise<string | null> => {
+  const refreshToken = localStorage.getItem('refresh_token')
+  if (!refreshToken) {
+    return Promise.resolve(null)
+  }
+  if (!refreshPromise) {
+    refreshPromise = axios
+      .post(`${apiClient.defaults.baseURL}/auth/refresh`, { refresh_token: refreshToken })
+      .then((response) => {
+        localStorage.setItem('access_token', response.data.access_token)
+        localStorage.setItem('refresh_token', response.data.refresh_token)
+        return response.data.access_token as string
+      })
+      .catch(() => null)
+      .finally(() => {
+        refreshPromise = null
+      })
+  }
+  return refreshPromise
+}
+
 // 响应拦截器 - 处理错误和统一响应格式
 apiClient.interceptors.response.use(
   (response: AxiosResponse<ApiResponse>) => {
     return response
   },
-  (error) => {
+  async (error) => {
+    const originalRequest = error.config as (InternalAxiosRequestConfig & { _retried?: boolean }) | undefined
+
+    // 访问令牌过期时先尝试刷新，成功后重发原请求
+    if (
+      error.response?.status === 401 &&
+      originalRequest &&
+      !originalRequest._retried &&
+      !originalRequest.url?.startsWith('/auth/login') &&
+      !originalRequest.url?.startsWith('/auth/refresh')
+    ) {
+      originalRequest._retried = true
+      const newToken = await refreshAccessToken()
+      if (newToken) {
+        originalRequest.headers['Authorization'] = `Bearer ${newToken}`
+        return apiClient(originalRequest)
+      }
+    }
+
     const apiError: ApiError = {
       message: error.response?.data?.detail || error.message || '请求失败',
       status: error.response?.status,
@@ -54,6 +96,7 @@ apiClient.interceptors.response.use(
     // 处理401未授权错误
     if (error.response?.status === 401) {
       localStorage.removeItem('access_token')
+      localStorage.removeItem('refresh_token')
       localStorage.removeItem('user_info')
       window.location.href = '/login'
     }
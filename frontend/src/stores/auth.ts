@@ -1,6 +1,6 @@
 import { defineStore } from 'pinia'
 import { ref, computed } from 'vue'
-import { login as apiLogin, getCurrentUser, type UserInfo as ApiUserInfo, type LoginResponse } from '../api/auth'
+import { login as apiLogin, logout as apiLogout, getCurrentUser, type UserInfo as ApiUserInfo, type LoginResponse } from '../api/auth'
 
 export interface UserInfo {
   studentId?: string
@@ -120,6 +120,7 @@ export const useAuthStore = defineStore('auth', () => {
 
       // 保存token
       localStorage.setItem('access_token', response.access_token)
+      localStorage.setItem('refresh_token', response.refresh_token)
 
       // 根据角色设置用户信息
       const apiUser = response.user
@@ -172,8 +173,15 @@ export const useAuthStore = defineStore('auth', () => {
     userInfo.value = null
     isAuthenticated.value = false
 
+    // 注销服务端会话
+    const refreshToken = localStorage.getItem('refresh_token')
+    if (refreshToken) {
+      apiLogout(refreshToken).catch(() => {})
+    }
+
     // 清除localStorage
     localStorage.removeItem('access_token')
+    localStorage.removeItem('refresh_token')
     localStorage.removeItem('userRole')
     localStorage.removeItem('userInfo')
   }